@@ -14,23 +14,25 @@ Funcionalidades implementadas:
 
 APP_VERSION = "#120"
 
-import tkinter as tk
-from tkinter import ttk, messagebox, Toplevel, font, filedialog
-from PIL import Image, ImageTk
+from PIL import Image
 import requests
 from io import BytesIO
 import sqlite3
 import os
 import webbrowser
-from tkcalendar import DateEntry, Calendar
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import json
 import google.generativeai as genai
 from ddgs import DDGS
 from bs4 import BeautifulSoup
+from lxml import etree
 import re
 import threading
+import multiprocessing
+import queue
 import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -42,19 +44,81 @@ import locale
 import shutil
 import glob
 import hashlib
+import socket
+import tracemalloc
+import unicodedata
+import random
+import sys
+import tempfile
+import zipfile
+import contextlib
+import csv
+from xml.sax.saxutils import escape
 import secrets
+import bisect
+import functools
+import types
+from collections import namedtuple
 import pandas as pd
+import numpy as np
 from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.ticker import FuncFormatter
+try:
+    from pypdf import PdfWriter  # Opcional: usado apenas na exportação em lote consolidada (PDF único)
+except ImportError:
+    PdfWriter = None
+try:
+    from openpyxl import Workbook  # Opcional: exportação de planilhas .xlsx
+    from openpyxl.cell import WriteOnlyCell
+except ImportError:
+    Workbook = None
+try:
+    import pyarrow as pa  # Opcional: exportação de planilhas .parquet
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 
 
 # --- 1. CONFIGURAÇÕES GERAIS ---
-LAST_FETCH_FILE = 'last_fetch.log'
 FETCH_INTERVAL_HOURS = 4
+NEWS_SCHEDULE_JITTER = 0.1         # Variação aleatória (±10%) do intervalo entre buscas, para instâncias não coincidirem
+NEWS_RETRY_MINUTES = 20            # Espera após uma busca que falhou
+NEWS_LEASE_SECONDS = 300           # Validade da reserva de execução; renovada enquanto a busca roda
+NEWS_FETCH_WORKERS = 8          # Downloads simultâneos de artigos
+NEWS_FETCH_PER_HOST = 2         # Downloads simultâneos por domínio
+NEWS_FETCH_DEADLINE_SECONDS = 90  # Prazo total da etapa de download
+NEWS_CACHE_DIR = 'news_cache'
+NEWS_CACHE_MAX_BYTES = 200 * 1024 * 1024
+NEWS_PAGE_MAX_BYTES = 2 * 1024 * 1024   # Limite de leitura de cada página de notícia
+NEWS_PAGE_CHUNK_BYTES = 16 * 1024
+NEWS_CACHE_FRESH_HOURS = 24  # Dentro deste prazo a página em cache é usada sem revalidar
+GEMINI_MODEL_NAME = 'gemini-flash-latest'
+NEWS_SUMMARY_ARTICLE_CHARS = 10000    # Trecho de cada artigo enviado ao modelo
+NEWS_SUMMARY_BATCH_TOKENS = 12000     # Orçamento aproximado de tokens por chamada de resumo em lote
+# Detecção de notícias quase duplicadas (MinHash sobre título + lead)
+NEWS_MINHASH_PERMUTATIONS = 64
+NEWS_MINHASH_BAND_ROWS = 4            # 16 faixas de 4 linhas para a busca de candidatos (LSH)
+NEWS_DUPLICATE_SIMILARITY = 0.6       # Similaridade de Jaccard estimada a partir da qual duas notícias são a mesma
+NEWS_LEAD_WORDS = 40
+# Validade (horas) dos resultados do modelo guardados em crm_llm_cache, por tipo
+LLM_CACHE_TTL_HOURS = {'relevance': 24 * 30, 'summary': 24 * 90}
+# Limites de requisições por serviço externo: (requisições por minuto, rajada)
+NEWS_RATE_LIMITS = {
+    'ddgs': (20, 2),
+    'gemini': (12, 2),
+    'host': (30, 3),
+}
+DETAIL_CARDS_PAGE_SIZE = 20
+NEWS_FEED_PAGE_SIZE = 10         # Notícias carregadas por vez no Menu Principal
+NEWS_FEED_MAX_CARDS = 60         # Máximo de cards mantidos na tela; os da ponta oposta à rolagem são descartados
 DB_NAME = 'dolp_crm_final.db'
 LOGO_PATH = "dolp_logo.png"
+PDF_RENDER_WORKERS = 2           # Processos dedicados à geração de PDFs
+BATCH_MERGED_MAX_DOCUMENTS = 300  # Limite do PDF único no lote (montado em memória); acima disso, use o ZIP
+REPORT_POLL_MS = 150             # Intervalo de verificação dos PDFs em geração
+INTERACTIONS_EXPORT_PAGE_SIZE = 200  # Interações lidas por vez nas exportações (e linhas por tabela no PDF)
+EXPORT_PAGE_SIZE = 1000          # Linhas lidas do banco por vez na exportação de planilhas
 LOGO_URL = "https://mcusercontent.com/cfa43b95eeae85d65cf1366fb/images/a68e98a6-1595-5add-0b79-2e541e7faefa.png"
 
 DOLP_COLORS = {
@@ -79,6 +143,22 @@ ESTAGIOS_PIPELINE_DOLP = [
     "Histórico",
     "Cancelada"
 ]
+CONTRACT_EXECUTION_STAGE = "Execução do Contrato"  # Estágio dos contratos ativos (carteira)
+
+# Previsão de receita do funil: probabilidade de ganho configurada por estágio (oportunidades ainda em aberto)
+STAGE_WIN_PROBABILITIES = {
+    "Clientes e Segmentos definidos (Playbook)": 0.05,
+    "Oportunidades": 0.10,
+    "Avaliação (Dolp)": 0.15,
+    "Qualificação (Cliente)": 0.25,
+    "Proposta Técnica": 0.40,
+    "Proposta Comercial": 0.55,
+    "Negociação": 0.70,
+    "Avaliação do Contrato": 0.85,
+}
+FORECAST_HORIZON_MONTHS = 24          # Meses projetados a partir do mês atual
+FORECAST_DEFAULT_DURATION_MONTHS = 12  # Duração assumida quando a oportunidade não informa o prazo do contrato
+FORECAST_MIN_SAMPLES = 5               # Oportunidades encerradas necessárias para usar a probabilidade aprendida de um estágio
 BRAZILIAN_STATES = ["GO", "TO", "MT", "DF", "AC", "AL", "AP", "AM", "BA", "CE", "ES", "MA", "MS", "MG", "PA", "PB", "PR", "PE", "PI", "RJ", "RN", "RS", "RO", "RR", "SC", "SP", "SE"]
 SERVICE_TYPES = ["Linha Viva Cesto Duplo", "Linha Viva Cesto Simples", "Linha Morta Pesada 7 Elementos", "STC", "Plantão", "Perdas", "Motocicleta", "Atendimento Emergencial", "Novas Ligações", "Corte e Religação", "Subestações", "Grupos Geradores"]
 INITIAL_SETORES = sorted(list(set(["Distribuição", "Geração", "Transmissão", "Comercialização", "Industrial", "Corporativo", "Energia Elétrica", "Infraestrutura"])))
@@ -111,6 +191,16 @@ QUALIFICATION_CHECKLIST = {
 }
 
 # --- 2. FUNÇÕES UTILITÁRIAS ---
+def load_gui_modules():
+    """Importa os módulos da interface (Tk) como globais do módulo. Só a interface gráfica os carrega: a CLI de
+    relatórios e os processos de geração de PDF rodam sem tkinter (ex.: servidor sem display)."""
+    global tk, ttk, messagebox, Toplevel, font, filedialog, ImageTk, DateEntry, Calendar, FigureCanvasTkAgg
+    import tkinter as tk
+    from tkinter import ttk, messagebox, Toplevel, font, filedialog
+    from PIL import ImageTk
+    from tkcalendar import DateEntry, Calendar
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
 def load_logo_image(size=(200, 75)):
     try:
         if os.path.exists(LOGO_PATH):
@@ -209,6 +299,15 @@ def backup_database(db_name):
     except Exception as e:
         print(f"Erro ao gerenciar backups antigos: {e}")
 
+def parse_empresa_referencia_string(ref_string):
+    """Separa 'Nome - UF - Serviço' em (nome_empresa, estado, tipo_servico); o nome pode conter ' - '."""
+    if not ref_string:
+        return None
+    parts = ref_string.split(' - ')
+    if len(parts) < 3:
+        return None
+    return " - ".join(parts[:-2]), parts[-2], parts[-1]
+
 def hash_password(password):
     """Gera um hash seguro para a senha com um salt."""
     salt = secrets.token_hex(16)
@@ -224,10 +323,11 @@ def verify_password(stored_password, provided_password):
 
 # --- 3. GERENCIADOR DE BANCO DE DADOS ---
 class DatabaseManager:
-    def __init__(self, db_name):
+    def __init__(self, db_name, initialize=True):
         self.db_name = db_name
-        self._initialize_database()
-        self._run_migrations()
+        if initialize:  # Processos auxiliares (ex.: geração de PDFs) abrem um banco já inicializado
+            self._initialize_database()
+            self._run_migrations()
 
     def _connect(self):
         conn = sqlite3.connect(self.db_name)
@@ -383,6 +483,58 @@ class DatabaseManager:
                                 saved INTEGER DEFAULT 0
                            )''')
 
+            # Assinaturas das notícias para detecção de duplicatas (URL canônica + MinHash e suas faixas LSH)
+            cursor.execute('''CREATE TABLE IF NOT EXISTS crm_news_signatures (
+                                news_id INTEGER PRIMARY KEY,
+                                canonical_url TEXT NOT NULL,
+                                minhash TEXT NOT NULL,
+                                FOREIGN KEY (news_id) REFERENCES crm_news(id) ON DELETE CASCADE
+                           )''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_news_signatures_url ON crm_news_signatures(canonical_url)")
+            cursor.execute('''CREATE TABLE IF NOT EXISTS crm_news_signature_bands (
+                                band INTEGER NOT NULL,
+                                bucket INTEGER NOT NULL,
+                                news_id INTEGER NOT NULL,
+                                FOREIGN KEY (news_id) REFERENCES crm_news(id) ON DELETE CASCADE
+                           )''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_news_signature_bands ON crm_news_signature_bands(band, bucket)")
+
+            # Reservas (leases) para que apenas uma instância do aplicativo execute uma tarefa periódica
+            cursor.execute('''CREATE TABLE IF NOT EXISTS crm_scheduler_leases (
+                                name TEXT PRIMARY KEY,
+                                owner TEXT NOT NULL,
+                                expires_at TEXT NOT NULL
+                           )''')
+
+            # Histórico das buscas de notícias, com o checkpoint da última etapa concluída
+            cursor.execute('''CREATE TABLE IF NOT EXISTS crm_news_runs (
+                                id INTEGER PRIMARY KEY,
+                                owner TEXT,
+                                started_at TEXT NOT NULL,
+                                finished_at TEXT,
+                                status TEXT NOT NULL,
+                                stage TEXT,
+                                checkpoint TEXT,
+                                duration_seconds REAL,
+                                items_found INTEGER,
+                                items_unique INTEGER,
+                                items_relevant INTEGER,
+                                items_fetched INTEGER,
+                                items_stored INTEGER,
+                                resumed_from INTEGER,
+                                error TEXT
+                           )''')
+
+            # Cache de resultados do modelo de linguagem (relevância e resumos), por hash do conteúdo
+            cursor.execute('''CREATE TABLE IF NOT EXISTS crm_llm_cache (
+                                cache_key TEXT NOT NULL,
+                                kind TEXT NOT NULL,
+                                model TEXT NOT NULL,
+                                result TEXT,
+                                created_at TEXT NOT NULL,
+                                PRIMARY KEY (cache_key, kind, model)
+                           )''')
+
             # Tabela para Eventos (Notificações, Glosas, Desvios)
             cursor.execute('''CREATE TABLE IF NOT EXISTS crm_events (
                                 id INTEGER PRIMARY KEY,
@@ -429,6 +581,42 @@ class DatabaseManager:
                                 observacoes TEXT,
                                 FOREIGN KEY (oportunidade_id) REFERENCES oportunidades(id) ON DELETE CASCADE
                            )''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_termos_aditivos_oportunidade ON crm_termos_aditivos(oportunidade_id)")
+
+            # Resumo dos termos aditivos por oportunidade, mantido a cada gravação de termo (ver _refresh_aditivos_resumo)
+            cursor.execute('''CREATE TABLE IF NOT EXISTS crm_aditivos_resumo (
+                                oportunidade_id INTEGER PRIMARY KEY,
+                                quantidade INTEGER NOT NULL DEFAULT 0,
+                                valor_global REAL NOT NULL DEFAULT 0,
+                                valor_mensal REAL NOT NULL DEFAULT 0,
+                                prazo_meses INTEGER NOT NULL DEFAULT 0,
+                                data_fim TEXT,
+                                FOREIGN KEY (oportunidade_id) REFERENCES oportunidades(id) ON DELETE CASCADE
+                           )''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_oportunidades_estagio ON oportunidades(estagio_id)")
+
+            # Mudanças de estágio estruturadas; interacao_id liga à interação 'Movimentação' de mesmo conteúdo
+            cursor.execute('''CREATE TABLE IF NOT EXISTS crm_stage_transitions (
+                                id INTEGER PRIMARY KEY,
+                                oportunidade_id INTEGER NOT NULL,
+                                estagio_origem TEXT,
+                                estagio_destino TEXT NOT NULL,
+                                resultado TEXT,
+                                data_transicao TEXT NOT NULL,
+                                usuario TEXT,
+                                interacao_id INTEGER UNIQUE,
+                                FOREIGN KEY (oportunidade_id) REFERENCES oportunidades(id) ON DELETE CASCADE,
+                                FOREIGN KEY (interacao_id) REFERENCES crm_interacoes(id) ON DELETE SET NULL
+                           )''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_stage_transitions_oportunidade ON crm_stage_transitions(oportunidade_id, data_transicao)")
+
+            # Versão dos dados do funil, incrementada por triggers a cada alteração (chave dos caches de previsão)
+            cursor.execute("CREATE TABLE IF NOT EXISTS crm_data_versions (nome TEXT PRIMARY KEY, versao INTEGER NOT NULL DEFAULT 0)")
+            cursor.execute("INSERT OR IGNORE INTO crm_data_versions (nome, versao) VALUES ('pipeline', 0)")
+            for table in ('oportunidades', 'crm_stage_transitions', 'pipeline_estagios'):
+                for event in ('INSERT', 'UPDATE', 'DELETE'):
+                    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_pipeline_version_{table}_{event.lower()} AFTER {event} ON {table}
+                                       BEGIN UPDATE crm_data_versions SET versao = versao + 1 WHERE nome = 'pipeline'; END""")
 
             self._populate_initial_data(cursor)
 
@@ -532,12 +720,28 @@ class DatabaseManager:
             if 'contato_nome' not in interacao_columns:
                 cursor.execute("ALTER TABLE crm_interacoes ADD COLUMN contato_nome TEXT")
 
+            # Movimentações registradas só como texto (bancos antigos) viram transições de estágio, uma única vez;
+            # depois disso, record_stage_transition e add_interaction gravam a transição junto com a interação
+            if not cursor.execute("SELECT 1 FROM crm_data_versions WHERE nome = 'backfill_transicoes'").fetchone():
+                self._backfill_stage_transitions(conn)
+                cursor.execute("INSERT INTO crm_data_versions (nome, versao) VALUES ('backfill_transicoes', 1)")
+
             # Migração para crm_termos_aditivos
             cursor.execute("PRAGMA table_info(crm_termos_aditivos)")
             termo_columns = [row['name'] for row in cursor.fetchall()]
             if 'valor_aditivo_capa' not in termo_columns:
                 cursor.execute("ALTER TABLE crm_termos_aditivos ADD COLUMN valor_aditivo_capa REAL DEFAULT 0")
 
+            # Bancos anteriores ao resumo de aditivos: calcula o resumo de todos os termos já cadastrados
+            if cursor.execute("SELECT count(*) FROM crm_aditivos_resumo").fetchone()[0] == 0:
+                self._refresh_aditivos_resumo(conn)
+
+            # Migração para crm_news
+            cursor.execute("PRAGMA table_info(crm_news)")
+            news_columns = [row['name'] for row in cursor.fetchall()]
+            if 'alternate_sources' not in news_columns:
+                cursor.execute("ALTER TABLE crm_news ADD COLUMN alternate_sources TEXT")
+
             # Ensure 'Cancelada' stage exists
             cursor.execute("SELECT id FROM pipeline_estagios WHERE nome = 'Cancelada'")
             if not cursor.fetchone():
@@ -737,27 +941,31 @@ class DatabaseManager:
             conn.execute("INSERT INTO crm_logs (timestamp, user_id, action, details) VALUES (?, ?, ?, ?)",
                          (timestamp, user_id, action, details))
 
-    def get_logs(self, start_date=None, end_date=None, user_id=None):
-        """Busca registros de log com filtros opcionais."""
-        with self._connect() as conn:
-            query = "SELECT l.timestamp, u.username, l.action, l.details FROM crm_logs l LEFT JOIN crm_users u ON l.user_id = u.id"
-            conditions = []
-            params = []
+    def _logs_query(self, start_date=None, end_date=None, user_id=None):
+        query = "SELECT l.timestamp, u.username, l.action, l.details FROM crm_logs l LEFT JOIN crm_users u ON l.user_id = u.id"
+        conditions = []
+        params = []
+
+        if start_date:
+            conditions.append("l.timestamp >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("l.timestamp <= ?")
+            params.append(end_date)
+        if user_id:
+            conditions.append("l.user_id = ?")
+            params.append(user_id)
 
-            if start_date:
-                conditions.append("l.timestamp >= ?")
-                params.append(start_date)
-            if end_date:
-                conditions.append("l.timestamp <= ?")
-                params.append(end_date)
-            if user_id:
-                conditions.append("l.user_id = ?")
-                params.append(user_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
 
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY l.id DESC"
+        return query, params
 
-            query += " ORDER BY l.id DESC"
+    def get_logs(self, start_date=None, end_date=None, user_id=None):
+        """Busca registros de log com filtros opcionais."""
+        with self._connect() as conn:
+            query, params = self._logs_query(start_date, end_date, user_id)
             return conn.execute(query, params).fetchall()
 
 
@@ -816,6 +1024,7 @@ class DatabaseManager:
 
     def update_opportunity(self, op_id, data):
         with self._connect() as conn:
+            previous = conn.execute("SELECT o.estagio_id, p.nome FROM oportunidades o JOIN pipeline_estagios p ON o.estagio_id = p.id WHERE o.id = ?", (op_id,)).fetchone()
             query = '''UPDATE oportunidades SET titulo=?, valor=?, cliente_id=?, estagio_id=?,
                         tempo_contrato_meses=?, regional=?, polo=?, quantidade_bases=?, bases_nomes=?, servicos_data=?, empresa_referencia=?,
                         numero_edital=?, data_abertura=?, modalidade=?, contato_principal=?, link_documentos=?,
@@ -832,44 +1041,119 @@ class DatabaseManager:
                       data.get('diferenciais_competitivos'), data.get('principais_riscos'),
                       op_id)
             conn.execute(query, params)
+            # Estágio alterado pelo formulário: registra a transição (sem interação de movimentação)
+            if previous and previous['estagio_id'] != data['estagio_id']:
+                new_stage = conn.execute("SELECT nome FROM pipeline_estagios WHERE id = ?", (data['estagio_id'],)).fetchone()
+                if new_stage:
+                    self._insert_stage_transition(conn, op_id, previous['nome'], new_stage['nome'], "Edição",
+                                                  datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
     def update_opportunity_stage(self, op_id, new_stage_id):
         with self._connect() as conn:
             conn.execute("UPDATE oportunidades SET estagio_id = ? WHERE id = ?", (new_stage_id, op_id))
 
-    def get_historico_oportunidades(self, filters=None):
+    # Transições de estágio
+    def _insert_stage_transition(self, conn, op_id, from_stage, to_stage, result, timestamp, username=None, interacao_id=None):
+        conn.execute("""INSERT INTO crm_stage_transitions
+                        (oportunidade_id, estagio_origem, estagio_destino, resultado, data_transicao, usuario, interacao_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""", (op_id, from_stage, to_stage, result, timestamp, username, interacao_id))
+
+    def record_stage_transition(self, op_id, from_stage, to_stage, result, username):
+        """Grava a movimentação no histórico de interações e a transição estruturada, na mesma transação."""
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         with self._connect() as conn:
-            base_query = "SELECT o.id, o.numero_oportunidade, o.titulo, o.valor, o.data_criacao, c.nome_empresa, p.nome as estagio_nome FROM oportunidades o JOIN clientes c ON o.cliente_id = c.id JOIN pipeline_estagios p ON o.estagio_id = p.id"
-            conditions = []
-            params = []
+            cursor = conn.execute(
+                "INSERT INTO crm_interacoes (oportunidade_id, data_interacao, tipo, resumo, usuario, responsavel_institucional, contato_nome) VALUES (?, ?, ?, ?, ?, 0, '')",
+                (op_id, timestamp, 'Movimentação', f"Movida de '{from_stage}' para '{to_stage}' - Resultado: {result}", username))
+            self._insert_stage_transition(conn, op_id, from_stage, to_stage, result, timestamp, username, cursor.lastrowid)
+
+    def _backfill_stage_transitions(self, conn, interacao_id=None):
+        """Converte em transições as interações 'Movimentação' ainda não ligadas a uma (texto "Movida de 'X' para 'Y' - Resultado: Z").
+        Com interacao_id, converte só essa interação; textos fora do padrão são ignorados."""
+        rows = pd.read_sql_query(f"""
+            SELECT i.id AS interacao_id, i.oportunidade_id, i.data_interacao, i.resumo, i.usuario
+            FROM crm_interacoes i JOIN oportunidades o ON o.id = i.oportunidade_id
+            WHERE i.tipo = 'Movimentação' {'AND i.id = ?' if interacao_id is not None else ''}
+              AND NOT EXISTS (SELECT 1 FROM crm_stage_transitions t WHERE t.interacao_id = i.id)""", conn,
+            params=(interacao_id,) if interacao_id is not None else None)
+        if rows.empty:
+            return 0
+        moves = pd.concat([rows, parse_movement_summaries(rows['resumo']), parse_timestamps(rows['data_interacao']).rename('data_transicao')], axis=1)
+        moves = moves.dropna(subset=['estagio_destino', 'data_transicao'])
+        conn.executemany("""INSERT INTO crm_stage_transitions
+                            (oportunidade_id, estagio_origem, estagio_destino, resultado, data_transicao, usuario, interacao_id)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                         zip(moves['oportunidade_id'].tolist(), moves['estagio_origem'].tolist(), moves['estagio_destino'].tolist(),
+                             moves['resultado'].where(moves['resultado'].notna(), None).tolist(),
+                             moves['data_transicao'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist(),
+                             moves['usuario'].where(moves['usuario'].notna(), None).tolist(), moves['interacao_id'].tolist()))
+        return len(moves)
+
+    def get_stage_transitions(self):
+        with self._connect() as conn:
+            return pd.read_sql_query("""SELECT oportunidade_id, estagio_origem, estagio_destino, resultado, data_transicao
+                                        FROM crm_stage_transitions ORDER BY oportunidade_id, data_transicao, id""", conn)
 
-            if filters:
-                if filters.get('numero_oportunidade'):
-                    conditions.append("o.numero_oportunidade LIKE ?")
-                    params.append(f"%{filters['numero_oportunidade']}%")
-                if filters.get('cliente'):
-                    conditions.append("c.nome_empresa = ?")
-                    params.append(filters['cliente'])
-                if filters.get('estagio'):
-                    conditions.append("p.nome = ?")
-                    params.append(filters['estagio'])
-                if filters.get('valor_min'):
-                    try:
-                        conditions.append("o.valor >= ?")
-                        params.append(float(filters['valor_min']))
-                    except ValueError:
-                        pass
-                if filters.get('periodo'):
-                    days = {'Última semana': 7, 'Último mês': 30, 'Últimos 3 meses': 90, 'Último ano': 365}
-                    if filters['periodo'] in days:
-                        date_limit = datetime.now() - timedelta(days=days[filters['periodo']])
-                        conditions.append("o.data_criacao >= ?")
-                        params.append(date_limit.strftime('%Y-%m-%d'))
+    def get_data_version(self, nome='pipeline'):
+        with self._connect() as conn:
+            row = conn.execute("SELECT versao FROM crm_data_versions WHERE nome = ?", (nome,)).fetchone()
+            return row['versao'] if row else 0
 
-            if conditions:
-                base_query += " WHERE " + " AND ".join(conditions)
+    def get_forecast_opportunities(self):
+        """Oportunidades com os campos usados na previsão de receita (estágio, valor, prazo e data de abertura)."""
+        with self._connect() as conn:
+            return pd.read_sql_query("""SELECT o.id AS oportunidade_id, p.nome AS estagio, o.valor, o.faturamento_estimado,
+                                               o.duracao_contrato, o.tempo_contrato_meses, o.data_abertura
+                                        FROM oportunidades o JOIN pipeline_estagios p ON o.estagio_id = p.id""", conn)
+
+    def get_opportunity_stages(self):
+        """Data de criação e estágio atual de cada oportunidade (ponto de partida da análise de velocidade do funil)."""
+        with self._connect() as conn:
+            return pd.read_sql_query("""SELECT o.id AS oportunidade_id, o.data_criacao, p.nome AS estagio_atual
+                                        FROM oportunidades o JOIN pipeline_estagios p ON o.estagio_id = p.id""", conn)
+
+    def _historico_query(self, filters=None):
+        # Último resultado: texto após 'Resultado:' na movimentação mais recente (mesma regra de get_ultimo_resultado_oportunidade)
+        base_query = """
+            SELECT o.id, o.numero_oportunidade, o.titulo, o.valor, o.data_criacao, c.nome_empresa, p.nome as estagio_nome,
+                   (SELECT CASE WHEN instr(i.resumo, 'Resultado:') > 0 THEN trim(substr(i.resumo, instr(i.resumo, 'Resultado:') + 10)) END
+                    FROM crm_interacoes i WHERE i.oportunidade_id = o.id AND i.tipo = 'Movimentação' ORDER BY i.id DESC LIMIT 1) as ultimo_resultado
+            FROM oportunidades o JOIN clientes c ON o.cliente_id = c.id JOIN pipeline_estagios p ON o.estagio_id = p.id"""
+        conditions = []
+        params = []
+
+        if filters:
+            if filters.get('numero_oportunidade'):
+                conditions.append("o.numero_oportunidade LIKE ?")
+                params.append(f"%{filters['numero_oportunidade']}%")
+            if filters.get('cliente'):
+                conditions.append("c.nome_empresa = ?")
+                params.append(filters['cliente'])
+            if filters.get('estagio'):
+                conditions.append("p.nome = ?")
+                params.append(filters['estagio'])
+            if filters.get('valor_min'):
+                try:
+                    conditions.append("o.valor >= ?")
+                    params.append(float(filters['valor_min']))
+                except ValueError:
+                    conditions.pop()
+            if filters.get('periodo'):
+                days = {'Última semana': 7, 'Último mês': 30, 'Últimos 3 meses': 90, 'Último ano': 365}
+                if filters['periodo'] in days:
+                    date_limit = datetime.now() - timedelta(days=days[filters['periodo']])
+                    conditions.append("o.data_criacao >= ?")
+                    params.append(date_limit.strftime('%Y-%m-%d'))
+
+        if conditions:
+            base_query += " WHERE " + " AND ".join(conditions)
+
+        base_query += " ORDER BY o.data_criacao DESC"
+        return base_query, params
 
-            base_query += " ORDER BY o.data_criacao DESC"
+    def get_historico_oportunidades(self, filters=None):
+        with self._connect() as conn:
+            base_query, params = self._historico_query(filters)
             return conn.execute(base_query, params).fetchall()
 
     def get_ultimo_resultado_oportunidade(self, op_id):
@@ -923,34 +1207,80 @@ class DatabaseManager:
         with self._connect() as conn:
             return [row['tipo'] for row in conn.execute("SELECT DISTINCT tipo FROM crm_interacoes ORDER BY tipo").fetchall()]
 
-    def get_interactions_for_opportunity(self, op_id, tipo=None, start_date_str=None, end_date_str=None):
-        with self._connect() as conn:
-            base_query = "SELECT * FROM crm_interacoes WHERE oportunidade_id = ?"
-            params = [op_id]
+    def _interactions_query(self, select, op_id, tipo=None, start_date_str=None, end_date_str=None):
+        base_query = f"SELECT {select} FROM crm_interacoes WHERE oportunidade_id = ?"
+        params = [op_id]
 
-            if tipo and tipo != 'Todos':
-                base_query += " AND tipo = ?"
-                params.append(tipo)
+        if tipo and tipo != 'Todos':
+            base_query += " AND tipo = ?"
+            params.append(tipo)
 
-            if start_date_str:
-                try:
-                    start_date_obj = datetime.strptime(start_date_str, '%d/%m/%Y')
-                    base_query += " AND substr(data_interacao, 7, 4) || '-' || substr(data_interacao, 4, 2) || '-' || substr(data_interacao, 1, 2) >= ?"
-                    params.append(start_date_obj.strftime('%Y-%m-%d'))
-                except ValueError:
-                    pass
+        if start_date_str:
+            try:
+                start_date_obj = datetime.strptime(start_date_str, '%d/%m/%Y')
+                base_query += " AND substr(data_interacao, 7, 4) || '-' || substr(data_interacao, 4, 2) || '-' || substr(data_interacao, 1, 2) >= ?"
+                params.append(start_date_obj.strftime('%Y-%m-%d'))
+            except ValueError:
+                pass
 
-            if end_date_str:
-                try:
-                    end_date_obj = datetime.strptime(end_date_str, '%d/%m/%Y')
-                    base_query += " AND substr(data_interacao, 7, 4) || '-' || substr(data_interacao, 4, 2) || '-' || substr(data_interacao, 1, 2) <= ?"
-                    params.append(end_date_obj.strftime('%Y-%m-%d'))
-                except ValueError:
-                    pass
+        if end_date_str:
+            try:
+                end_date_obj = datetime.strptime(end_date_str, '%d/%m/%Y')
+                base_query += " AND substr(data_interacao, 7, 4) || '-' || substr(data_interacao, 4, 2) || '-' || substr(data_interacao, 1, 2) <= ?"
+                params.append(end_date_obj.strftime('%Y-%m-%d'))
+            except ValueError:
+                pass
+
+        return base_query, params
 
+    def get_interactions_for_opportunity(self, op_id, tipo=None, start_date_str=None, end_date_str=None):
+        with self._connect() as conn:
+            base_query, params = self._interactions_query("*", op_id, tipo, start_date_str, end_date_str)
             base_query += " ORDER BY substr(data_interacao, 7, 4) DESC, substr(data_interacao, 4, 2) DESC, substr(data_interacao, 1, 2) DESC, substr(data_interacao, 12) DESC"
             return conn.execute(base_query, params).fetchall()
 
+    def count_interactions_for_opportunity(self, op_id, tipo=None, start_date_str=None, end_date_str=None):
+        with self._connect() as conn:
+            base_query, params = self._interactions_query("COUNT(*)", op_id, tipo, start_date_str, end_date_str)
+            return conn.execute(base_query, params).fetchone()[0]
+
+    def _iter_query(self, query, params, page_size):
+        """Resultado da consulta em páginas lidas de um cursor aberto (sem carregar tudo em memória)."""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(query, params)
+            while True:
+                page = cursor.fetchmany(page_size)
+                if not page:
+                    break
+                yield page
+        finally:
+            conn.close()
+
+    def iter_interactions_for_opportunity(self, op_id, tipo=None, start_date_str=None, end_date_str=None, page_size=INTERACTIONS_EXPORT_PAGE_SIZE):
+        """Mesmas interações de get_interactions_for_opportunity, entregues em páginas lidas de um cursor aberto."""
+        base_query, params = self._interactions_query("*", op_id, tipo, start_date_str, end_date_str)
+        base_query += " ORDER BY substr(data_interacao, 7, 4) DESC, substr(data_interacao, 4, 2) DESC, substr(data_interacao, 1, 2) DESC, substr(data_interacao, 12) DESC"
+        return self._iter_query(base_query, params, page_size)
+
+    def iter_dataset(self, name, filters=None, page_size=EXPORT_PAGE_SIZE):
+        """Linhas de uma listagem exportável (ver SPREADSHEET_DATASETS) com os mesmos filtros da tela, em páginas."""
+        filters = filters or {}
+        if name == 'historico':
+            query, params = self._historico_query(filters)
+        elif name == 'eventos':
+            query, params = self._events_query(filters)
+        elif name == 'logs':
+            query, params = self._logs_query(filters.get('start_date'), filters.get('end_date'), filters.get('user_id'))
+        elif name == 'carteira':
+            query, params = self._carteira_query(filters)
+        elif name == 'empresas_referencia':
+            query, params = self._empresas_referencia_query(filters.get('estado'), filters.get('tipo_servico'),
+                                                            filters.get('concessionaria'), filters.get('nome_empresa'))
+        else:
+            raise ValueError(f"Listagem desconhecida: {name}")
+        return self._iter_query(query, params, page_size)
+
     def get_interaction_by_id(self, interaction_id):
         with self._connect() as conn:
             return conn.execute("SELECT * FROM crm_interacoes WHERE id = ?", (interaction_id,)).fetchone()
@@ -973,6 +1303,9 @@ class DatabaseManager:
             conn = self._connect()
             cursor = conn.cursor()
             cursor.execute("INSERT INTO crm_interacoes (oportunidade_id, data_interacao, tipo, resumo, usuario, responsavel_institucional, contato_nome) VALUES (?, ?, ?, ?, ?, ?, ?)", (data['oportunidade_id'], data['data_interacao'], data['tipo'], data['resumo'], data['usuario'], data.get('responsavel_institucional', 0), data.get('contato_nome', '')))
+            if data['tipo'] == 'Movimentação':
+                # Movimentação digitada no padrão "Movida de 'X' para 'Y'" também vira transição; texto livre não
+                self._backfill_stage_transitions(conn, cursor.lastrowid)
             conn.commit()
         except sqlite3.Error as e:
             print(f"Database error in add_interaction: {e}")
@@ -1103,33 +1436,37 @@ class DatabaseManager:
             conn.execute("DELETE FROM crm_bases_alocadas WHERE oportunidade_id = ?", (op_id,))
 
     # Métodos de Empresas Referência
+    def _empresas_referencia_query(self, estado=None, tipo_servico=None, concessionaria=None, nome_empresa=None):
+        base_query = """
+            SELECT er.*, te.nome as tipo_equipe_nome
+            FROM crm_empresas_referencia er
+            LEFT JOIN crm_tipos_equipe te ON er.tipo_equipe_id = te.id
+        """
+        conditions = []
+        params = []
+
+        if estado and estado != 'Todos':
+            conditions.append("er.estado = ?")
+            params.append(estado)
+        if tipo_servico and tipo_servico != 'Todos':
+            conditions.append("er.tipo_servico = ?")
+            params.append(tipo_servico)
+        if concessionaria and concessionaria != 'Todos':
+            conditions.append("er.concessionaria = ?")
+            params.append(concessionaria)
+        if nome_empresa and nome_empresa != 'Todos':
+            conditions.append("er.nome_empresa = ?")
+            params.append(nome_empresa)
+
+        if conditions:
+            base_query += " WHERE " + " AND ".join(conditions)
+
+        base_query += " ORDER BY er.nome_empresa, er.tipo_servico"
+        return base_query, params
+
     def get_all_empresas_referencia(self, estado=None, tipo_servico=None, concessionaria=None, nome_empresa=None):
         with self._connect() as conn:
-            base_query = """
-                SELECT er.*, te.nome as tipo_equipe_nome
-                FROM crm_empresas_referencia er
-                LEFT JOIN crm_tipos_equipe te ON er.tipo_equipe_id = te.id
-            """
-            conditions = []
-            params = []
-
-            if estado and estado != 'Todos':
-                conditions.append("er.estado = ?")
-                params.append(estado)
-            if tipo_servico and tipo_servico != 'Todos':
-                conditions.append("er.tipo_servico = ?")
-                params.append(tipo_servico)
-            if concessionaria and concessionaria != 'Todos':
-                conditions.append("er.concessionaria = ?")
-                params.append(concessionaria)
-            if nome_empresa and nome_empresa != 'Todos':
-                conditions.append("er.nome_empresa = ?")
-                params.append(nome_empresa)
-
-            if conditions:
-                base_query += " WHERE " + " AND ".join(conditions)
-
-            base_query += " ORDER BY er.nome_empresa, er.tipo_servico"
+            base_query, params = self._empresas_referencia_query(estado, tipo_servico, concessionaria, nome_empresa)
             return conn.execute(base_query, params).fetchall()
 
     def get_unique_empresa_referencia_names(self):
@@ -1168,6 +1505,19 @@ class DatabaseManager:
                 empresa_id
             ))
 
+    def get_empresas_referencia_frame(self):
+        with self._connect() as conn:
+            return pd.read_sql_query("SELECT * FROM crm_empresas_referencia ORDER BY id", conn)
+
+    def apply_empresas_referencia_import(self, inserts, updates, update_fields):
+        """Grava uma importação de tabela de preços em uma única transação.
+        inserts: tuplas na ordem de PRICE_IMPORT_INSERT_COLUMNS; updates: tuplas (valores de update_fields..., id)."""
+        with self._connect() as conn:
+            conn.executemany(f"""INSERT INTO crm_empresas_referencia ({', '.join(PRICE_IMPORT_INSERT_COLUMNS)})
+                                 VALUES ({', '.join('?' for _ in PRICE_IMPORT_INSERT_COLUMNS)})""", inserts)
+            if update_fields:
+                conn.executemany(f"UPDATE crm_empresas_referencia SET {', '.join(f'{field} = ?' for field in update_fields)} WHERE id = ?", updates)
+
     def get_empresa_referencia_by_tipo(self, tipo_servico):
         with self._connect() as conn:
             return conn.execute("SELECT * FROM crm_empresas_referencia WHERE tipo_servico = ? AND ativa = 1", (tipo_servico,)).fetchone()
@@ -1176,42 +1526,40 @@ class DatabaseManager:
         with self._connect() as conn:
             return conn.execute("SELECT * FROM crm_empresas_referencia WHERE nome_empresa = ? AND tipo_servico = ? AND ativa = 1", (nome_empresa, tipo_servico)).fetchone()
 
+    def _reference_prices(self, conn, ref_strings):
+        """Valor mensal de cada empresa referência 'Nome - UF - Serviço' ativa (a de menor id, como nas telas),
+        em uma única consulta. Referências não encontradas ficam fora do dicionário."""
+        wanted = {}
+        for ref_string in ref_strings:
+            parsed = parse_empresa_referencia_string(ref_string)
+            if parsed:
+                wanted[ref_string] = (parsed[0], parsed[2])
+        if not wanted:
+            return {}
+        names = sorted({nome for nome, _ in wanted.values()})
+        placeholders = ", ".join("?" for _ in names)
+        first_match = {}
+        for row in conn.execute(f"SELECT * FROM crm_empresas_referencia WHERE ativa = 1 AND nome_empresa IN ({placeholders}) ORDER BY id", names):
+            first_match.setdefault((row['nome_empresa'], row['tipo_servico']), row['valor_mensal'])
+        return {ref_string: first_match[key] or 0.0 for ref_string, key in wanted.items() if key in first_match}
+
+    def get_reference_prices(self, ref_strings):
+        with self._connect() as conn:
+            return self._reference_prices(conn, ref_strings)
+
     def get_empresa_referencia_price_by_string(self, ref_string):
         """
         Parses 'Name - State - Service' string and returns the monthly value.
         Returns 0.0 if not found or parse error.
         """
-        if not ref_string:
+        parsed = parse_empresa_referencia_string(ref_string)
+        if not parsed:
             return 0.0
+        nome_empresa, _estado, tipo_servico = parsed
         try:
-            # Expecting "Name - State - Service Type"
-            # Split by ' - ' which is the separator used in UI
-            parts = ref_string.split(' - ')
-            if len(parts) >= 3:
-                # Name is first part
-                # Service is last part
-                # State is middle (parts[1]) - but we might not strictly need it for unique lookup if name+service is unique enough,
-                # but let's use what we have or try match.
-                # Actually, get_empresa_referencia_by_nome_e_tipo uses name and service.
-                # State is extra.
-                # If name contains ' - ', this split might be tricky.
-                # Assuming standard format: "Name" - "UF" - "Service"
-                # Name might be "Company A", Service "Type B"
-
-                # Careful: The name itself might contain " - ".
-                # But the UI constructs it as: f"{e['nome_empresa']} - {e['estado']} - {e['tipo_servico']}"
-                # Service types are fixed strings. States are 2 chars.
-
-                # Let's try to parse from the end?
-                # Service is the last part. State is the second to last. Name is everything before.
-
-                tipo_servico = parts[-1]
-                # estado = parts[-2] # Not used in query currently but could be added
-                nome_empresa = " - ".join(parts[:-2])
-
-                empresa = self.get_empresa_referencia_by_nome_e_tipo(nome_empresa, tipo_servico)
-                if empresa:
-                    return empresa['valor_mensal']
+            empresa = self.get_empresa_referencia_by_nome_e_tipo(nome_empresa, tipo_servico)
+            if empresa:
+                return empresa['valor_mensal']
         except Exception:
             pass
         return 0.0
@@ -1281,13 +1629,78 @@ class DatabaseManager:
 
     # Métodos para Notícias
     def add_news_article(self, article_data):
+        """Insere a notícia (e sua assinatura, se informada). Retorna o id criado ou None se a URL já existia."""
+        with self._connect() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO crm_news (title, url, source, content_summary, published_date, saved, alternate_sources) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (article_data['title'], article_data['url'], article_data.get('source'), article_data.get('content_summary'), article_data.get('published_date'), 0,
+                                   json.dumps(article_data['alternate_sources'], ensure_ascii=False) if article_data.get('alternate_sources') else None))
+            if not cursor.rowcount:
+                return None
+            news_id = cursor.lastrowid
+            if article_data.get('minhash'):
+                conn.execute("INSERT INTO crm_news_signatures (news_id, canonical_url, minhash) VALUES (?, ?, ?)",
+                             (news_id, article_data['canonical_url'], json.dumps(article_data['minhash'])))
+                conn.executemany("INSERT INTO crm_news_signature_bands (band, bucket, news_id) VALUES (?, ?, ?)",
+                                 [(band, bucket, news_id) for band, bucket in enumerate(minhash_bands(article_data['minhash']))])
+            return news_id
+
+    def find_duplicate_news(self, canonical_url, minhash):
+        """Procura uma notícia já armazenada com a mesma URL canônica ou conteúdo quase idêntico. Retorna o id ou None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT news_id FROM crm_news_signatures WHERE canonical_url = ?", (canonical_url,)).fetchone()
+            if row:
+                return row['news_id']
+            bands = list(enumerate(minhash_bands(minhash)))
+            conditions = " OR ".join("(b.band = ? AND b.bucket = ?)" for _ in bands)
+            params = [value for pair in bands for value in pair]
+            candidates = conn.execute(f"""SELECT DISTINCT s.news_id, s.minhash FROM crm_news_signature_bands b
+                                          JOIN crm_news_signatures s ON s.news_id = b.news_id
+                                          WHERE {conditions}""", params).fetchall()
+        best_id, best_similarity = None, NEWS_DUPLICATE_SIMILARITY
+        for candidate in candidates:
+            similarity = minhash_similarity(minhash, json.loads(candidate['minhash']))
+            if similarity >= best_similarity:
+                best_id, best_similarity = candidate['news_id'], similarity
+        return best_id
+
+    def add_news_alternate_sources(self, news_id, sources):
+        """Acrescenta fontes alternativas ({'source', 'url'}) a uma notícia, sem repetir URLs."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT url, alternate_sources FROM crm_news WHERE id = ?", (news_id,)).fetchone()
+            if not row:
+                return
+            current = json.loads(row['alternate_sources']) if row['alternate_sources'] else []
+            known_urls = {row['url']} | {entry['url'] for entry in current}
+            for entry in sources:
+                if entry['url'] not in known_urls:
+                    current.append(entry)
+                    known_urls.add(entry['url'])
+            conn.execute("UPDATE crm_news SET alternate_sources = ? WHERE id = ?", (json.dumps(current, ensure_ascii=False), news_id))
+
+    def get_news_since(self, after_id=0, limit=None):
+        """Notícias com id maior que after_id, das mais novas para as mais antigas."""
+        with self._connect() as conn:
+            return conn.execute("SELECT * FROM crm_news WHERE id > ? ORDER BY id DESC LIMIT ?", (after_id, limit if limit else -1)).fetchall()
+
+    def get_news_before(self, before_id, limit):
+        """Página de notícias mais antigas que before_id (para rolagem incremental)."""
         with self._connect() as conn:
-            conn.execute("INSERT OR IGNORE INTO crm_news (title, url, source, content_summary, published_date, saved) VALUES (?, ?, ?, ?, ?, ?)",
-                         (article_data['title'], article_data['url'], article_data.get('source'), article_data.get('content_summary'), article_data.get('published_date'), 0))
+            return conn.execute("SELECT * FROM crm_news WHERE id < ? ORDER BY id DESC LIMIT ?", (before_id, limit)).fetchall()
 
-    def get_latest_news(self, limit=10):
+    def get_news_after(self, after_id, limit):
+        """Página de notícias mais novas que after_id (as mais próximas dele), das mais novas para as mais antigas."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM crm_news WHERE id > ? ORDER BY id ASC LIMIT ?", (after_id, limit)).fetchall()
+        return rows[::-1]
+
+    def get_existing_news_ids(self, ids):
+        """Retorna o subconjunto de ids que ainda estão em crm_news."""
+        ids = list(ids)
+        if not ids:
+            return set()
         with self._connect() as conn:
-            return conn.execute("SELECT * FROM crm_news ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+            placeholders = ", ".join("?" for _ in ids)
+            return {row['id'] for row in conn.execute(f"SELECT id FROM crm_news WHERE id IN ({placeholders})", ids)}
 
     def get_saved_news(self):
         with self._connect() as conn:
@@ -1305,34 +1718,137 @@ class DatabaseManager:
             except sqlite3.Error as e:
                 print(f"Could not delete old news: {e}")
 
+    def get_existing_news_urls(self, urls):
+        """Retorna o subconjunto de URLs que já estão em crm_news."""
+        urls = [u for u in urls if u]
+        if not urls:
+            return set()
+        with self._connect() as conn:
+            placeholders = ", ".join("?" for _ in urls)
+            return {row['url'] for row in conn.execute(f"SELECT url FROM crm_news WHERE url IN ({placeholders})", urls)}
+
+    # Métodos do Agendador de Notícias
+    def acquire_lease(self, name, owner, ttl_seconds):
+        """Obtém (ou renova) a reserva 'name' se estiver livre, expirada ou já pertencer a 'owner'."""
+        now = datetime.now()
+        with self._connect() as conn:
+            cursor = conn.execute("""INSERT INTO crm_scheduler_leases (name, owner, expires_at) VALUES (?, ?, ?)
+                                     ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                                     WHERE crm_scheduler_leases.owner = excluded.owner OR crm_scheduler_leases.expires_at < ?""",
+                                  (name, owner, (now + timedelta(seconds=ttl_seconds)).isoformat(), now.isoformat()))
+            return cursor.rowcount > 0
+
+    def release_lease(self, name, owner):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM crm_scheduler_leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def start_news_run(self, owner, resumed_from=None):
+        with self._connect() as conn:
+            cursor = conn.execute("INSERT INTO crm_news_runs (owner, started_at, status, resumed_from) VALUES (?, ?, 'running', ?)",
+                                  (owner, datetime.now().isoformat(), resumed_from))
+            return cursor.lastrowid
+
+    def update_news_run(self, run_id, **fields):
+        if not fields:
+            return
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE crm_news_runs SET {columns} WHERE id = ?", list(fields.values()) + [run_id])
+
+    def mark_stale_news_runs(self):
+        """Runs ainda 'running' sem dono ativo (o chamador detém a reserva) foram interrompidos por queda do aplicativo."""
+        with self._connect() as conn:
+            conn.execute("UPDATE crm_news_runs SET status = 'interrupted' WHERE status = 'running'")
+
+    def get_resumable_news_run(self, max_age_hours):
+        """Último run não concluído, recente e com checkpoint, que pode ser retomado."""
+        min_started = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        with self._connect() as conn:
+            return conn.execute("""SELECT * FROM crm_news_runs
+                                   WHERE status IN ('interrupted', 'failed', 'cancelled') AND checkpoint IS NOT NULL AND started_at >= ?
+                                     AND id > COALESCE((SELECT MAX(id) FROM crm_news_runs WHERE status = 'success'), 0)
+                                   ORDER BY id DESC LIMIT 1""", (min_started,)).fetchone()
+
+    def get_last_news_run(self, statuses=None):
+        with self._connect() as conn:
+            if statuses:
+                placeholders = ", ".join("?" for _ in statuses)
+                return conn.execute(f"SELECT * FROM crm_news_runs WHERE status IN ({placeholders}) ORDER BY id DESC LIMIT 1", list(statuses)).fetchone()
+            return conn.execute("SELECT * FROM crm_news_runs ORDER BY id DESC LIMIT 1").fetchone()
+
+    def get_news_runs(self, limit=50):
+        with self._connect() as conn:
+            return conn.execute("""SELECT id, owner, started_at, finished_at, status, stage, duration_seconds, items_found, items_unique,
+                                          items_relevant, items_fetched, items_stored, resumed_from, error
+                                   FROM crm_news_runs ORDER BY id DESC LIMIT ?""", (limit,)).fetchall()
+
+    # Métodos do Cache do Modelo de Linguagem
+    def get_llm_cache(self, kind, model, keys, max_age_hours):
+        """Retorna {cache_key: result} dos resultados ainda válidos para o modelo informado."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        min_created = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        found = {}
+        with self._connect() as conn:
+            # Consulta em blocos para respeitar o limite de parâmetros do SQLite
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = conn.execute(f"SELECT cache_key, result FROM crm_llm_cache WHERE kind = ? AND model = ? AND created_at >= ? AND cache_key IN ({placeholders})",
+                                    [kind, model, min_created] + chunk)
+                found.update((row['cache_key'], row['result']) for row in rows)
+        return found
+
+    def set_llm_cache(self, kind, model, results):
+        """Grava {cache_key: result} no cache do modelo."""
+        if not results:
+            return
+        now = datetime.now().isoformat()
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO crm_llm_cache (cache_key, kind, model, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                             [(key, kind, model, result, now) for key, result in results.items()])
+
+    def delete_expired_llm_cache(self):
+        max_age = max(LLM_CACHE_TTL_HOURS.values())
+        with self._connect() as conn:
+            try:
+                conn.execute("DELETE FROM crm_llm_cache WHERE created_at < ?", ((datetime.now() - timedelta(hours=max_age)).isoformat(),))
+            except sqlite3.Error as e:
+                print(f"Could not delete expired LLM cache: {e}")
+
     # Métodos de Eventos
     def get_events_for_opportunity(self, op_id):
         with self._connect() as conn:
             return conn.execute("SELECT * FROM crm_events WHERE oportunidade_id = ? ORDER BY data_notificacao DESC", (op_id,)).fetchall()
 
-    def get_all_events(self, filters=None):
-        with self._connect() as conn:
-            base_query = """
-                SELECT e.*, o.titulo as oportunidade_titulo, c.nome_empresa as cliente_nome
-                FROM crm_events e
-                JOIN oportunidades o ON e.oportunidade_id = o.id
-                JOIN clientes c ON o.cliente_id = c.id
-            """
-            conditions = []
-            params = []
+    def _events_query(self, filters=None):
+        base_query = """
+            SELECT e.*, o.titulo as oportunidade_titulo, c.nome_empresa as cliente_nome
+            FROM crm_events e
+            JOIN oportunidades o ON e.oportunidade_id = o.id
+            JOIN clientes c ON o.cliente_id = c.id
+        """
+        conditions = []
+        params = []
 
-            if filters:
-                if filters.get('cliente') and filters['cliente'] != 'Todos':
-                    conditions.append("c.nome_empresa = ?")
-                    params.append(filters['cliente'])
-                if filters.get('oportunidade_id'):
-                    conditions.append("e.oportunidade_id = ?")
-                    params.append(filters['oportunidade_id'])
+        if filters:
+            if filters.get('cliente') and filters['cliente'] != 'Todos':
+                conditions.append("c.nome_empresa = ?")
+                params.append(filters['cliente'])
+            if filters.get('oportunidade_id'):
+                conditions.append("e.oportunidade_id = ?")
+                params.append(filters['oportunidade_id'])
 
-            if conditions:
-                base_query += " WHERE " + " AND ".join(conditions)
+        if conditions:
+            base_query += " WHERE " + " AND ".join(conditions)
 
-            base_query += " ORDER BY e.data_notificacao DESC"
+        base_query += " ORDER BY e.data_notificacao DESC"
+        return base_query, params
+
+    def get_all_events(self, filters=None):
+        with self._connect() as conn:
+            base_query, params = self._events_query(filters)
             return conn.execute(base_query, params).fetchall()
 
     def add_event(self, data):
@@ -1453,6 +1969,19 @@ class DatabaseManager:
         with self._connect() as conn:
             return conn.execute("SELECT * FROM crm_termos_aditivos WHERE id = ?", (termo_id,)).fetchone()
 
+    def _refresh_aditivos_resumo(self, conn, op_id=None):
+        """Recalcula o resumo dos termos aditivos de uma oportunidade (ou de todas, sem op_id) na transação atual.
+        A data fim vigente é a maior data_fim válida dos termos, gravada como AAAA-MM-DD para ordenar e agregar em SQL."""
+        where, params = ("WHERE oportunidade_id = ?", (op_id,)) if op_id is not None else ("", ())
+        conn.execute(f"DELETE FROM crm_aditivos_resumo {where}", params)
+        conn.execute(f"""
+            INSERT INTO crm_aditivos_resumo (oportunidade_id, quantidade, valor_global, valor_mensal, prazo_meses, data_fim)
+            SELECT oportunidade_id, COUNT(*), COALESCE(SUM(valor_global_aditivo), 0), COALESCE(SUM(valor_adicionado_mensal), 0),
+                   COALESCE(SUM(prazo_adicionado_meses), 0),
+                   MAX(CASE WHEN data_fim LIKE '__/__/____' THEN substr(data_fim, 7, 4) || '-' || substr(data_fim, 4, 2) || '-' || substr(data_fim, 1, 2)
+                            WHEN data_fim LIKE '____-__-__%' THEN substr(data_fim, 1, 10) END)
+            FROM crm_termos_aditivos {where} GROUP BY oportunidade_id""", params)
+
     def add_termo_aditivo(self, data):
         with self._connect() as conn:
             conn.execute("""
@@ -1466,6 +1995,7 @@ class DatabaseManager:
                 data.get('valor_adicionado_mensal', 0), data.get('prazo_adicionado_meses', 0),
                 data.get('servicos_data'), data.get('valor_global_aditivo', 0), data.get('observacoes'), data.get('valor_aditivo_capa', 0)
             ))
+            self._refresh_aditivos_resumo(conn, data['oportunidade_id'])
 
     def update_termo_aditivo(self, termo_id, data):
         with self._connect() as conn:
@@ -1480,161 +2010,3120 @@ class DatabaseManager:
                 data.get('servicos_data'), data.get('valor_global_aditivo', 0), data.get('observacoes'), data.get('valor_aditivo_capa', 0),
                 termo_id
             ))
+            row = conn.execute("SELECT oportunidade_id FROM crm_termos_aditivos WHERE id = ?", (termo_id,)).fetchone()
+            if row:
+                self._refresh_aditivos_resumo(conn, row['oportunidade_id'])
 
     def delete_termo_aditivo(self, termo_id):
         with self._connect() as conn:
+            row = conn.execute("SELECT oportunidade_id FROM crm_termos_aditivos WHERE id = ?", (termo_id,)).fetchone()
             conn.execute("DELETE FROM crm_termos_aditivos WHERE id = ?", (termo_id,))
+            if row:
+                self._refresh_aditivos_resumo(conn, row['oportunidade_id'])
+
+    # Carteira de contratos (oportunidades em execução)
+    def _carteira_query(self, filters=None):
+        """Contratos em 'Execução do Contrato' com o valor atual (valor original + aditivos) e o run-rate mensal.
+        Run-rate: valor original / meses de contrato (ou o faturamento estimado, sem prazo) + valores mensais dos aditivos."""
+        query = """
+            SELECT o.id, o.numero_oportunidade, o.titulo, c.nome_empresa, COALESCE(NULLIF(c.estado, ''), '---') AS estado,
+                   COALESCE(o.valor, 0) AS valor_original,
+                   COALESCE(r.quantidade, 0) AS quantidade_aditivos,
+                   COALESCE(r.valor_global, 0) AS valor_aditivos,
+                   COALESCE(o.valor, 0) + COALESCE(r.valor_global, 0) AS valor_atual,
+                   COALESCE(COALESCE(o.valor, 0) * 1.0 / NULLIF(COALESCE(NULLIF(o.tempo_contrato_meses, 0), o.duracao_contrato), 0),
+                            o.faturamento_estimado, 0) + COALESCE(r.valor_mensal, 0) AS run_rate_mensal,
+                   r.data_fim AS data_fim_atual
+            FROM oportunidades o
+            JOIN pipeline_estagios p ON o.estagio_id = p.id
+            JOIN clientes c ON o.cliente_id = c.id
+            LEFT JOIN crm_aditivos_resumo r ON r.oportunidade_id = o.id
+            WHERE p.nome = ?"""
+        params = [CONTRACT_EXECUTION_STAGE]
+        filters = filters or {}
+        if filters.get('cliente'):
+            query += " AND c.nome_empresa = ?"
+            params.append(filters['cliente'])
+        if filters.get('estado'):
+            query += " AND COALESCE(NULLIF(c.estado, ''), '---') = ?"
+            params.append(filters['estado'])
+        return query + " ORDER BY valor_atual DESC", params
+
+    def get_carteira_contratos(self, filters=None):
+        with self._connect() as conn:
+            query, params = self._carteira_query(filters)
+            return conn.execute(query, params).fetchall()
+
+    def get_carteira_agregada(self, group_by='cliente'):
+        """Totais da carteira por cliente ou por estado (group_by='estado'), agregados no SQLite."""
+        grupo = 'estado' if group_by == 'estado' else 'nome_empresa'
+        query, params = self._carteira_query()
+        with self._connect() as conn:
+            return conn.execute(f"""
+                SELECT {grupo} AS grupo, COUNT(*) AS contratos, SUM(valor_original) AS valor_original,
+                       SUM(valor_aditivos) AS valor_aditivos, SUM(valor_atual) AS valor_atual,
+                       SUM(run_rate_mensal) AS run_rate_mensal,
+                       MIN(data_fim_atual) AS proximo_fim, MAX(data_fim_atual) AS ultimo_fim
+                FROM ({query}) GROUP BY {grupo} ORDER BY valor_atual DESC""", params).fetchall()
+
+
+class OpportunitySnapshot(namedtuple('OpportunitySnapshot', [
+        'opportunity', 'interaction_types', 'interacoes', 'events', 'aditivos',
+        'tarefas', 'task_responsibles', 'task_categories', 'reference_prices'])):
+    """Fotografia imutável de uma oportunidade e de todos os dados exibidos em seus detalhes."""
+    __slots__ = ()
+
+    def servicos_data(self):
+        """Lista de serviços/equipes decodificada do JSON da oportunidade."""
+        op_keys = self.opportunity.keys()
+        try:
+            return json.loads(self.opportunity['servicos_data']) if 'servicos_data' in op_keys and self.opportunity['servicos_data'] else []
+        except (json.JSONDecodeError, TypeError):
+            return []
+
+    def priced_teams(self):
+        """Equipes de todos os serviços com os valores calculados (ver price_teams)."""
+        return price_teams(team_table(self.servicos_data()), self.reference_prices)
+
+class OpportunityAggregate:
+    """Carrega o grafo completo de uma oportunidade em uma única transação de leitura."""
+    def __init__(self, db_manager):
+        self.db = db_manager
+
+    def load(self, op_id):
+        """Retorna um OpportunitySnapshot, ou None se a oportunidade não existir."""
+        conn = self.db._connect()
+        try:
+            conn.execute("BEGIN")
+            opportunity = conn.execute("""
+                SELECT o.*, c.nome_empresa, p.nome as estagio_nome
+                FROM oportunidades o
+                JOIN clientes c ON o.cliente_id = c.id
+                JOIN pipeline_estagios p ON o.estagio_id = p.id
+                WHERE o.id = ?
+            """, (op_id,)).fetchone()
+            if not opportunity:
+                return None
+
+            interaction_types = tuple(row['tipo'] for row in conn.execute("SELECT DISTINCT tipo FROM crm_interacoes ORDER BY tipo"))
+            interacoes = tuple(conn.execute("""
+                SELECT * FROM crm_interacoes WHERE oportunidade_id = ?
+                ORDER BY substr(data_interacao, 7, 4) DESC, substr(data_interacao, 4, 2) DESC, substr(data_interacao, 1, 2) DESC, substr(data_interacao, 12) DESC
+            """, (op_id,)))
+            events = tuple(conn.execute("SELECT * FROM crm_events WHERE oportunidade_id = ? ORDER BY data_notificacao DESC", (op_id,)))
+            aditivos = tuple(conn.execute("SELECT * FROM crm_termos_aditivos WHERE oportunidade_id = ? ORDER BY data_assinatura", (op_id,)))
+            tarefas = tuple(conn.execute("SELECT * FROM crm_tarefas WHERE oportunidade_id = ? ORDER BY status, data_vencimento", (op_id,)))
+            task_categories = tuple(conn.execute("SELECT * FROM crm_task_categories ORDER BY name"))
+            task_responsibles = tuple(sorted({t['responsavel'] for t in tarefas}, key=lambda r: (r is not None, r or '')))
+
+            # Preços de referência de todas as equipes em uma única consulta
+            reference_prices = {}
+            snapshot = OpportunitySnapshot(opportunity, interaction_types, interacoes, events, aditivos,
+                                           tarefas, task_responsibles, task_categories, types.MappingProxyType(reference_prices))
+            reference_prices.update(self.db._reference_prices(conn, team_table(snapshot.servicos_data())['empresa_referencia']))
+            return snapshot
+        finally:
+            conn.rollback()
+            conn.close()
+
+# Precificação das equipes. A tabela de equipes de todos os serviços é montada como um DataFrame e os cálculos
+# (quantidade × preço de referência, totais por serviço, valor US/UPS/UPE e faturamento) são feitos por coluna.
+# Usada pelo cálculo automático do formulário, pela tela de detalhes e pelos PDFs.
+TEAM_TABLE_COLUMNS = ['servico_idx', 'servico', 'tipo_equipe', 'quantidade', 'volumetria', 'base', 'empresa_referencia']
+
+
+def team_table(servicos_data):
+    """Tabela colunar das equipes a partir da lista de serviços ({'servico_nome', 'equipes': [...]})."""
+    rows = [(idx, servico.get('servico_nome', 'N/A'), equipe.get('tipo_equipe', 'N/A'), equipe.get('quantidade', ''),
+             equipe.get('volumetria', ''), equipe.get('base', 'N/A'), equipe.get('empresa_referencia', '') or '')
+            for idx, servico in enumerate(servicos_data) for equipe in servico.get('equipes', [])]
+    return pd.DataFrame(rows, columns=TEAM_TABLE_COLUMNS)
+
+
+def _decimal_column(values):
+    """Números digitados com vírgula ou ponto decimal; vazio vale 0. Retorna (valores, máscara de inválidos)."""
+    text = values.fillna('').astype(str).str.strip().str.replace(',', '.', regex=False)
+    numbers = pd.to_numeric(text, errors='coerce')
+    invalid = numbers.isna() & (text != '')
+    return numbers.fillna(0.0).astype(float), invalid
+
+
+def price_teams(teams, reference_prices):
+    """Acrescenta à tabela de equipes: qtd, vol, preco_unitario (NaN se a referência não foi encontrada),
+    valor_total (qtd × preço), valor_unitario (valor_total / volumetria), invalido e sem_referencia."""
+    priced = teams.copy()
+    priced['qtd'], qtd_invalid = _decimal_column(priced['quantidade'])
+    priced['vol'], vol_invalid = _decimal_column(priced['volumetria'])
+    priced['invalido'] = qtd_invalid | vol_invalid
+    priced['preco_unitario'] = priced['empresa_referencia'].map(dict(reference_prices)).astype(float)
+    priced['sem_referencia'] = priced['preco_unitario'].isna() & (priced['empresa_referencia'] != '')
+    priced['valor_total'] = priced['qtd'] * priced['preco_unitario'].fillna(0.0)
+    priced['valor_unitario'] = (priced['valor_total'] / priced['vol']).where(priced['vol'] > 0, 0.0)
+    return priced
+
+
+def summarize_services(priced, service_names):
+    """Totais por serviço, na ordem de 'service_names': quantidade, volumetria, valor_total, valor_unitario
+    (volumetria ponderada), preco_unitario (NaN quando os preços variam), varia, sem_referencia e invalido.
+    O faturamento estimado é a soma de valor_total."""
+    summary = priced.groupby('servico_idx').agg(
+        quantidade=('qtd', 'sum'), volumetria=('vol', 'sum'), valor_total=('valor_total', 'sum'),
+        precos=('preco_unitario', 'nunique'), preco_unitario=('preco_unitario', 'first'),
+        sem_referencia=('sem_referencia', 'sum'), invalido=('invalido', 'any'),
+    ).reindex(range(len(service_names)))
+    summary = summary.fillna({'quantidade': 0.0, 'volumetria': 0.0, 'valor_total': 0.0, 'precos': 0,
+                              'sem_referencia': 0, 'invalido': False})
+    summary.insert(0, 'servico', list(service_names))
+    summary['varia'] = summary['precos'] != 1
+    summary['preco_unitario'] = summary['preco_unitario'].where(~summary['varia'])
+    summary['valor_unitario'] = (summary['valor_total'] / summary['volumetria']).where(summary['volumetria'] > 0, 0.0)
+    return summary.drop(columns='precos')
+
+
+# Velocidade do funil: análise vetorizada das transições de estágio (crm_stage_transitions)
+MOVEMENT_SUMMARY_PATTERN = r"^Movida de '(?P<estagio_origem>.*?)' para '(?P<estagio_destino>.*?)'(?: - Resultado: (?P<resultado>.*))?$"
+CLOSED_STAGES = ("Histórico", "Cancelada")
+
+
+def parse_movement_summaries(resumos):
+    """Origem, destino e resultado dos textos "Movida de 'X' para 'Y' - Resultado: Z"; fora do padrão fica NaN."""
+    return resumos.fillna('').astype(str).str.strip().str.extract(MOVEMENT_SUMMARY_PATTERN)
+
+
+def parse_timestamps(values):
+    """Datas do banco em qualquer um dos formatos de EXPORT_DATE_FORMATS (NaT quando nenhum serve)."""
+    text = values.fillna('').astype(str).str.strip()
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    for date_format in EXPORT_DATE_FORMATS:
+        missing = parsed.isna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(text[missing], format=date_format, errors='coerce')
+    return parsed
+
+
+def _in_stage_order(frame, stage_order):
+    """Reordena o índice (nomes de estágio) pela ordem do funil; estágios desconhecidos vão para o fim."""
+    known = [stage for stage in stage_order if stage in frame.index]
+    return frame.reindex(known + sorted(set(frame.index) - set(known)))
+
+
+def stage_stays(transitions, opportunities, now=None):
+    """Uma linha por permanência em estágio: oportunidade_id, estagio, entrada, saida, destino, em_aberto e dias.
+    A primeira permanência começa na criação da oportunidade; a atual (fora de Histórico/Cancelada) vai até 'now'."""
+    now = pd.Timestamp(now or datetime.now())
+    created = pd.Series(parse_timestamps(opportunities['data_criacao']).values, index=opportunities['oportunidade_id'])
+    moves = transitions.assign(data_transicao=parse_timestamps(transitions['data_transicao']))
+    moves = moves.dropna(subset=['data_transicao']).sort_values(['oportunidade_id', 'data_transicao'], kind='stable')
+
+    entered = moves.groupby('oportunidade_id')['data_transicao'].shift()
+    closed = pd.DataFrame({
+        'oportunidade_id': moves['oportunidade_id'], 'estagio': moves['estagio_origem'],
+        'entrada': entered.fillna(moves['oportunidade_id'].map(created)), 'saida': moves['data_transicao'],
+        'destino': moves['estagio_destino'], 'em_aberto': False})
+
+    current = opportunities[~opportunities['estagio_atual'].isin(CLOSED_STAGES)]
+    last_move = moves.groupby('oportunidade_id')['data_transicao'].max()
+    open_stays = pd.DataFrame({
+        'oportunidade_id': current['oportunidade_id'], 'estagio': current['estagio_atual'],
+        'entrada': current['oportunidade_id'].map(last_move).fillna(current['oportunidade_id'].map(created)),
+        'saida': now, 'destino': None, 'em_aberto': True})
+
+    stays = pd.concat([closed, open_stays], ignore_index=True).dropna(subset=['estagio', 'entrada'])
+    stays['dias'] = (stays['saida'] - stays['entrada']).dt.total_seconds() / 86400
+    return stays[stays['dias'] >= 0].reset_index(drop=True)
+
+
+def time_in_stage(stays, stage_order=ESTAGIOS_PIPELINE_DOLP):
+    """Distribuição do tempo (dias) em cada estágio para as permanências encerradas, e idade das que seguem em aberto."""
+    finished = stays[~stays['em_aberto']].groupby('estagio')['dias']
+    still_open = stays[stays['em_aberto']].groupby('estagio')['dias']
+    summary = pd.DataFrame({
+        'saidas': finished.size(), 'media_dias': finished.mean(), 'mediana_dias': finished.median(),
+        'p90_dias': finished.quantile(0.9), 'max_dias': finished.max(),
+        'em_aberto': still_open.size(), 'idade_media_em_aberto': still_open.mean()})
+    summary = summary.fillna({'saidas': 0, 'em_aberto': 0}).astype({'saidas': int, 'em_aberto': int})
+    return _in_stage_order(summary, stage_order)
+
+
+def stage_conversion(transitions, stage_order=ESTAGIOS_PIPELINE_DOLP):
+    """Saídas de cada estágio classificadas em avanço (estágio posterior), perda (Histórico/Cancelada) e retorno,
+    com a taxa de conversão (avanços / saídas)."""
+    order = {stage: position for position, stage in enumerate(stage_order)}
+    origin = transitions['estagio_origem'].map(order)
+    target = transitions['estagio_destino'].map(order)
+    lost = transitions['estagio_destino'].isin(CLOSED_STAGES)
+    advanced = ~lost & (target > origin)
+    outcome = pd.DataFrame({'estagio': transitions['estagio_origem'], 'avancos': advanced, 'perdas': lost})
+    summary = outcome.groupby('estagio').agg(saidas=('avancos', 'size'), avancos=('avancos', 'sum'), perdas=('perdas', 'sum'))
+    summary['retornos'] = summary['saidas'] - summary['avancos'] - summary['perdas']
+    summary['taxa_conversao'] = summary['avancos'] / summary['saidas']
+    return _in_stage_order(summary, stage_order)
+
+
+def monthly_throughput(transitions, stage_order=ESTAGIOS_PIPELINE_DOLP):
+    """Entradas por mês em cada estágio (linhas: mês AAAA-MM; colunas: estágio de destino, na ordem do funil)."""
+    moves = transitions.assign(data_transicao=parse_timestamps(transitions['data_transicao'])).dropna(subset=['data_transicao'])
+    table = pd.crosstab(moves['data_transicao'].dt.strftime('%Y-%m').rename('mes'), moves['estagio_destino'])
+    return _in_stage_order(table.T, stage_order).T
+
+
+def pipeline_velocity_report(db, now=None):
+    """Tempo em estágio, conversão por estágio e vazão mensal a partir das transições gravadas."""
+    transitions = db.get_stage_transitions()
+    stays = stage_stays(transitions, db.get_opportunity_stages(), now)
+    return {
+        'tempo_em_estagio': time_in_stage(stays),
+        'conversao_por_estagio': stage_conversion(transitions),
+        'vazao_mensal': monthly_throughput(transitions),
+    }
+
+
+# Previsão ponderada de receita do funil
+def learned_win_probabilities(transitions, opportunities, stage_order=ESTAGIOS_PIPELINE_DOLP,
+                              won_stage=CONTRACT_EXECUTION_STAGE, min_samples=FORECAST_MIN_SAMPLES,
+                              fallback=STAGE_WIN_PROBABILITIES):
+    """Probabilidade de ganho por estágio aprendida do histórico: entre as oportunidades encerradas (ganhas ao chegar
+    em 'won_stage', perdidas em Histórico/Cancelada) que passaram pelo estágio, a fração ganha. Estágios com menos de
+    'min_samples' oportunidades encerradas usam o valor de 'fallback'."""
+    order = {stage: position for position, stage in enumerate(stage_order) if stage not in CLOSED_STAGES}
+    won_order = order[won_stage]
+    reached = pd.concat([
+        transitions[['oportunidade_id', 'estagio_origem']].set_axis(['oportunidade_id', 'estagio'], axis=1),
+        transitions[['oportunidade_id', 'estagio_destino']].set_axis(['oportunidade_id', 'estagio'], axis=1),
+        opportunities[['oportunidade_id', 'estagio_atual']].set_axis(['oportunidade_id', 'estagio'], axis=1)])
+    furthest = reached.assign(ordem=reached['estagio'].map(order)).groupby('oportunidade_id')['ordem'].max().fillna(-1)
+    current = opportunities.set_index('oportunidade_id')['estagio_atual'].reindex(furthest.index)
+    won = (furthest >= won_order).to_numpy()
+    resolved = won | current.isin(CLOSED_STAGES).to_numpy()
+
+    stages = [stage for stage, position in order.items() if position < won_order]
+    passed = furthest.to_numpy()[:, None] >= np.array([order[stage] for stage in stages])[None, :]
+    closed_count = (passed & resolved[:, None]).sum(axis=0)
+    won_count = (passed & won[:, None]).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        learned = np.where(closed_count >= max(min_samples, 1), won_count / closed_count, np.nan)
+    return {stage: float(value) if not np.isnan(value) else fallback.get(stage, 0.0) for stage, value in zip(stages, learned)}
+
+
+def forecast_revenue(opportunities, probabilities, start=None, horizon_months=FORECAST_HORIZON_MONTHS,
+                     stage_order=ESTAGIOS_PIPELINE_DOLP):
+    """Curva mensal de receita esperada das oportunidades em aberto (estágios com probabilidade em 'probabilities').
+    Cada contrato fatura valor / prazo por mês, do mês de abertura (ou do mês atual, se já passou ou não informado)
+    até o fim do prazo; a receita esperada é o faturamento mensal × probabilidade do estágio.
+    Retorna (curva mês × estágio da receita esperada, totais por mês com a receita esperada e a bruta)."""
+    start = pd.Period(start or datetime.now(), 'M')
+    open_ops = opportunities[opportunities['estagio'].isin(list(probabilities))]
+    months = pd.to_numeric(open_ops['duracao_contrato'], errors='coerce')
+    months = months.where(months > 0, pd.to_numeric(open_ops['tempo_contrato_meses'], errors='coerce'))
+    # Prazos abaixo de meio mês arredondariam para 0 (divisão por zero): fatura-se ao menos um mês
+    months = months.where(months > 0, FORECAST_DEFAULT_DURATION_MONTHS).round().clip(lower=1).to_numpy(dtype=float)
+    valor = pd.to_numeric(open_ops['valor'], errors='coerce').fillna(0.0).to_numpy()
+    faturamento = pd.to_numeric(open_ops['faturamento_estimado'], errors='coerce').fillna(0.0).to_numpy()
+    monthly = np.where(valor > 0, valor / months, faturamento)
+    probability = open_ops['estagio'].map(probabilities).to_numpy(dtype=float)
+
+    opening = parse_timestamps(open_ops['data_abertura'])
+    opening_month = ((opening.dt.year - 1970) * 12 + opening.dt.month - 1).fillna(start.ordinal)  # ordinal de Period('M')
+    first = np.maximum(opening_month.to_numpy(dtype=np.int64), start.ordinal)
+
+    # Só os meses dentro do horizonte são expandidos (um prazo digitado errado não gera milhões de linhas)
+    billed = np.clip(start.ordinal + horizon_months - first, 0, months).astype(np.int64)
+
+    # Uma linha por (oportunidade, mês de faturamento), sem laço por oportunidade
+    rows = np.repeat(np.arange(len(open_ops)), billed)
+    offsets = np.arange(billed.sum()) - np.repeat(np.cumsum(billed) - billed, billed)
+    month = first[rows] + offsets - start.ordinal
+    expected = (monthly * probability)[rows]
+
+    labels = [str(start + offset) for offset in range(horizon_months)]
+    stages = [stage for stage in stage_order if stage in probabilities]
+    stage_index = pd.Categorical(open_ops['estagio'].to_numpy()[rows], categories=stages).codes
+    curve = np.zeros((horizon_months, len(stages)))
+    np.add.at(curve, (month, stage_index), expected)
+    totals = pd.DataFrame({'receita_esperada': curve.sum(axis=1),
+                           'receita_bruta': np.bincount(month, weights=monthly[rows], minlength=horizon_months)},
+                          index=pd.Index(labels, name='mes'))
+    curve = pd.DataFrame(curve, index=pd.Index(labels, name='mes'), columns=stages)
+    return curve.loc[:, curve.any(axis=0)], totals
+
+
+class PipelineForecaster:
+    """Previsões de receita do funil em cache, por banco e versão dos dados do funil (ver crm_data_versions).
+    Os DataFrames retornados são compartilhados entre chamadas: trate-os como somente leitura."""
+    MODES = {'configurada': "Probabilidades configuradas", 'aprendida': "Probabilidades aprendidas do histórico"}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._cache = {}
+
+    def forecast(self, db, mode='configurada', horizon_months=FORECAST_HORIZON_MONTHS, start=None):
+        """{'probabilidades', 'curva', 'totais'} para o modo 'configurada' ou 'aprendida'."""
+        start = pd.Period(start or datetime.now(), 'M')
+        version = (db.db_name, db.get_data_version('pipeline'))
+        key = (mode, horizon_months, start.ordinal)
+        with self.lock:
+            cached = self._cache.get(version, {}).get(key)
+        if cached is not None:
+            return cached
+
+        opportunities = db.get_forecast_opportunities()
+        if mode == 'aprendida':
+            probabilities = learned_win_probabilities(db.get_stage_transitions(),
+                                                      opportunities.rename(columns={'estagio': 'estagio_atual'}))
+        else:
+            probabilities = dict(STAGE_WIN_PROBABILITIES)
+        curve, totals = forecast_revenue(opportunities, probabilities, start, horizon_months)
+        result = {'probabilidades': probabilities, 'curva': curve, 'totais': totals}
+        with self.lock:
+            # Versões antigas do mesmo banco não serão mais pedidas
+            self._cache = {cached_version: entries for cached_version, entries in self._cache.items()
+                           if cached_version[0] != version[0] or cached_version == version}
+            self._cache.setdefault(version, {})[key] = result
+        return result
+
+
+PIPELINE_FORECASTER = PipelineForecaster()
+
+
+# --- 4. SERVIÇO DE NOTÍCIAS ---
+class RateLimitedError(Exception):
+    """Resposta de limite de requisições (HTTP 429), com o tempo de espera sugerido pelo servidor."""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def is_rate_limit_error(error):
+    """Reconhece erros de cota/limite das APIs externas (DDGS, Gemini, HTTP 429)."""
+    if isinstance(error, RateLimitedError):
+        return True
+    name = type(error).__name__.lower()
+    text = str(error).lower()
+    return 'ratelimit' in name or 'resourceexhausted' in name or '429' in text or 'quota' in text
+
+class RateLimiter:
+    """Token bucket de um serviço externo, com backoff adaptativo e métricas de espera/trabalho."""
+    def __init__(self, name, rpm, burst=1, stop_event=None):
+        self.name = name
+        self.max_rate = rpm / 60.0
+        self.min_rate = self.max_rate / 8
+        self.rate = self.max_rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.stop_event = stop_event
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.work_seconds = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Aguarda um token; retorna False se a busca for cancelada durante a espera."""
+        started = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.wait_seconds += now - started
+                    return True
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.01)
+            if self.stop_event is not None:
+                if self.stop_event.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+    def penalize(self, retry_after=None):
+        """Reduz a taxa pela metade e bloqueia o serviço após um erro de limite."""
+        with self.lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            backoff = retry_after if retry_after else 1 / self.rate
+            self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+        print(f"Limite atingido em '{self.name}': nova taxa {self.rate * 60:.1f}/min, pausa de {backoff:.1f}s.")
+
+    def _reward(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def call(self, func, *args, retries=2, **kwargs):
+        """Executa func respeitando o limite; erros de cota aplicam backoff e são repetidos."""
+        for attempt in range(retries + 1):
+            if not self.acquire():
+                raise InterruptedError(f"Chamada a '{self.name}' cancelada.")
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == retries:
+                    raise
+                self.penalize(getattr(e, 'retry_after', None))
+                continue
+            finally:
+                # Limitadores por domínio são compartilhados entre as threads de download
+                with self.lock:
+                    self.calls += 1
+                    self.work_seconds += time.monotonic() - started
+            self._reward()
+            return result
+
+    def stats(self):
+        with self.lock:
+            return {'calls': self.calls, 'throttled': self.throttled,
+                    'wait_seconds': round(self.wait_seconds, 2), 'work_seconds': round(self.work_seconds, 2)}
+
+def normalize_url(url):
+    """Normaliza uma URL para uso como chave: esquema/host minúsculos, sem fragmento, porta padrão ou parâmetros de rastreamento."""
+    parts = urlsplit((url or '').strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith('utm_') and k.lower() not in ('fbclid', 'gclid', 'ref', 'amp'))
+    path = parts.path or '/'
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/')
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+def canonicalize_news_url(url):
+    """URL canônica para deduplicação: normalize_url sem 'www.', versões AMP e diferença entre http/https."""
+    parts = urlsplit(normalize_url(url))
+    host = parts.netloc
+    for prefix in ('www.', 'amp.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = re.sub(r'(/amp|\.amp|/amp\.html)$', '', parts.path) or '/'
+    return urlunsplit(('https', host, path, parts.query, ''))
+
+
+_NEWS_STOPWORDS = frozenset("a o e de da do das dos em no na nos nas para por com um uma que se ao aos os as diz afirma segundo".split())
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240501)  # Semente fixa: as assinaturas gravadas no banco precisam ser estáveis
+_MINHASH_COEFFICIENTS = [(_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(0, _MINHASH_PRIME))
+                         for _ in range(NEWS_MINHASH_PERMUTATIONS)]
+
+
+def news_tokens(text):
+    """Palavras normalizadas (minúsculas, sem acentos e sem stopwords)."""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return {word for word in re.findall(r'[a-z0-9]+', text) if word not in _NEWS_STOPWORDS}
+
+
+def news_minhash(title, lead=''):
+    """Assinatura MinHash do título + início do texto da notícia."""
+    lead_words = (lead or '').split()[:NEWS_LEAD_WORDS]
+    tokens = news_tokens(f"{title or ''} {' '.join(lead_words)}")
+    if not tokens:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big') for token in tokens]
+    return [min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_COEFFICIENTS]
+
+
+def minhash_bands(signature):
+    """Divide a assinatura em faixas (LSH); notícias semelhantes tendem a coincidir em ao menos uma faixa."""
+    rows = NEWS_MINHASH_BAND_ROWS
+    return [int.from_bytes(hashlib.blake2b(repr(signature[i:i + rows]).encode(), digest_size=7).digest(), 'big')
+            for i in range(0, len(signature), rows)]
+
+
+def minhash_similarity(a, b):
+    """Estimativa da similaridade de Jaccard entre duas assinaturas."""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a) if a and b else 0.0
+
+
+class ArticleTextExtractor:
+    """Extrai o corpo de uma notícia de forma incremental (HTML recebido em pedaços).
+
+    Coleta o texto dos blocos (parágrafos, títulos, itens de lista) fora de menus/rodapés/scripts,
+    dá preferência ao que está dentro de <article> e sinaliza quando já há texto suficiente."""
+    SKIP_TAGS = {'script', 'style', 'header', 'footer', 'nav', 'aside', 'form', 'noscript', 'iframe', 'svg', 'button', 'select'}
+    BLOCK_TAGS = {'p', 'h1', 'h2', 'h3', 'h4', 'li', 'blockquote', 'pre'}
+    MIN_ARTICLE_CHARS = 200
+
+    def __init__(self, max_chars=NEWS_SUMMARY_ARTICLE_CHARS, encoding=None):
+        self.max_chars = max_chars
+        self.encoding = encoding
+        self.parser = None
+        self.skip_depth = 0
+        self.article_depth = 0
+        self.article_closed = False
+        self.article_blocks, self.article_chars = [], 0
+        self.page_blocks, self.page_chars = [], 0
+        self.done = False
+
+    def feed(self, chunk):
+        """Processa mais um pedaço do HTML; retorna True quando não é preciso ler o restante."""
+        if self.done:
+            return True
+        if self.parser is None:
+            # Sem charset no cabeçalho: procura o <meta charset> no início da página (padrão UTF-8)
+            if not self.encoding:
+                meta = re.search(rb'<meta[^>]+charset=["\']?([\w-]+)', chunk[:4096], re.IGNORECASE)
+                self.encoding = meta.group(1).decode('ascii') if meta else 'utf-8'
+            self.parser = etree.HTMLPullParser(events=('start', 'end'), encoding=self.encoding)
+        self.parser.feed(chunk)
+        self._consume_events()
+        return self.done
+
+    def close(self):
+        if self.parser is not None and not self.done:
+            try:
+                self.parser.close()
+            except etree.LxmlError:
+                pass
+            self._consume_events()
+        if self.article_chars >= self.MIN_ARTICLE_CHARS:
+            blocks = self.article_blocks
+        else:
+            blocks = self.page_blocks
+        return '\n'.join(blocks)[:self.max_chars]
+
+    def _consume_events(self):
+        for event, element in self.parser.read_events():
+            tag = element.tag if isinstance(element.tag, str) else ''
+            if event == 'start':
+                if tag in self.SKIP_TAGS:
+                    self.skip_depth += 1
+                elif tag == 'article':
+                    self.article_depth += 1
+                continue
+
+            if tag in self.SKIP_TAGS:
+                self.skip_depth -= 1
+                self._release(element)
+            elif tag == 'article':
+                self.article_depth -= 1
+                self.article_closed = True
+            elif tag in self.BLOCK_TAGS:
+                if not self.skip_depth:
+                    self._add_block(' '.join(''.join(element.itertext()).split()))
+                self._release(element)
+            if self.done:
+                return
+
+    def _add_block(self, text):
+        if not text:
+            return
+        self.page_blocks.append(text)
+        self.page_chars += len(text) + 1
+        if self.article_depth:
+            self.article_blocks.append(text)
+            self.article_chars += len(text) + 1
+        # Texto suficiente: dentro do <article>, ou na página quando o <article> já terminou (ou não existe e sobra texto)
+        self.done = (self.article_chars >= self.max_chars
+                     or (self.page_chars >= self.max_chars and self.article_closed and self.article_chars < self.MIN_ARTICLE_CHARS)
+                     or self.page_chars >= 4 * self.max_chars)
+
+    @staticmethod
+    def _release(element):
+        # Libera a memória do trecho já processado (o texto após o elemento é preservado)
+        element.clear(keep_tail=True)
+        parent = element.getparent()
+        while parent is not None and element.getprevious() is not None:
+            del parent[0]
+
+
+def extract_article_text(chunks, encoding=None, max_bytes=NEWS_PAGE_MAX_BYTES):
+    """Consome pedaços de HTML até ter texto suficiente ou atingir max_bytes. Retorna (html_lido, texto)."""
+    extractor = ArticleTextExtractor(encoding=encoding)
+    received = []
+    total = 0
+    for chunk in chunks:
+        chunk = chunk[:max_bytes - total]
+        received.append(chunk)
+        total += len(chunk)
+        if extractor.feed(chunk) or total >= max_bytes:
+            break
+    html = b''.join(received)
+    text = extractor.close()
+    if not text:
+        # Página sem blocos de texto reconhecíveis: recorre à extração completa sobre o trecho lido
+        text = NewsService._extract_text(html)[:NEWS_SUMMARY_ARTICLE_CHARS]
+    return html, text
+
+
+def read_article_stream(response):
+    """Lê uma resposta HTTP aberta com stream=True sem baixar além do necessário."""
+    charset = re.search(r'charset=([\w-]+)', response.headers.get('Content-Type', ''), re.IGNORECASE)
+    try:
+        return extract_article_text(response.iter_content(NEWS_PAGE_CHUNK_BYTES), charset.group(1) if charset else None)
+    finally:
+        response.close()
+
+
+def benchmark_html_extraction(source=None):
+    """Compara tempo e pico de memória da extração completa (BeautifulSoup) com a extração incremental.
+
+    source: pasta com arquivos .html, um feed gravado (.json com 'pages') ou None para usar as páginas do cache em disco."""
+    if source and source.endswith('.json'):
+        pages = [html.encode('utf-8') for html in FixtureNewsSource.load(source).pages.values()]
+    else:
+        folder = source or NEWS_CACHE_DIR
+        pages = []
+        for path in glob.glob(os.path.join(folder, '*.html')):
+            with open(path, 'rb') as f:
+                pages.append(f.read())
+    if not pages:
+        print("Nenhuma página de amostra encontrada; usando o feed sintético.")
+        pages = [html.encode('utf-8') for html in FixtureNewsSource.synthetic(20).pages.values()]
+
+    def full(html):
+        return NewsService._extract_text(html)[:NEWS_SUMMARY_ARTICLE_CHARS]
+
+    def streaming(html):
+        chunks = (html[start:start + NEWS_PAGE_CHUNK_BYTES] for start in range(0, len(html), NEWS_PAGE_CHUNK_BYTES))
+        return extract_article_text(chunks)[1]
+
+    results = {}
+    for name, extract in (('completa', full), ('incremental', streaming)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        chars = sum(len(extract(html)) for html in pages)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {'paginas': len(pages), 'segundos': round(elapsed, 3), 'pico_memoria_kb': peak // 1024, 'caracteres': chars}
+    for name, stats in results.items():
+        print(f"{name:>12}: {stats}")
+    return results
+
+
+class HttpCache:
+    """Cache em disco de páginas de notícias (HTML + texto extraído), com validação ETag/Last-Modified e descarte LRU."""
+    def __init__(self, cache_dir=NEWS_CACHE_DIR, max_bytes=NEWS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(self._entry_size(key) for key in self._keys())
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, f"{key}.{ext}")
+
+    def _keys(self):
+        return [name[:-5] for name in os.listdir(self.cache_dir) if name.endswith('.json')]
+
+    def _entry_size(self, key):
+        return sum(os.path.getsize(self._path(key, ext)) for ext in ('json', 'html', 'txt') if os.path.exists(self._path(key, ext)))
+
+    @staticmethod
+    def key_for(url):
+        return hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+
+    def get(self, url):
+        """Retorna {'url', 'etag', 'last_modified', 'text'} ou None; a leitura atualiza a posição LRU."""
+        key = self.key_for(url)
+        with self.lock:
+            try:
+                with open(self._path(key, 'json'), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                with open(self._path(key, 'txt'), 'r', encoding='utf-8') as f:
+                    entry['text'] = f.read()
+                os.utime(self._path(key, 'json'))
+                return entry
+            except (OSError, ValueError):
+                return None
+
+    def get_html(self, url):
+        try:
+            with open(self._path(self.key_for(url), 'html'), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, html, text, etag=None, last_modified=None):
+        key = self.key_for(url)
+        meta = {'url': normalize_url(url), 'etag': etag, 'last_modified': last_modified, 'stored_at': datetime.now().isoformat()}
+        with self.lock:
+            self.total_bytes -= self._entry_size(key)
+            try:
+                with open(self._path(key, 'html'), 'wb') as f:
+                    f.write(html or b'')
+                with open(self._path(key, 'txt'), 'w', encoding='utf-8') as f:
+                    f.write(text or '')
+                # O .json é gravado por último: sua presença indica uma entrada completa
+                with open(self._path(key, 'json'), 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+            except OSError as e:
+                print(f"Erro ao gravar cache de {url}: {e}")
+            self.total_bytes += self._entry_size(key)
+            self._evict()
+
+    def touch(self, url, etag=None, last_modified=None):
+        """Após uma revalidação (304): renova 'stored_at' e guarda os validadores novos, se o servidor os enviou."""
+        key = self.key_for(url)
+        with self.lock:
+            try:
+                with open(self._path(key, 'json'), 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                meta['etag'] = etag or meta.get('etag')
+                meta['last_modified'] = last_modified or meta.get('last_modified')
+                meta['stored_at'] = datetime.now().isoformat()
+                self.total_bytes -= self._entry_size(key)
+                with open(self._path(key, 'json'), 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+                self.total_bytes += self._entry_size(key)
+            except (OSError, ValueError) as e:
+                print(f"Erro ao atualizar cache de {url}: {e}")
+
+    def record_hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def record_revalidated(self):
+        with self.lock:
+            self.revalidated += 1
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def _remove(self, key):
+        size = self._entry_size(key)
+        for ext in ('json', 'html', 'txt'):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+        self.total_bytes -= size
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Mais antigos (menos usados recentemente) primeiro
+        by_use = sorted(self._keys(), key=lambda k: os.path.getmtime(self._path(k, 'json')))
+        for key in by_use:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses,
+                    'entries': len(self._keys()), 'bytes': self.total_bytes}
+
+
+# Fontes de notícias e modelos de linguagem são plugáveis: o NewsService só depende das interfaces abaixo.
+NEWS_SEARCH_QUERIES = [
+    "notícias setor elétrico brasileiro",
+    "programas governo federal energia elétrica",
+    "fatos relevantes concessionárias energia Brasil",
+    "ANEEL últimas notícias",
+    "leilão de transmissão energia"
+]
+
+
+class NewsSource:
+    """Interface de fonte de notícias: search() retorna dicts com 'title', 'url', 'source', 'date' e 'body'."""
+    name = 'base'
+
+    def search(self, queries, rate_limiter=None):
+        raise NotImplementedError
+
+
+class DDGSNewsSource(NewsSource):
+    """Busca de notícias no DuckDuckGo."""
+    name = 'ddgs'
+
+    def __init__(self, region='br-pt', timelimit='m', max_results=5):
+        self.region = region
+        self.timelimit = timelimit
+        self.max_results = max_results
+
+    def search(self, queries, rate_limiter=None):
+        results = []
+        with DDGS() as ddgs:
+            for query in queries:
+                fetch = lambda q=query: list(ddgs.news(q, region=self.region, timelimit=self.timelimit, max_results=self.max_results))
+                results.extend(rate_limiter.call(fetch) if rate_limiter else fetch())
+        return results
+
+
+class FixtureNewsSource(NewsSource):
+    """Fonte local a partir de um feed gravado (JSON com 'items' e, opcionalmente, 'pages' {url: html})."""
+    name = 'fixture'
+
+    def __init__(self, items, pages=None):
+        self.items = list(items)
+        self.pages = dict(pages or {})
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get('items', []), data.get('pages'))
+
+    @staticmethod
+    def record(source, path, queries=None, session=None):
+        """Grava em 'path' o resultado atual de uma fonte real (e as páginas dos artigos) para uso offline."""
+        items = source.search(queries or NEWS_SEARCH_QUERIES)
+        session = session or requests.Session()
+        pages = {}
+        for item in items:
+            try:
+                response = session.get(item['url'], headers={'User-Agent': 'Mozilla/5.0'}, timeout=10)
+                pages[item['url']] = response.text
+            except requests.RequestException as e:
+                print(f"Erro ao gravar página {item['url']}: {e}")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'items': items, 'pages': pages}, f, ensure_ascii=False)
+        return len(items)
+
+    @classmethod
+    def synthetic(cls, num_items=60, seed=0):
+        """Feed sintético determinístico (mistura de notícias relevantes, irrelevantes e cópias sindicadas)."""
+        rng = random.Random(seed)
+        topics = ["leilão de transmissão", "reajuste tarifário da ANEEL", "obra de subestação", "investimento em distribuição",
+                  "resultado do campeonato", "lançamento de smartphone", "receita de bolo", "concessionária de energia amplia rede"]
+        companies = ["CPFL", "Neoenergia", "Eletrobras", "Cemig", "Equatorial", "Energisa", "Taesa", "Copel", "Light", "Enel"]
+        places = ["Campinas", "Recife", "Belém", "Goiânia", "Manaus", "Curitiba", "Natal", "Cuiabá", "Vitória", "Maceió", "Palmas"]
+        verbs = ["anuncia", "conclui", "adia", "comemora", "questiona", "detalha", "suspende", "amplia"]
+        details = ["previsão para 2026", "após audiência pública", "segundo balanço trimestral", "com apoio do BNDES",
+                   "diante de críticas", "em parceria inédita", "sob investigação", "com novas metas"]
+        outlets = ["valor.com.br", "g1.globo.com", "canalenergia.com.br", "estadao.com.br", "folha.uol.com.br"]
+        filler = "a empresa informou que o projeto segue o cronograma previsto e deve atender milhares de consumidores na região".split()
+        items, pages = [], {}
+        for n in range(num_items):
+            # Cada terceira notícia é cópia da anterior publicada em outro veículo
+            story = n - 1 if n % 3 == 2 else n
+            story_rng = random.Random(story)
+            title = (f"{story_rng.choice(companies)} {story_rng.choice(verbs)} {topics[story % len(topics)]} "
+                     f"em {story_rng.choice(places)} ({story_rng.choice(details)})")
+            url = f"https://{outlets[n % len(outlets)]}/noticias/{n}"
+            body = " ".join(rng.choice(filler) for _ in range(600))
+            items.append({'title': title, 'url': url, 'source': outlets[n % len(outlets)], 'body': '',
+                          'date': datetime.now().strftime('%Y-%m-%dT%H:%M:%S')})
+            pages[url] = f"<html><head><title>{title}</title><script>var x = 1;</script></head><body><nav>menu</nav><article><h1>{title}</h1><p>{body}</p></article><footer>rodapé</footer></body></html>"
+        return cls(items, pages)
+
+    def search(self, queries, rate_limiter=None):
+        return [dict(item) for item in self.items]
+
+
+class FixtureHTTPAdapter(requests.adapters.BaseAdapter):
+    """Adaptador do requests que serve as páginas gravadas de um FixtureNewsSource, sem acessar a rede."""
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        html = self.pages.get(request.url)
+        response.status_code = 200 if html is not None else 404
+        response._content = (html or '').encode('utf-8')
+        response._content_consumed = True
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        response.encoding = 'utf-8'
+        return response
+
+    def close(self):
+        pass
+
+
+class LLMProvider:
+    """Interface de modelo de linguagem: generate_content(prompt) retorna um objeto com o atributo 'text'.
+    model_name identifica o modelo nas entradas do cache de resultados."""
+    model_name = 'base'
+
+    def generate_content(self, prompt):
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    def __init__(self, api_key, model_name=GEMINI_MODEL_NAME):
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate_content(self, prompt):
+        return self.model.generate_content(prompt)
+
+
+def default_llm_provider():
+    """Modelo configurado pelo ambiente: CRM_FAKE_LLM força o modelo local; senão Gemini se houver chave."""
+    if os.environ.get('CRM_FAKE_LLM'):
+        return FakeNewsModel()
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if api_key:
+        return GeminiProvider(api_key)
+    print("AVISO: Chave da API do Gemini não configurada.")
+    return None
+
+
+class FakeNewsModel(LLMProvider):
+    """Modelo local determinístico, para testes e benchmarks sem rede."""
+    model_name = 'fake-local'
+    KEYWORDS = ('energia', 'aneel', 'leilão', 'transmissão', 'distribuição', 'concessionária', 'subestação')
+
+    def __init__(self, latency=0.0, seconds_per_1k_tokens=0.0, drop_rate=0.0, seed=0):
+        self.latency = latency
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.prompt_tokens = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        tokens = len(prompt) // 4
+        self.prompt_tokens += tokens
+        time.sleep(self.latency + tokens / 1000 * self.seconds_per_1k_tokens)
+        if '"indices_relevantes"' in prompt:
+            indices = [int(index) for index, title in re.findall(r'^\s*(\d+): (.*)$', prompt, re.MULTILINE)
+                       if any(word in title.lower() for word in self.KEYWORDS)]
+            text = json.dumps({"indices_relevantes": indices})
+        elif '"resumos"' in prompt:
+            entries = [{"id": int(index), "resumo": f"Resumo simulado de: {title}"}
+                       for index, title in re.findall(r'### ARTIGO (\d+)\nTítulo: "(.*)"', prompt)
+                       if self.random.random() >= self.drop_rate]
+            text = "```json\n" + json.dumps({"resumos": entries}, ensure_ascii=False) + "\n```"
+        else:
+            match = re.search(r'Título: "(.*)"', prompt)
+            text = f"Resumo simulado de: {match.group(1) if match else ''}"
+        return types.SimpleNamespace(text=text)
+
+
+def benchmark_news_summaries(num_articles=24, latency=0.5, drop_rate=0.1):
+    """Compara, com o FakeNewsModel, o resumo em lote contra uma chamada por artigo (sem rede e sem tocar no banco real)."""
+    words = "concessionária investe em linha de transmissão e subestação no interior ".split()
+    articles = [(f"Notícia {n} sobre leilão de transmissão", " ".join(words[(n + k) % len(words)] for k in range(1500)))
+                for n in range(num_articles)]
+    rpm = NEWS_RATE_LIMITS['gemini'][0]
+    results = {}
+    for mode in ('individual', 'lote'):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # O limite de RPM é contabilizado à parte para que o benchmark meça apenas o trabalho
+            service = NewsService(DatabaseManager(os.path.join(tmp_dir, 'benchmark.db')),
+                                  model=FakeNewsModel(latency=latency, drop_rate=drop_rate),
+                                  rate_limits={'gemini': (60000, num_articles)}, cache_dir=os.path.join(tmp_dir, 'cache'))
+            start = time.perf_counter()
+            if mode == 'lote':
+                summaries = service._summarize_articles(articles)
+            else:
+                summaries = [service._summarize_single(title, text) for title, text in articles]
+            elapsed = time.perf_counter() - start
+            results[mode] = {
+                'chamadas': service.model.calls,
+                'tokens_prompt': service.model.prompt_tokens,
+                'segundos': round(elapsed, 2),
+                'minutos_no_limite_rpm': round(service.model.calls / rpm, 2),
+                'resumos_ok': sum(1 for summary in summaries if summary and summary.startswith("Resumo simulado")),
+            }
+    for mode, stats in results.items():
+        print(f"{mode:>10}: {stats}")
+    return results
+
+
+def benchmark_news_pipeline(fixture_path=None, num_items=60, latency=0.2, fetch_latency=0.05):
+    """Mede a vazão do fetch_and_store_news completo sem rede: feed gravado (ou sintético), páginas locais e FakeNewsModel."""
+    source = FixtureNewsSource.load(fixture_path) if fixture_path else FixtureNewsSource.synthetic(num_items)
+    pages = source.pages
+
+    class SlowFixtureAdapter(FixtureHTTPAdapter):
+        def send(self, request, **kwargs):
+            time.sleep(fetch_latency)  # Latência simulada de rede por página
+            return super().send(request, **kwargs)
+
+    unlimited = {service: (60000, 1000) for service in NEWS_RATE_LIMITS}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model = FakeNewsModel(latency=latency)
+        service = NewsService(DatabaseManager(os.path.join(tmp_dir, 'benchmark.db')), sources=[source], model=model,
+                              rate_limits=unlimited, cache_dir=os.path.join(tmp_dir, 'cache'))
+        adapter = SlowFixtureAdapter(pages)
+        service.session.mount('http://', adapter)
+        service.session.mount('https://', adapter)
+        start = time.perf_counter()
+        service.fetch_and_store_news()
+        elapsed = time.perf_counter() - start
+        stored = len(service.db.get_news_since(0))
+    result = {
+        'itens_feed': len(source.items),
+        'noticias_gravadas': stored,
+        'chamadas_modelo': model.calls,
+        'segundos': round(elapsed, 2),
+        'itens_por_segundo': round(len(source.items) / elapsed, 1) if elapsed else None,
+        'etapas': {key: value for key, value in service.last_fetch_stats.items() if key != 'rate_limits'},
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    return result
+
+
+class NewsService:
+    def __init__(self, db_manager, sources=None, model=None, rate_limits=None, cache_dir=NEWS_CACHE_DIR):
+        """sources: lista de NewsSource (padrão: DuckDuckGo); model: LLMProvider (padrão: conforme o ambiente);
+        rate_limits: sobrescreve entradas de NEWS_RATE_LIMITS."""
+        self.db = db_manager
+        self.sources = sources if sources is not None else [DDGSNewsSource()]
+        self.rate_limits = dict(NEWS_RATE_LIMITS, **(rate_limits or {}))
+        self.stop_event = threading.Event()
+        self.last_fetch_stats = {}
+        self._host_limits = {}
+        self._host_limits_lock = threading.Lock()
+        # Sessão compartilhada: reaproveita conexões TCP/TLS entre os artigos
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'Mozilla/5.0'})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=NEWS_FETCH_WORKERS, pool_maxsize=NEWS_FETCH_WORKERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.http_cache = HttpCache(cache_dir)
+        self.llm_cache_stats = {'hits': 0, 'misses': 0, 'tokens_saved': 0}
+        self.rate_limiters = {
+            service: RateLimiter(service, rpm, burst, self.stop_event)
+            for service, (rpm, burst) in self.rate_limits.items() if service != 'host'
+        }
+        self.model = model if model is not None else default_llm_provider()
+
+    @property
+    def model_name(self):
+        return getattr(self.model, 'model_name', GEMINI_MODEL_NAME)
+
+    def _search_news(self):
+        """Busca notícias em todas as fontes configuradas."""
+        results = []
+        for source in self.sources:
+            limiter = self.rate_limiters.get(source.name)
+            if limiter is None and source.name in self.rate_limits:
+                rpm, burst = self.rate_limits[source.name]
+                limiter = self.rate_limiters[source.name] = RateLimiter(source.name, rpm, burst, self.stop_event)
+            try:
+                results.extend(source.search(NEWS_SEARCH_QUERIES, limiter))
+            except InterruptedError:
+                raise
+            except Exception as e:
+                print(f"Erro na fonte de notícias '{source.name}': {e}")
+        unique_results = {result['url']: result for result in results}.values()
+        return list(unique_results)
+
+    def _get_article_text(self, url):
+        """Extrai o texto principal de uma página web (usando o cache em disco quando possível)."""
+        try:
+            cached = self.http_cache.get(url)
+            if cached and datetime.now() - datetime.fromisoformat(cached['stored_at']) < timedelta(hours=NEWS_CACHE_FRESH_HOURS):
+                self.http_cache.record_hit()
+                return cached['text']
+            response = self._rate_limiter_for_host(url).call(self._http_get, url, self.http_cache.conditional_headers(cached), stream=True)
+            if response.status_code == 304 and cached:
+                response.close()
+                # Conteúdo confirmado pelo servidor: volta a valer por NEWS_CACHE_FRESH_HOURS
+                self.http_cache.touch(url, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                self.http_cache.record_revalidated()
+                return cached['text']
+            self.http_cache.record_miss()
+            html, text = read_article_stream(response)
+            self.http_cache.put(url, html, text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return text
+        except Exception as e:
+            print(f"Erro ao buscar conteúdo de {url}: {e}")
+            return None
+
+    @staticmethod
+    def _extract_text(html):
+        soup = BeautifulSoup(html, 'lxml')
+        for script_or_style in soup(["script", "style", "header", "footer", "nav"]):
+            script_or_style.decompose()
+        text = soup.get_text()
+        lines = (line.strip() for line in text.splitlines())
+        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+        return '\n'.join(chunk for chunk in chunks if chunk)
+
+    def cancel(self):
+        """Interrompe a busca em andamento (usado ao fechar o aplicativo)."""
+        self.stop_event.set()
+
+    def _http_get(self, url, headers=None, stream=False):
+        response = self.session.get(url, timeout=10, headers=headers, stream=stream)
+        try:
+            if response.status_code == 429:
+                retry_after = response.headers.get('Retry-After')
+                raise RateLimitedError(f"HTTP 429 em {url}", float(retry_after) if retry_after and retry_after.isdigit() else None)
+            response.raise_for_status()
+        except Exception:
+            # Com stream=True a conexão só volta ao pool da sessão quando a resposta é fechada
+            response.close()
+            raise
+        return response
+
+    def _rate_limiter_for_host(self, url):
+        host = urlsplit(url or '').netloc.lower()
+        key = f"host:{host}"
+        with self._host_limits_lock:
+            if key not in self.rate_limiters:
+                rpm, burst = self.rate_limits['host']
+                self.rate_limiters[key] = RateLimiter(key, rpm, burst, self.stop_event)
+            return self.rate_limiters[key]
+
+    def _generate(self, prompt):
+        """Chama o modelo respeitando o limite de RPM do Gemini."""
+        return self.rate_limiters['gemini'].call(self.model.generate_content, prompt)
+
+    def rate_limit_report(self):
+        """Resume, por serviço, o tempo gasto aguardando cota versus trabalhando."""
+        services = {}
+        for name, limiter in list(self.rate_limiters.items()):
+            group = 'host' if name.startswith('host:') else name
+            totals = services.setdefault(group, {'calls': 0, 'throttled': 0, 'wait_seconds': 0.0, 'work_seconds': 0.0})
+            for key, value in limiter.stats().items():
+                totals[key] += value
+        return services
+
+    def _host_limit(self, url):
+        host = urlsplit(url or '').netloc.lower()
+        with self._host_limits_lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.Semaphore(NEWS_FETCH_PER_HOST)
+            return self._host_limits[host]
+
+    def _fetch_one(self, url):
+        if self.stop_event.is_set():
+            return None
+        with self._host_limit(url):
+            if self.stop_event.is_set():
+                return None
+            return self._get_article_text(url)
+
+    def _fetch_articles(self, urls):
+        """Baixa os artigos em paralelo, respeitando o limite por domínio e o prazo total da etapa."""
+        texts = {}
+        if not urls:
+            return texts
+        started = time.monotonic()
+        deadline = started + NEWS_FETCH_DEADLINE_SECONDS
+        executor = ThreadPoolExecutor(max_workers=NEWS_FETCH_WORKERS, thread_name_prefix='news-fetch')
+        try:
+            pending = {executor.submit(self._fetch_one, url): url for url in urls}
+            while pending and not self.stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Prazo de download esgotado; {len(pending)} artigo(s) descartado(s).")
+                    break
+                done, _ = wait(pending, timeout=min(remaining, 1.0), return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    try:
+                        texts[url] = future.result()
+                    except Exception as e:
+                        print(f"Erro ao buscar conteúdo de {url}: {e}")
+                        texts[url] = None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        fetched = sum(1 for text in texts.values() if text)
+        self.last_fetch_stats['download'] = {
+            'requested': len(urls), 'fetched': fetched, 'failed': len(texts) - fetched,
+            'dropped': len(urls) - len(texts), 'seconds': elapsed, 'articles_per_second': len(texts) / elapsed,
+        }
+        print(f"Download de artigos: {fetched}/{len(urls)} em {elapsed:.1f}s ({len(texts) / elapsed:.2f} artigos/s)")
+        return texts
+
+    @staticmethod
+    def _content_key(*parts):
+        normalized = "\n".join(re.sub(r'\s+', ' ', (p or '')).strip().lower() for p in parts)
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _estimate_tokens(text):
+        # Aproximação usual: ~4 caracteres por token
+        return len(text) // 4
+
+    def _record_cache_usage(self, hits, misses, tokens_saved):
+        self.llm_cache_stats['hits'] += hits
+        self.llm_cache_stats['misses'] += misses
+        self.llm_cache_stats['tokens_saved'] += tokens_saved
+
+    def _check_relevance_batch(self, news_items):
+        """Verifica a relevância das notícias; só os títulos ainda não classificados vão ao modelo."""
+        if not self.model or not news_items:
+            return []
+
+        keys = [self._content_key(item.get('title')) for item in news_items]
+        cached = self.db.get_llm_cache('relevance', self.model_name, set(keys), LLM_CACHE_TTL_HOURS['relevance'])
+        unseen = [i for i, key in enumerate(keys) if key not in cached]
+        self._record_cache_usage(len(news_items) - len(unseen), len(unseen),
+                                 sum(self._estimate_tokens(f'{i}: {news_items[i].get("title")}') for i, key in enumerate(keys) if key in cached))
+
+        relevant = [i for i, key in enumerate(keys) if cached.get(key) == '1']
+        if unseen:
+            new_indices = self._classify_titles([news_items[i] for i in unseen])
+            if new_indices is not None:
+                new_set = set(new_indices)
+                self.db.set_llm_cache('relevance', self.model_name,
+                                      {keys[i]: '1' if pos in new_set else '0' for pos, i in enumerate(unseen)})
+                relevant.extend(unseen[pos] for pos in new_set if 0 <= pos < len(unseen))
+        return sorted(set(relevant))
+
+    @staticmethod
+    def _parse_json_response(text):
+        """Extrai o objeto JSON da resposta do modelo (com ou sem bloco ```json)."""
+        if '```json' in text:
+            text = text.split('```json')[1].split('```')[0]
+        return json.loads(text.strip())
+
+    def _classify_titles(self, news_items):
+        """Envia os títulos ao modelo em uma única chamada; retorna os índices relevantes ou None em caso de erro."""
+
+        titles_with_indices = [f'{i}: {item["title"]}' for i, item in enumerate(news_items)]
+        titles_text = "\n".join(titles_with_indices)
+
+        prompt = f'''
+        Você é um analista do setor de energia. Abaixo está uma lista de títulos de notícias, cada um com um índice. Sua tarefa é identificar quais notícias são relevantes para uma empresa de engenharia elétrica no Brasil.
+
+        **Critérios de Relevância:**
+        - Relevante: Notícias sobre leilões de energia, construção/manutenção de linhas de transmissão ou distribuição, investimentos, mudanças regulatórias da ANEEL, ou sobre grandes concessionárias (Neoenergia, CPFL, Eletrobras, etc.).
+        - Não Relevante: Notícias genéricas de economia, política não relacionada, ou outros setores.
+
+        **Lista de Títulos:**
+        {titles_text}
+
+        **Sua Tarefa:**
+        Responda APENAS com um objeto JSON contendo uma única chave "indices_relevantes", que é uma lista de números (inteiros) correspondendo aos índices dos títulos que você considerou relevantes.
+        Exemplo de Resposta:
+        {{
+          "indices_relevantes": [0, 4, 15]
+        }}
+        '''
+        try:
+            response = self._generate(prompt)
+            data = self._parse_json_response(response.text)
+            return [int(i) for i in data.get("indices_relevantes", [])]
+        except (json.JSONDecodeError, KeyError, Exception) as e:
+            print(f"Erro ao checar relevância em lote: {e}")
+            return None
+
+    @staticmethod
+    def _summary_prompt(title, text):
+        return f'''
+        Resuma a seguinte notícia em 2 a 3 frases, focando no impacto para o setor de engenharia elétrica.
+
+        Título: "{title}"
+        Conteúdo: "{text[:NEWS_SUMMARY_ARTICLE_CHARS]}"
+        '''
+
+    def _get_summary(self, text, title):
+        """Gera o resumo para um único artigo já considerado relevante."""
+        return self._summarize_articles([(title, text)])[0]
+
+    def _summarize_articles(self, articles):
+        """Resume uma lista de (título, texto), agrupando os artigos ainda sem resumo em poucas chamadas ao modelo."""
+        if not self.model:
+            return ["Resumo não disponível (API não configurada)."] * len(articles)
+
+        keys = [self._content_key(title, text[:NEWS_SUMMARY_ARTICLE_CHARS]) for title, text in articles]
+        cached = self.db.get_llm_cache('summary', self.model_name, set(keys), LLM_CACHE_TTL_HOURS['summary'])
+        summaries = [cached.get(key) for key in keys]
+        pending = [i for i, summary in enumerate(summaries) if summary is None]
+        self._record_cache_usage(len(articles) - len(pending), len(pending),
+                                 sum(self._estimate_tokens(self._summary_prompt(*articles[i]) + summaries[i])
+                                     for i in range(len(articles)) if summaries[i] is not None))
+
+        for batch in self._pack_summary_batches([articles[i] for i in pending], pending):
+            if self.stop_event.is_set():
+                raise InterruptedError
+            summaries_by_index = self._summarize_batch([(i, articles[i]) for i in batch]) if len(batch) > 1 else {}
+            for i in batch:
+                if not summaries_by_index.get(i):
+                    # Item ausente ou inválido na resposta em lote: tenta sozinho
+                    summaries_by_index[i] = self._summarize_single(*articles[i])
+            new_entries = {}
+            for i in batch:
+                summaries[i] = summaries_by_index[i]
+                if summaries[i] is not None:
+                    new_entries[keys[i]] = summaries[i]
+            self.db.set_llm_cache('summary', self.model_name, new_entries)
+
+        return [summary if summary is not None else "Não foi possível gerar o resumo." for summary in summaries]
+
+    def _pack_summary_batches(self, articles, indices):
+        """Agrupa os artigos em lotes cujo tamanho estimado cabe em NEWS_SUMMARY_BATCH_TOKENS."""
+        batches, current, current_tokens = [], [], 0
+        for (title, text), index in zip(articles, indices):
+            tokens = self._estimate_tokens(title or '') + self._estimate_tokens(text[:NEWS_SUMMARY_ARTICLE_CHARS]) + 50
+            if current and current_tokens + tokens > NEWS_SUMMARY_BATCH_TOKENS:
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _summarize_batch(self, items):
+        """Resume vários artigos em uma única chamada; retorna {índice: resumo} apenas para os itens válidos."""
+        articles_text = "\n\n".join(
+            f'### ARTIGO {index}\nTítulo: "{title}"\nConteúdo: "{text[:NEWS_SUMMARY_ARTICLE_CHARS]}"'
+            for index, (title, text) in items)
+        prompt = f'''
+        Você é um analista do setor de energia. Resuma cada uma das notícias abaixo em 2 a 3 frases, focando no impacto para o setor de engenharia elétrica.
+
+        {articles_text}
+
+        **Sua Tarefa:**
+        Responda APENAS com um objeto JSON contendo a chave "resumos", uma lista de objetos com "id" (o número do ARTIGO) e "resumo".
+        Exemplo de Resposta:
+        {{
+          "resumos": [{{"id": 3, "resumo": "..."}}]
+        }}
+        '''
+        expected = {index for index, _ in items}
+        try:
+            response = self._generate(prompt)
+            data = self._parse_json_response(response.text)
+            result = {}
+            for entry in data.get("resumos", []):
+                try:
+                    index = int(entry.get("id"))
+                except (TypeError, ValueError, AttributeError):
+                    continue
+                summary = str(entry.get("resumo") or '').strip()
+                if index in expected and summary:
+                    result[index] = summary
+            return result
+        except InterruptedError:
+            raise
+        except Exception as e:
+            print(f"Erro ao gerar resumos em lote: {e}")
+            return {}
+
+    def _summarize_single(self, title, text):
+        try:
+            response = self._generate(self._summary_prompt(title, text))
+            return response.text.strip()
+        except InterruptedError:
+            raise
+        except Exception as e:
+            print(f"Erro ao gerar resumo para '{title}': {e}")
+            return None
+
+    def fetch_and_store_news(self, checkpoint=None, save_checkpoint=None):
+        """Orquestra o processo de busca e armazenamento de notícias de forma eficiente.
+
+        checkpoint: estado salvo de uma execução anterior (as etapas já concluídas não são refeitas);
+        save_checkpoint(stage, checkpoint): chamado ao fim de cada etapa (search, classify, fetch, summarize)."""
+        self.last_fetch_stats = {'counts': {'found': 0, 'unique': 0, 'relevant': 0, 'fetched': 0, 'stored': 0}}
+        try:
+            self._run_pipeline(dict(checkpoint or {}), save_checkpoint)
+        except InterruptedError:
+            print("Busca de notícias cancelada.")
+        finally:
+            self.last_fetch_stats['rate_limits'] = self.rate_limit_report()
+            self.last_fetch_stats['http_cache'] = self.http_cache.stats()
+            print(f"Cache HTTP: {self.last_fetch_stats['http_cache']}")
+            lookups = self.llm_cache_stats['hits'] + self.llm_cache_stats['misses']
+            self.last_fetch_stats['llm_cache'] = dict(self.llm_cache_stats, hit_rate=(self.llm_cache_stats['hits'] / lookups) if lookups else 0.0)
+            print(f"Cache do modelo: {self.llm_cache_stats['hits']}/{lookups} acertos, ~{self.llm_cache_stats['tokens_saved']} tokens economizados")
+            for service, stats in self.last_fetch_stats['rate_limits'].items():
+                print(f"Cota '{service}': {stats['calls']} chamadas, {stats['throttled']} bloqueios, "
+                      f"{stats['wait_seconds']:.1f}s aguardando / {stats['work_seconds']:.1f}s trabalhando")
+
+    def _dedupe_news(self, news_items):
+        """Colapsa notícias quase duplicadas (entre si e contra as já armazenadas) antes da classificação."""
+        unique, buckets = [], {}
+        merged_into_stored = 0
+        for item in news_items:
+            alternate = {'source': item.get('source'), 'url': item.get('url')}
+            canonical_url = canonicalize_news_url(item.get('url'))
+            minhash = news_minhash(item.get('title'), item.get('body'))
+            if not minhash:
+                unique.append(item)
+                continue
+
+            duplicate_of = None
+            candidate_ids = {index for band in enumerate(minhash_bands(minhash)) for index in buckets.get(band, ())}
+            for index in sorted(candidate_ids):
+                kept = unique[index]
+                if kept['canonical_url'] == canonical_url or minhash_similarity(kept['minhash'], minhash) >= NEWS_DUPLICATE_SIMILARITY:
+                    duplicate_of = kept
+                    break
+            if duplicate_of is None:
+                duplicate_of = next((kept for kept in unique if kept.get('canonical_url') == canonical_url), None)
+            if duplicate_of is not None:
+                duplicate_of['alternate_sources'].append(alternate)
+                continue
+
+            stored_id = self.db.find_duplicate_news(canonical_url, minhash)
+            if stored_id is not None:
+                self.db.add_news_alternate_sources(stored_id, [alternate])
+                merged_into_stored += 1
+                continue
+
+            item = dict(item, canonical_url=canonical_url, minhash=minhash, alternate_sources=[])
+            for band in enumerate(minhash_bands(minhash)):
+                buckets.setdefault(band, []).append(len(unique))
+            unique.append(item)
+
+        self.last_fetch_stats['dedup'] = {'recebidas': len(news_items), 'unicas': len(unique), 'ja_armazenadas': merged_into_stored}
+        print(f"Deduplicação: {len(news_items)} notícias -> {len(unique)} únicas ({merged_into_stored} já armazenadas)")
+        return unique
+
+    def _checkpoint(self, stage, checkpoint, save_checkpoint):
+        # Uma etapa interrompida no meio não deve ser gravada como concluída
+        if self.stop_event.is_set():
+            raise InterruptedError
+        if save_checkpoint:
+            save_checkpoint(stage, checkpoint)
+
+    def _run_pipeline(self, checkpoint, save_checkpoint=None):
+        counts = self.last_fetch_stats['counts']
+        if 'items' not in checkpoint:
+            news_items = self._search_news()
+            checkpoint['found'] = len(news_items)
+            checkpoint['items'] = self._dedupe_news(news_items) if news_items else []
+            self._checkpoint('search', checkpoint, save_checkpoint)
+        news_items = checkpoint['items']
+        counts['found'] = checkpoint.get('found', len(news_items))
+        counts['unique'] = len(news_items)
+        if not news_items:
+            return
+
+        if 'relevant' not in checkpoint:
+            relevant_indices = self._check_relevance_batch(news_items)
+            relevant_articles = [news_items[i] for i in relevant_indices if i < len(news_items)]
+            # Artigos já armazenados não precisam ser baixados nem resumidos novamente
+            existing_urls = self.db.get_existing_news_urls([item.get('url') for item in relevant_articles])
+            checkpoint['relevant'] = [item for item in relevant_articles if item.get('url') not in existing_urls]
+            self._checkpoint('classify', checkpoint, save_checkpoint)
+        relevant_articles = checkpoint['relevant']
+        counts['relevant'] = len(relevant_articles)
+        if not relevant_articles:
+            self.db.delete_old_unsaved_news()
+            return
+
+        if 'texts' not in checkpoint:
+            article_texts = self._fetch_articles([item.get('url') for item in relevant_articles])
+            checkpoint['texts'] = {url: text for url, text in article_texts.items() if text}
+            self._checkpoint('fetch', checkpoint, save_checkpoint)
+        article_texts = checkpoint['texts']
+        fetched = [item for item in relevant_articles if article_texts.get(item.get('url'))]
+        counts['fetched'] = len(fetched)
+
+        if 'summaries' not in checkpoint:
+            summaries = self._summarize_articles([(item.get('title'), article_texts[item.get('url')]) for item in fetched])
+            checkpoint['summaries'] = {item.get('url'): summary for item, summary in zip(fetched, summaries)}
+            self._checkpoint('summarize', checkpoint, save_checkpoint)
+        summaries = checkpoint['summaries']
+
+        for item in fetched:
+            if self.stop_event.is_set():
+                return
+            article_data = {
+                'title': item.get('title'),
+                'url': item.get('url'),
+                'source': item.get('source'),
+                'content_summary': summaries.get(item.get('url')),
+                'published_date': '',
+                'canonical_url': item.get('canonical_url'),
+                'minhash': item.get('minhash'),
+                'alternate_sources': item.get('alternate_sources'),
+            }
+            if item.get('date'):
+                try:
+                    dt_obj = datetime.fromisoformat(item['date'].replace('Z', '+00:00'))
+                    article_data['published_date'] = dt_obj.strftime('%Y-%m-%d')
+                except ValueError:
+                    pass
+
+            if self.db.add_news_article(article_data):
+                counts['stored'] += 1
+
+        self.db.delete_old_unsaved_news()
+        self.db.delete_expired_llm_cache()
+
+
+class NewsScheduler:
+    """Executa a busca de notícias periodicamente (FETCH_INTERVAL_HOURS, com variação aleatória).
+
+    Uma reserva no banco garante que só uma instância do aplicativo busque por vez; cada etapa concluída
+    é gravada em crm_news_runs, de modo que uma busca interrompida é retomada de onde parou."""
+    LEASE_NAME = 'news_fetch'
+
+    def __init__(self, db_manager, news_service, interval_hours=FETCH_INTERVAL_HOURS, on_run_finished=None):
+        self.db = db_manager
+        self.news_service = news_service
+        self.interval = timedelta(hours=interval_hours)
+        self.on_run_finished = on_run_finished
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.news_service.cancel()
+        try:
+            self.db.release_lease(self.LEASE_NAME, self.owner)
+        except sqlite3.Error as e:
+            print(f"Erro ao liberar a reserva da busca de notícias: {e}")
+
+    def next_run_at(self):
+        """Próximo horário de busca: intervalo (com variação) após o último sucesso; espera menor após falha."""
+        last = self.db.get_last_news_run(('success', 'failed'))
+        if not last or not last['finished_at']:
+            return datetime.now()
+        finished = datetime.fromisoformat(last['finished_at'])
+        if last['status'] == 'failed':
+            return finished + timedelta(minutes=NEWS_RETRY_MINUTES)
+        # Variação sorteada uma vez por busca (semente = id da execução): o horário não muda entre reavaliações
+        jitter = random.Random(last['id']).uniform(-NEWS_SCHEDULE_JITTER, NEWS_SCHEDULE_JITTER)
+        return finished + self.interval * (1 + jitter)
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            wait_seconds = (self.next_run_at() - datetime.now()).total_seconds()
+            if wait_seconds > 0:
+                # Reavalia periodicamente: outra instância pode ter buscado nesse meio-tempo
+                self.stop_event.wait(min(wait_seconds, NEWS_LEASE_SECONDS))
+                continue
+            try:
+                result = self.run_once()
+            except Exception as e:
+                print(f"Erro no agendador de notícias: {e}")
+                result = None
+            if result is None:
+                # Outra instância detém a reserva (ou o banco falhou): tenta novamente mais tarde
+                self.stop_event.wait(NEWS_LEASE_SECONDS)
+
+    def _keep_lease(self, done):
+        while not done.wait(NEWS_LEASE_SECONDS / 3):
+            self.db.acquire_lease(self.LEASE_NAME, self.owner, NEWS_LEASE_SECONDS)
+
+    def run_once(self):
+        """Executa (ou retoma) uma busca se esta instância conseguir a reserva. Retorna o status final ou None."""
+        if not self.db.acquire_lease(self.LEASE_NAME, self.owner, NEWS_LEASE_SECONDS):
+            print("Busca de notícias em andamento em outra instância. Pulando.")
+            return None
+        done = threading.Event()
+        threading.Thread(target=self._keep_lease, args=(done,), daemon=True).start()
+        try:
+            return self._execute()
+        finally:
+            done.set()
+            self.db.release_lease(self.LEASE_NAME, self.owner)
+
+    def _execute(self):
+        self.db.mark_stale_news_runs()
+        resumable = self.db.get_resumable_news_run(self.interval.total_seconds() / 3600)
+        checkpoint = json.loads(resumable['checkpoint']) if resumable else None
+        run_id = self.db.start_news_run(self.owner, resumable['id'] if resumable else None)
+        if resumable:
+            print(f"Retomando a busca de notícias #{resumable['id']} após a etapa '{resumable['stage']}'.")
+
+        def save_checkpoint(stage, data):
+            self.db.update_news_run(run_id, stage=stage, checkpoint=json.dumps(data, ensure_ascii=False))
+
+        started = time.monotonic()
+        status, error = 'success', None
+        try:
+            self.news_service.fetch_and_store_news(checkpoint, save_checkpoint)
+            if self.news_service.stop_event.is_set():
+                status = 'cancelled'
+        except Exception as e:
+            status, error = 'failed', str(e)
+            print(f"Erro na busca de notícias: {e}")
+
+        counts = self.news_service.last_fetch_stats.get('counts', {})
+        fields = {
+            'status': status, 'error': error, 'finished_at': datetime.now().isoformat(),
+            'duration_seconds': time.monotonic() - started,
+            'items_found': counts.get('found'), 'items_unique': counts.get('unique'), 'items_relevant': counts.get('relevant'),
+            'items_fetched': counts.get('fetched'), 'items_stored': counts.get('stored'),
+        }
+        if status == 'success':
+            fields['checkpoint'] = None  # Concluído: não há o que retomar
+        self.db.update_news_run(run_id, **fields)
+        if self.on_run_finished and status == 'success':
+            self.on_run_finished(run_id)
+        return status
+
+
+class NewsFeedModel:
+    """Janela de notícias exibida no Menu Principal, atualizada de forma incremental.
+
+    Mantém no máximo max_items notícias em memória: load_older() pagina para trás e descarta as do topo;
+    load_newer() volta em direção às mais recentes e descarta as do fim. refresh() traz as notícias novas
+    (quando a janela está no topo) e remove as que saíram do banco; set_saved() grava e atualiza o item.
+    As views são avisadas por on_insert/on_append/on_update/on_remove."""
+    def __init__(self, db_manager, page_size=NEWS_FEED_PAGE_SIZE, max_items=NEWS_FEED_MAX_CARDS):
+        self.db = db_manager
+        self.page_size = page_size
+        self.max_items = max_items
+        self.items = []          # Mais novas primeiro
+        self.by_id = {}
+        self.exhausted = False   # Não há mais notícias antigas a carregar
+        self.at_newest = True    # A janela começa na notícia mais recente
+        self.on_insert = None    # (itens novos) -> inseridos no topo
+        self.on_append = None    # (itens antigos) -> acrescentados ao fim
+        self.on_update = None    # (item) -> item alterado
+        self.on_remove = None    # (ids) -> itens que saíram da janela
+
+    @property
+    def newest_id(self):
+        return self.items[0]['id'] if self.items else 0
+
+    def _insert(self, new_items):
+        self.items[:0] = new_items
+        self.by_id.update((item['id'], item) for item in new_items)
+        if self.on_insert:
+            self.on_insert(new_items)
+
+    def _append(self, older):
+        self.items.extend(older)
+        self.by_id.update((item['id'], item) for item in older)
+        if self.on_append:
+            self.on_append(older)
+
+    def _discard(self, removed):
+        if not removed:
+            return
+        for item in removed:
+            self.by_id.pop(item['id'], None)
+        if self.on_remove:
+            self.on_remove([item['id'] for item in removed])
+
+    def _trim_oldest(self):
+        removed = self.items[self.max_items:]
+        if removed:
+            del self.items[self.max_items:]
+            self.exhausted = False
+        self._discard(removed)
+
+    def _trim_newest(self):
+        excess = len(self.items) - self.max_items
+        if excess > 0:
+            removed = self.items[:excess]
+            del self.items[:excess]
+            self.at_newest = False
+            self._discard(removed)
+
+    def refresh(self):
+        self.remove_missing()
+        if not self.items:
+            new_items = [dict(row) for row in self.db.get_news_since(0, self.page_size)]
+            self.exhausted = len(new_items) < self.page_size
+            self.at_newest = True
+        elif self.at_newest:
+            new_items = [dict(row) for row in self.db.get_news_since(self.newest_id)]
+        else:
+            # Janela longe do topo: as novas entram ao rolar de volta (load_newer)
+            return []
+        if new_items:
+            self._insert(new_items)
+            self._trim_oldest()
+        return new_items
+
+    def load_older(self):
+        if self.exhausted or not self.items:
+            return []
+        older = [dict(row) for row in self.db.get_news_before(self.items[-1]['id'], self.page_size)]
+        self.exhausted = len(older) < self.page_size
+        if older:
+            self._append(older)
+            self._trim_newest()
+        return older
+
+    def load_newer(self):
+        if self.at_newest or not self.items:
+            return []
+        newer = [dict(row) for row in self.db.get_news_after(self.newest_id, self.page_size)]
+        self.at_newest = len(newer) < self.page_size
+        if newer:
+            self._insert(newer)
+            self._trim_oldest()
+        return newer
+
+    def remove(self, news_ids):
+        """Tira da janela as notícias informadas (ex.: excluídas do banco)."""
+        news_ids = set(news_ids)
+        removed = [item for item in self.items if item['id'] in news_ids]
+        if removed:
+            self.items = [item for item in self.items if item['id'] not in news_ids]
+            self._discard(removed)
+
+    def remove_missing(self):
+        """Tira da janela as notícias que não existem mais no banco (limpeza das antigas não salvas)."""
+        if self.items:
+            existing = self.db.get_existing_news_ids(self.by_id)
+            self.remove([news_id for news_id in self.by_id if news_id not in existing])
+
+    def set_saved(self, news_id, saved):
+        self.db.set_news_saved_status(news_id, saved)
+        item = self.by_id.get(news_id)
+        if item is not None:
+            item['saved'] = 1 if saved else 0
+            if self.on_update:
+                self.on_update(item)
+        return item
+
+
+# --- 5. AGENDA DE VISITAS ---
+def parse_visit_day(value):
+    """Extrai a data (sem hora) de um campo de visita no formato 'YYYY-MM-DD[ HH:MM:SS]'."""
+    if not value:
+        return None
+    return datetime.strptime(str(value).split(' ')[0], '%Y-%m-%d').date()
+
+class VisitIndex:
+    """Índice em memória dos intervalos de visitas, ordenado pela data de ida."""
+    def __init__(self, visits):
+        entries = []
+        for v in visits:
+            try:
+                start = parse_visit_day(v['data_ida'])
+                end = parse_visit_day(v['data_volta']) or start
+            except (ValueError, IndexError, TypeError):
+                continue
+            if start is None:
+                continue
+            # Volta anterior à ida é tratada como visita de um único dia
+            if end < start:
+                end = start
+            entries.append((start, end, v))
+
+        entries.sort(key=lambda e: e[0])
+        self._entries = entries
+        self._starts = [e[0] for e in entries]
+        # Maior duração conhecida: limita quantas visitas anteriores podem alcançar uma data
+        self._max_span = max(((e[1] - e[0]) for e in entries), default=timedelta(0))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def all(self):
+        """Retorna todas as visitas indexadas, na ordem da data de ida."""
+        return [e[2] for e in self._entries]
+
+    def query_range(self, range_start, range_end):
+        """Retorna (ida, volta, visita) de todas as visitas que tocam o intervalo [range_start, range_end]."""
+        # Perto de date.min a subtração estouraria o limite do tipo date
+        lower = range_start - self._max_span if range_start > date.min + self._max_span else date.min
+        lo = bisect.bisect_left(self._starts, lower)
+        hi = bisect.bisect_right(self._starts, range_end)
+        return [e for e in self._entries[lo:hi] if e[1] >= range_start]
+
+    def visits_on(self, day):
+        """Retorna as visitas ativas em um dia, na ordem da data de ida."""
+        return [e[2] for e in self.query_range(day, day)]
+
+
+def parse_visit_interval(visit):
+    """Converte ida/volta de uma visita em (início, fim) com hora; sem volta, vale até o fim do dia."""
+    start = datetime.fromisoformat(str(visit['data_ida']))
+    end = datetime.fromisoformat(str(visit['data_volta'])) if visit['data_volta'] else None
+    if end is None or end <= start:
+        end = datetime.combine(start.date(), datetime.max.time())
+    return start, end
+
+class _IntervalNode:
+    __slots__ = ('key', 'start', 'end', 'max_end', 'height', 'left', 'right', 'payload')
+
+    def __init__(self, key, start, end, payload):
+        self.key = key
+        self.start = start
+        self.end = end
+        self.max_end = end
+        self.height = 1
+        self.left = None
+        self.right = None
+        self.payload = payload
+
+class IntervalTree:
+    """Árvore de intervalos AVL (aumentada com o maior fim da subárvore): inserção O(log n)."""
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    @staticmethod
+    def _height(node):
+        return node.height if node else 0
+
+    @staticmethod
+    def _update(node):
+        node.height = 1 + max(IntervalTree._height(node.left), IntervalTree._height(node.right))
+        node.max_end = node.end
+        if node.left and node.left.max_end > node.max_end:
+            node.max_end = node.left.max_end
+        if node.right and node.right.max_end > node.max_end:
+            node.max_end = node.right.max_end
+
+    def _rotate_right(self, node):
+        pivot = node.left
+        node.left = pivot.right
+        pivot.right = node
+        self._update(node)
+        self._update(pivot)
+        return pivot
+
+    def _rotate_left(self, node):
+        pivot = node.right
+        node.right = pivot.left
+        pivot.left = node
+        self._update(node)
+        self._update(pivot)
+        return pivot
+
+    def _rebalance(self, node):
+        self._update(node)
+        balance = self._height(node.left) - self._height(node.right)
+        if balance > 1:
+            if self._height(node.left.left) < self._height(node.left.right):
+                node.left = self._rotate_left(node.left)
+            return self._rotate_right(node)
+        if balance < -1:
+            if self._height(node.right.right) < self._height(node.right.left):
+                node.right = self._rotate_right(node.right)
+            return self._rotate_left(node)
+        return node
+
+    def insert(self, start, end, payload, tiebreak=0):
+        """Insere o intervalo [start, end) associado a payload."""
+        key = (start, tiebreak)
+
+        def _insert(node):
+            if node is None:
+                return _IntervalNode(key, start, end, payload)
+            if key < node.key:
+                node.left = _insert(node.left)
+            else:
+                node.right = _insert(node.right)
+            return self._rebalance(node)
+
+        self.root = _insert(self.root)
+        self.size += 1
+
+    def overlapping(self, start, end):
+        """Retorna os payloads cujos intervalos se sobrepõem a [start, end)."""
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            # Nenhum intervalo desta subárvore termina depois do início procurado
+            if node is None or node.max_end <= start:
+                continue
+            stack.append(node.left)
+            if node.start < end:
+                if node.end > start:
+                    found.append(node.payload)
+                stack.append(node.right)
+        return found
+
+class VisitScheduler:
+    """Detecta visitas sobrepostas por responsável e por cliente."""
+    def __init__(self, visits=()):
+        self._by_responsavel = {}
+        self._by_cliente = {}
+        for v in visits:
+            self.add(v)
+
+    def add(self, visit):
+        """Registra uma visita nas árvores do responsável e do cliente."""
+        try:
+            start, end = parse_visit_interval(visit)
+        except (ValueError, TypeError):
+            return
+        visit_id = visit['id'] if 'id' in visit.keys() else 0
+        for trees, owner in ((self._by_responsavel, visit['responsavel_id']), (self._by_cliente, visit['cliente_id'])):
+            trees.setdefault(owner, IntervalTree()).insert(start, end, visit, tiebreak=visit_id or 0)
+
+    def find_conflicts(self, visit, exclude_id=None):
+        """Retorna {'responsavel': [...], 'cliente': [...]} com as visitas que se sobrepõem a 'visit'."""
+        start, end = parse_visit_interval(visit)
+        conflicts = {}
+        for kind, trees, owner in (('responsavel', self._by_responsavel, visit['responsavel_id']),
+                                   ('cliente', self._by_cliente, visit['cliente_id'])):
+            tree = trees.get(owner)
+            matches = tree.overlapping(start, end) if tree else []
+            conflicts[kind] = sorted((m for m in matches if m['id'] != exclude_id), key=lambda m: str(m['data_ida']))
+        return conflicts
+
+    @staticmethod
+    def conflicts_in_period(visits, period_start, period_end):
+        """Lista os pares de visitas sobrepostas no período (varredura ordenada por responsável e por cliente)."""
+        report = []
+        for kind, field in (('responsavel', 'responsavel_id'), ('cliente', 'cliente_id')):
+            groups = {}
+            for v in visits:
+                try:
+                    start, end = parse_visit_interval(v)
+                except (ValueError, TypeError):
+                    continue
+                if start > period_end or end < period_start:
+                    continue
+                groups.setdefault(v[field], []).append((start, end, v))
+
+            for items in groups.values():
+                items.sort(key=lambda item: item[0])
+                active = []
+                for start, end, v in items:
+                    active = [a for a in active if a[1] > start]
+                    for a_start, a_end, other in active:
+                        report.append({'tipo': kind, 'visita_a': other, 'visita_b': v,
+                                       'inicio': start, 'fim': min(end, a_end)})
+                    active.append((start, end, v))
+        report.sort(key=lambda r: r['inicio'])
+        return report
+
+
+# --- 6. RELATÓRIOS PDF ---
+# Os relatórios são descritos por uma especificação serializável (dicts, listas e textos), montada na thread da
+# interface a partir dos dados da oportunidade, e renderizados pelo reportlab em processos separados.
+# Blocos da especificação:
+#   ('paragraph', texto, estilo) | ('spacer', altura) | ('keep', [blocos])
+#   ('table', linhas, larguras_em_polegadas, estilo_da_tabela, linhas_de_cabeçalho_repetidas)
+#   ('interactions', lista_ou_consulta) -> tabelas de INTERACTIONS_EXPORT_PAGE_SIZE linhas, geradas sob demanda
+# Células de tabela são valores simples ou ('p', texto), renderizado como Paragraph em BodyText.
+
+REPORT_TABLE_STYLES = {
+    'kv': [
+        ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('FONTNAME', (0,0), (0,-1), 'Helvetica-Bold'), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
+    ],
+    'equipes': [
+        ('BACKGROUND', (0,0), (-1,0), colors.grey), ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'), ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0,0), (-1,0), 12), ('BACKGROUND', (0,1), (-1,-1), colors.beige),
+        ('GRID', (0,0), (-1,-1), 1, colors.black)
+    ],
+    'qualificacao': [
+        ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
+        ('LEFTPADDING', (0,0), (-1,-1), 6), ('RIGHTPADDING', (0,0), (-1,-1), 6),
+        ('TOPPADDING', (0,0), (-1,-1), 6), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
+    ],
+    'interacoes': [
+        ('BACKGROUND', (0,0), (-1,0), colors.grey), ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+        ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0,0), (-1,0), 12), ('BACKGROUND', (0,1), (-1,-1), colors.beige),
+        ('GRID', (0,0), (-1,-1), 1, colors.black), ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ('LEFTPADDING', (0,0), (-1,-1), 6), ('RIGHTPADDING', (0,0), (-1,-1), 6),
+        ('TOPPADDING', (0,0), (-1,-1), 6), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
+    ],
+}
 
 
-# --- 4. SERVIÇO DE NOTÍCIAS ---
-class NewsService:
-    def __init__(self, db_manager):
-        self.db = db_manager
-        self.gemini_api_key = os.environ.get('GEMINI_API_KEY')
-        if self.gemini_api_key:
-            genai.configure(api_key=self.gemini_api_key)
-            self.model = genai.GenerativeModel('gemini-flash-latest')
+class PdfAssets:
+    """Recursos compartilhados pelos relatórios PDF: folha de estilos, estilos de tabela e o logo.
+
+    Montados uma única vez por processo e reaproveitados entre documentos (os processos do ReportService
+    renderizam vários relatórios). O logo é decodificado uma vez e gravado em cada documento como um
+    Form XObject, desenhado na primeira página e apenas referenciado nas demais."""
+    LOGO_FORM = 'DolpLogo'
+    LOGO_WIDTH = 1.5 * inch
+
+    def __init__(self, logo_path=LOGO_PATH):
+        self.logo_path = logo_path
+        self.lock = threading.Lock()
+        self._styles = None
+        self._table_styles = {}
+        self._logo = None  # (mtime, ImageReader, largura, altura)
+
+    def styles(self):
+        with self.lock:
+            if self._styles is None:
+                styles = getSampleStyleSheet()
+                styles.add(ParagraphStyle(name='Justify', alignment=4))
+                self._styles = styles
+            return self._styles
+
+    def table_style(self, name):
+        with self.lock:
+            if name not in self._table_styles:
+                self._table_styles[name] = TableStyle(REPORT_TABLE_STYLES[name])
+            return self._table_styles[name]
+
+    def logo(self):
+        """ImageReader do logo e tamanho de exibição, recarregado apenas se o arquivo mudar; None se não existir."""
+        try:
+            mtime = os.path.getmtime(self.logo_path)
+        except OSError:
+            return None
+        with self.lock:
+            if self._logo is None or self._logo[0] != mtime:
+                reader = ImageReader(self.logo_path)
+                img_width, img_height = reader.getSize()
+                reader.getRGBData()  # Decodifica uma vez; o ImageReader guarda os pixels para os próximos documentos
+                self._logo = (mtime, reader, self.LOGO_WIDTH, self.LOGO_WIDTH * img_height / float(img_width))
+            return self._logo[1:]
+
+    def draw_logo(self, canvas, x, y):
+        if not canvas.hasForm(self.LOGO_FORM):
+            logo = self.logo()
+            if logo is None:
+                return
+            reader, width, height = logo
+            canvas.beginForm(self.LOGO_FORM)
+            canvas.drawImage(reader, 0, 0, width=width, height=height, mask='auto')
+            canvas.endForm()
+        canvas.saveState()
+        canvas.translate(x, y)
+        canvas.doForm(self.LOGO_FORM)
+        canvas.restoreState()
+
+
+PDF_ASSETS = PdfAssets()
+
+
+def _report_flowable(block, styles):
+    kind = block[0]
+    if kind == 'paragraph':
+        return Paragraph(block[1], styles[block[2]])
+    if kind == 'spacer':
+        return Spacer(1, block[1])
+    if kind == 'keep':
+        return KeepTogether([_report_flowable(child, styles) for child in block[1]])
+    if kind == 'table':
+        _, rows, widths, style_name, repeat_rows = block
+        cells = [[Paragraph(cell[1], styles['BodyText']) if isinstance(cell, (tuple, list)) else cell for cell in row] for row in rows]
+        table = Table(cells, colWidths=[width * inch for width in widths], repeatRows=repeat_rows)
+        table.setStyle(PDF_ASSETS.table_style(style_name))
+        return table
+    raise ValueError(f"Bloco de relatório desconhecido: {kind}")
+
+
+def iter_interaction_pages(source, page_size=INTERACTIONS_EXPORT_PAGE_SIZE):
+    """Páginas de interações de uma lista ou de uma consulta ao banco (ver build_interactions_spec)."""
+    if isinstance(source, dict):
+        db = DatabaseManager(source['db_name'], initialize=False)
+        yield from db.iter_interactions_for_opportunity(source['op_id'], source.get('tipo'), source.get('start_date'),
+                                                        source.get('end_date'), page_size=page_size)
+    else:
+        for start in range(0, len(source), page_size):
+            yield source[start:start + page_size]
+
+
+def _interactions_tables(source, styles):
+    for page in iter_interaction_pages(source):
+        rows = [['Data', 'Tipo', 'Usuário', 'Resumo']]
+        for interaction in page:
+            rows.append([interaction['data_interacao'], interaction['tipo'], interaction['usuario'],
+                         Paragraph((interaction['resumo'] or '').replace('\n', '<br/>'), styles['BodyText'])])
+        table = Table(rows, colWidths=[width * inch for width in (1.2, 1.0, 1.0, 3.0)], repeatRows=1)
+        table.setStyle(PDF_ASSETS.table_style('interacoes'))
+        yield table
+
+
+def _report_flowables(blocks, styles):
+    for block in blocks:
+        if block[0] == 'interactions':
+            yield from _interactions_tables(block[1], styles)
         else:
-            self.model = None
-            print("AVISO: Chave da API do Gemini não configurada.")
+            yield _report_flowable(block, styles)
 
-    def _search_news(self):
-        """Busca notícias usando DuckDuckGo."""
-        queries = [
-            "notícias setor elétrico brasileiro",
-            "programas governo federal energia elétrica",
-            "fatos relevantes concessionárias energia Brasil",
-            "ANEEL últimas notícias",
-            "leilão de transmissão energia"
-        ]
-        results = []
-        with DDGS() as ddgs:
-            for query in queries:
-                search_results = [r for r in ddgs.news(query, region='br-pt', timelimit='m', max_results=5)]
-                results.extend(search_results)
-                time.sleep(2)
-        unique_results = {result['url']: result for result in results}.values()
-        return list(unique_results)
 
-    def _get_article_text(self, url):
-        """Extrai o texto principal de uma página web."""
+class _StreamingStory(list):
+    """Story do platypus alimentada por um gerador: o reportlab consome os flowables do início da lista e
+    a consulta 'len' a cada passo, momento em que ela é reabastecida. Só alguns flowables ficam em memória."""
+    def __init__(self, flowables, prefetch=2):
+        super().__init__()
+        self._source = iter(flowables)
+        self._prefetch = prefetch
+
+    def __len__(self):
+        while self._source is not None and super().__len__() < self._prefetch:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return super().__len__()
+
+
+def render_report_spec(spec, progress_queue=None):
+    """Renderiza a especificação em PDF (executado nos processos do ReportService). Retorna um resumo do resultado."""
+    started = time.perf_counter()
+    doc = SimpleDocTemplate(spec['file_path'], pagesize=A4,
+                            rightMargin=72, leftMargin=72,
+                            topMargin=90, bottomMargin=72)
+    styles = PDF_ASSETS.styles()
+    story = _StreamingStory(_report_flowables(spec['blocks'], styles))
+    generated_at = f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}"
+
+    def header_footer(canvas, doc):
+        canvas.saveState()
         try:
-            response = requests.get(url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'lxml')
-            for script_or_style in soup(["script", "style", "header", "footer", "nav"]):
-                script_or_style.decompose()
-            text = soup.get_text()
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            return text
+            PDF_ASSETS.draw_logo(canvas, doc.leftMargin, A4[1] - 1.0 * inch)
         except Exception as e:
-            print(f"Erro ao buscar conteúdo de {url}: {e}")
-            return None
+            print(f"Erro ao desenhar logo no PDF: {e}")
+
+        canvas.setFont('Helvetica', 9)
+        canvas.drawRightString(A4[0] - doc.rightMargin, A4[1] - 0.75 * inch, generated_at)
+
+        if spec.get('signature'):
+            canvas.setFont('Helvetica', 10)
+            canvas.drawString(doc.leftMargin, 0.75 * inch, "_________________________________________")
+            canvas.drawString(doc.leftMargin, 0.5 * inch, "Assinatura da Diretoria")
+        canvas.restoreState()
+        if progress_queue is not None:
+            progress_queue.put((spec.get('job_id'), doc.page))
+
+    doc.build(story, onFirstPage=header_footer, onLaterPages=header_footer)
+    return {'file_path': spec['file_path'], 'pages': doc.page, 'seconds': time.perf_counter() - started}
+
+
+def benchmark_pdf_reports(pages=200, runs=3):
+    """Mede a renderização de um histórico de interações sintético com cerca de 'pages' páginas (mesmo processo)."""
+    tipos = ['Reunião', 'Ligação', 'E-mail', 'Movimentação', 'Visita']
+    interactions = [{
+        'data_interacao': (datetime(2020, 1, 1) + timedelta(days=i)).strftime('%Y-%m-%d'),
+        'tipo': tipos[i % len(tipos)], 'usuario': f"Usuário {i % 7}",
+        'resumo': f"Interação {i}: alinhamento com o cliente sobre escopo, equipes e cronograma de mobilização.",
+    } for i in range(pages * 13)]
+    op_data = {'titulo': "Benchmark de Relatório", 'nome_empresa': "Cliente Sintético"}
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for run in range(runs):
+            spec = build_interactions_spec(op_data, interactions, os.path.join(tmp_dir, f"interacoes_{run}.pdf"))
+            info = render_report_spec(spec)
+            results.append({'execucao': run + 1, 'paginas': info['pages'], 'segundos': round(info['seconds'], 3)})
+            print(results[-1])
+    return results
+
+
+def _equipes_table_rows(priced, header):
+    """Linhas da tabela de equipes de um serviço (linhas de price_teams), com os valores calculados."""
+    rows = [header]
+    for equipe in priced.itertuples(index=False):
+        rows.append([
+            ('p', equipe.tipo_equipe),
+            equipe.quantidade,
+            equipe.volumetria,
+            equipe.base,
+            ('p', equipe.empresa_referencia or 'N/A'),
+            format_currency(equipe.valor_total),
+            format_currency(equipe.valor_unitario)
+        ])
+    return rows
+
+
+def _op_value(op_data, key, default="---"):
+    return op_data[key] if key in op_data.keys() and op_data[key] else default
+
+
+def build_analise_previa_spec(snapshot, file_path):
+    op_data = snapshot.opportunity
+    blocks = [
+        ('paragraph', "Análise Prévia de Viabilidade", 'h1'), ('spacer', 12),
+        ('paragraph', f"Oportunidade: {op_data['titulo']}", 'h2'), ('spacer', 24),
+        ('paragraph', "1. Informações Básicas", 'h3'), ('spacer', 12),
+        ('table', [
+            ['Cliente:', op_data['nome_empresa']],
+            ['Estágio:', op_data['estagio_nome']],
+            ['Valor Estimado:', format_currency(op_data['valor'])],
+            ['Tempo de Contrato:', f"{op_data['tempo_contrato_meses']} meses" if _op_value(op_data, 'tempo_contrato_meses', None) else "---"],
+            ['Regional:', _op_value(op_data, 'regional')],
+            ['Polo:', _op_value(op_data, 'polo')],
+        ], [1.5, 4.5], 'kv', 0),
+        ('spacer', 24),
+        ('paragraph', "2. Formulário de Análise de Qualificação", 'h3'), ('spacer', 12),
+    ]
 
-    def _check_relevance_batch(self, news_items):
-        """Verifica a relevância de uma lista de notícias em uma única chamada de API."""
-        if not self.model or not news_items:
-            return []
+    qualificacao_data_json = _op_value(op_data, 'qualificacao_data', None)
+    if qualificacao_data_json:
+        try:
+            qualificacao_answers = json.loads(qualificacao_data_json)
+            for section, questions in QUALIFICATION_CHECKLIST.items():
+                blocks += [('paragraph', f"<b>{section}</b>", 'h4'), ('spacer', 6)]
+                if section == "Análise Concorrencial e de Riscos":
+                    # Esta seção usa respostas em texto livre
+                    for question in questions:
+                        blocks += [('paragraph', f"<b>{question}</b>", 'BodyText'), ('spacer', 4)]
+                        if question == "Quais são nossos diferenciais competitivos claros para esta oportunidade específica?":
+                            answer = _op_value(op_data, 'diferenciais_competitivos')
+                        elif question == "Quais os principais riscos (técnicos, logísticos, regulatórios, políticos) associados ao projeto?":
+                            answer = _op_value(op_data, 'principais_riscos')
+                        else:
+                            answer = "Não aplicável"
+                        blocks += [('paragraph', answer.replace('\n', '<br/>'), 'Justify'), ('spacer', 12)]
+                else:
+                    question_rows = [[('p', question), qualificacao_answers.get(question, "Não respondido")] for question in questions]
+                    blocks += [('table', question_rows, [5, 1], 'qualificacao', 0), ('spacer', 12)]
+        except (json.JSONDecodeError, TypeError):
+            blocks.append(('paragraph', "Erro ao carregar dados de qualificação.", 'BodyText'))
+    else:
+        blocks.append(('paragraph', "Dados de qualificação não preenchidos.", 'BodyText'))
+    blocks += [('spacer', 24), ('paragraph', "3. Bases Alocadas", 'h3'), ('spacer', 12)]
+
+    bases_nomes_json = _op_value(op_data, 'bases_nomes', None)
+    if bases_nomes_json:
+        try:
+            bases_nomes = json.loads(bases_nomes_json)
+            if bases_nomes:
+                blocks += [('paragraph', f"- {base}", 'BodyText') for base in bases_nomes]
+            else:
+                blocks.append(('paragraph', "Nenhuma base alocada.", 'BodyText'))
+        except (json.JSONDecodeError, TypeError):
+            blocks.append(('paragraph', "Erro ao carregar nomes de bases.", 'BodyText'))
+    else:
+        blocks.append(('paragraph', "Nenhuma base alocada.", 'BodyText'))
+    blocks += [('spacer', 24), ('paragraph', "4. Serviços e Equipes", 'h3'), ('spacer', 12)]
+
+    servicos_data_json = _op_value(op_data, 'servicos_data', None)
+    if servicos_data_json:
+        try:
+            servicos_data = json.loads(servicos_data_json)
+            if servicos_data:
+                header = ['Tipo de Equipe', 'Qtd', 'Vol.', 'Base', 'Empresa Ref.', 'Valor Total', 'Valor US/UPS']
+                priced = price_teams(team_table(servicos_data), snapshot.reference_prices)
+                for idx, servico_info in enumerate(servicos_data):
+                    blocks.append(('paragraph', f"<b>Serviço: {servico_info.get('servico_nome', 'N/A')}</b>", 'h4'))
+                    equipes = priced[priced['servico_idx'] == idx]
+                    if not equipes.empty:
+                        rows = _equipes_table_rows(equipes, header)
+                        # Nesta análise os valores também quebram linha dentro da célula
+                        rows[1:] = [row[:5] + [('p', row[5]), ('p', row[6])] for row in rows[1:]]
+                        blocks += [('table', rows, [1.4, 0.4, 0.5, 0.7, 1.6, 0.9, 0.9], 'equipes', 0), ('spacer', 12)]
+                    else:
+                        blocks.append(('paragraph', "Nenhuma equipe configurada para este serviço.", 'BodyText'))
+            else:
+                blocks.append(('paragraph', "Nenhum serviço configurado.", 'BodyText'))
+        except (json.JSONDecodeError, TypeError):
+            blocks.append(('paragraph', "Erro ao carregar dados de serviços.", 'BodyText'))
+    else:
+        blocks.append(('paragraph', "Nenhum serviço configurado.", 'BodyText'))
+
+    return {'kind': 'analise_previa', 'title': "Análise Prévia de Viabilidade", 'file_path': file_path,
+            'signature': True, 'blocks': blocks}
+
+
+def build_interactions_spec(op_data, interactions, file_path):
+    """interactions: lista de interações ou a consulta {'db_name', 'op_id', 'tipo', 'start_date', 'end_date'},
+    lida em páginas pelo processo que renderiza o PDF."""
+    blocks = [
+        ('paragraph', "Histórico de Interações", 'h1'), ('spacer', 12),
+        ('paragraph', f"Oportunidade: {op_data['titulo']}", 'h2'),
+        ('paragraph', f"Cliente: {op_data['nome_empresa']}", 'h3'), ('spacer', 24),
+        ('interactions', interactions),
+    ]
+    return {'kind': 'interacoes', 'title': "Histórico de Interações", 'file_path': file_path,
+            'signature': False, 'blocks': blocks}
 
-        titles_with_indices = [f'{i}: {item["title"]}' for i, item in enumerate(news_items)]
-        titles_text = "\n".join(titles_with_indices)
 
-        prompt = f'''
-        Você é um analista do setor de energia. Abaixo está uma lista de títulos de notícias, cada um com um índice. Sua tarefa é identificar quais notícias são relevantes para uma empresa de engenharia elétrica no Brasil.
+def export_interactions_table(source, file_path):
+    """Grava as interações (lista ou consulta, como em build_interactions_spec) em CSV, XLSX ou Parquet, conforme
+    a extensão, página a página. Retorna o número de interações exportadas."""
+    return write_spreadsheet(INTERACTION_EXPORT_COLUMNS, iter_interaction_pages(source), file_path)
 
-        **Critérios de Relevância:**
-        - Relevante: Notícias sobre leilões de energia, construção/manutenção de linhas de transmissão ou distribuição, investimentos, mudanças regulatórias da ANEEL, ou sobre grandes concessionárias (Neoenergia, CPFL, Eletrobras, etc.).
-        - Não Relevante: Notícias genéricas de economia, política não relacionada, ou outros setores.
 
-        **Lista de Títulos:**
-        {titles_text}
+def _servicos_blocks(servicos_data_json, reference_prices, empty_team_text, decode_errors):
+    """Blocos da seção de serviços (um bloco indivisível por serviço), usados nos sumários executivos."""
+    blocks = []
+    if not servicos_data_json:
+        return [('paragraph', "Nenhum serviço configurado.", 'BodyText')]
+    try:
+        servicos_data = json.loads(servicos_data_json)
+    except decode_errors:
+        return None
+    if not servicos_data:
+        return [('paragraph', "Nenhum serviço configurado.", 'BodyText')]
+    header = ['Tipo de Equipe', 'Qtd', 'Vol.', 'Base', 'Empresa Ref.', 'Valor Total\npor Tipo de Equipe', 'Valor\nUS/UPS/UPE']
+    priced = price_teams(team_table(servicos_data), reference_prices)
+    for idx, servico_info in enumerate(servicos_data):
+        servico_block = [('paragraph', f"<b>Serviço: {servico_info.get('servico_nome', 'N/A')}</b>", 'h4')]
+        equipes = priced[priced['servico_idx'] == idx]
+        if not equipes.empty:
+            servico_block.append(('table', _equipes_table_rows(equipes, header), [1.2, 0.4, 0.5, 0.6, 1.6, 1.4, 1.2], 'equipes', 0))
+        else:
+            servico_block.append(('paragraph', empty_team_text, 'BodyText'))
+        blocks += [('keep', servico_block), ('spacer', 12)]
+    return blocks
+
+
+def build_sumario_executivo_spec(snapshot, file_path):
+    op_data = snapshot.opportunity
+    blocks = [
+        ('paragraph', "Sumário Executivo", 'h1'), ('spacer', 12),
+        ('paragraph', f"Oportunidade: {_op_value(op_data, 'titulo', 'N/A')}", 'h2'), ('spacer', 24),
+        ('keep', [
+            ('paragraph', "1. Informações do Edital", 'h3'), ('spacer', 12),
+            ('table', [
+                ['Número do Edital:', _op_value(op_data, 'numero_edital')],
+                ['Data de Abertura:', _op_value(op_data, 'data_abertura')],
+                ['Modalidade:', _op_value(op_data, 'modalidade')],
+                ['Contato Principal:', _op_value(op_data, 'contato_principal')],
+                ['Link dos Documentos:', _op_value(op_data, 'link_documentos')],
+            ], [1.5, 4.5], 'kv', 0),
+        ]),
+        ('spacer', 24),
+        ('keep', [
+            ('paragraph', "2. Informações Financeiras e de Pessoal", 'h3'), ('spacer', 12),
+            ('table', [
+                ['Faturamento Estimado:', format_currency(_op_value(op_data, 'faturamento_estimado', None))],
+                ['Duração do Contrato:', f"{op_data['duracao_contrato']} meses" if _op_value(op_data, 'duracao_contrato', None) else "---"],
+                ['MOD (Mão de Obra Direta):', _op_value(op_data, 'mod')],
+                ['MOI (Mão de Obra Indireta):', _op_value(op_data, 'moi')],
+                ['Total de Pessoas:', _op_value(op_data, 'total_pessoas')],
+                ['Margem de Contribuição:', f"{op_data['margem_contribuicao']}%" if _op_value(op_data, 'margem_contribuicao', None) else "---"],
+            ], [2, 4], 'kv', 0),
+        ]),
+        ('spacer', 24),
+    ]
 
-        **Sua Tarefa:**
-        Responda APENAS com um objeto JSON contendo uma única chave "indices_relevantes", que é uma lista de números (inteiros) correspondendo aos índices dos títulos que você considerou relevantes.
-        Exemplo de Resposta:
-        {{
-          "indices_relevantes": [0, 4, 15]
-        }}
-        '''
-        try:
-            response = self.model.generate_content(prompt)
-            # Extrair o JSON da resposta
-            if '```json' in response.text:
-                json_str = response.text.split('```json')[1].split('```')[0].strip()
-            else:
-                json_str = response.text
+    servicos = _servicos_blocks(_op_value(op_data, 'servicos_data', None), snapshot.reference_prices,
+                                "Nenhuma equipe configurada para este serviço.", (json.JSONDecodeError, TypeError))
+    if servicos is None:
+        servicos = [('paragraph', "Erro ao carregar dados de serviços.", 'BodyText')]
+    blocks += [('keep', [('paragraph', "3. Detalhes de Serviços e Preços", 'h3'), ('spacer', 12)] + servicos), ('spacer', 24)]
 
-            data = json.loads(json_str)
-            return data.get("indices_relevantes", [])
-        except (json.JSONDecodeError, KeyError, Exception) as e:
-            print(f"Erro ao checar relevância em lote: {e}")
-            return []
+    descricao = _op_value(op_data, 'descricao_detalhada', 'Nenhuma descrição fornecida.')
+    blocks += [
+        ('keep', [('paragraph', "4. Descrição Detalhada", 'h3'), ('spacer', 12), ('paragraph', descricao.replace('\n', '<br/>'), 'BodyText')]),
+        ('spacer', 48),
+    ]
+    return {'kind': 'sumario_executivo', 'title': "Sumário Executivo", 'file_path': file_path,
+            'signature': True, 'blocks': blocks}
+
+
+def build_termo_aditivo_spec(termo, op_data, reference_prices, file_path):
+    termo = dict(termo)
+    blocks = [
+        ('paragraph', "Sumário Executivo - Termo Aditivo", 'h1'), ('spacer', 12),
+        ('paragraph', f"Oportunidade: {op_data['titulo']}", 'h2'), ('spacer', 24),
+        ('paragraph', "1. Informações do Termo", 'h3'), ('spacer', 12),
+        ('table', [
+            ['Número do Termo:', termo['numero_termo']],
+            ['Data Assinatura:', termo['data_assinatura']],
+            ['Tipo de Alteração:', termo['tipo_alteracao']],
+            ['Prazo Adicionado:', f"{termo['prazo_adicionado_meses']} meses"],
+            ['Valor do Aditivo (Capa):', format_currency(termo.get('valor_aditivo_capa', 0))],
+            ['Valor Adicionado Mensal:', format_currency(termo['valor_adicionado_mensal'])],
+            ['Valor Global do Aditivo:', format_currency(termo['valor_global_aditivo'])],
+        ], [2, 4], 'kv', 0),
+        ('spacer', 24),
+        ('paragraph', "2. Detalhes de Serviços e Equipes (Aditivo)", 'h3'), ('spacer', 12),
+    ]
+    servicos = _servicos_blocks(termo['servicos_data'], reference_prices,
+                                "Nenhuma equipe configurada.", json.JSONDecodeError)
+    blocks += servicos if servicos is not None else [('paragraph', "Erro nos dados de serviços.", 'BodyText')]
+    obs = termo['observacoes'] if termo['observacoes'] else "Sem observações."
+    blocks += [
+        ('spacer', 24),
+        ('paragraph', "3. Observações", 'h3'), ('spacer', 12),
+        ('paragraph', obs.replace('\n', '<br/>'), 'BodyText'),
+    ]
+    return {'kind': 'termo_aditivo', 'title': "Sumário Executivo do Termo Aditivo", 'file_path': file_path,
+            'signature': True, 'blocks': blocks}
 
-    def _get_summary(self, text, title):
-        """Gera o resumo para um único artigo já considerado relevante."""
-        if not self.model:
-            return "Resumo não disponível (API não configurada)."
 
-        prompt = f'''
-        Resuma a seguinte notícia em 2 a 3 frases, focando no impacto para o setor de engenharia elétrica.
+class ReportService:
+    """Renderiza relatórios em um pool de processos, fora da thread da interface.
 
-        Título: "{title}"
-        Conteúdo: "{text[:10000]}"
-        '''
-        try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
-        except Exception as e:
-            print(f"Erro ao gerar resumo para '{title}': {e}")
-            return "Não foi possível gerar o resumo."
+    submit() devolve o id do trabalho; poll() (chamado periodicamente pela interface) repassa o progresso
+    (páginas já montadas) e a conclusão de cada trabalho aos callbacks informados."""
+    def __init__(self, max_workers=PDF_RENDER_WORKERS):
+        self.max_workers = max_workers
+        self.executor = None
+        self.manager = None
+        self.progress_queue = None
+        self.jobs = {}
+        self._next_id = 1
 
-    def fetch_and_store_news(self):
-        """Orquestra o processo de busca e armazenamento de notícias de forma eficiente."""
-        news_items = self._search_news()
-        if not news_items:
-            return
+    def _ensure_pool(self):
+        if self.executor is None:
+            try:
+                self.manager = multiprocessing.Manager()
+                self.progress_queue = self.manager.Queue()
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            except (OSError, RuntimeError) as e:
+                # Sem suporte a processos (ambiente restrito): renderiza em threads
+                print(f"Aviso: pool de processos indisponível ({e}); usando threads para os PDFs.")
+                self.progress_queue = queue.Queue()
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, spec, on_progress=None, on_done=None):
+        self._ensure_pool()
+        job_id = self._next_id
+        self._next_id += 1
+        spec = dict(spec, job_id=job_id)
+        future = self.executor.submit(render_report_spec, spec, self.progress_queue)
+        self.jobs[job_id] = {'spec': spec, 'future': future, 'on_progress': on_progress, 'on_done': on_done, 'pages': 0}
+        return job_id
+
+    @property
+    def pending(self):
+        return len(self.jobs)
+
+    def poll(self):
+        """Processa progresso e conclusões pendentes; deve rodar na thread da interface."""
+        while self.progress_queue is not None:
+            try:
+                job_id, page = self.progress_queue.get_nowait()
+            except (queue.Empty, EOFError, OSError):
+                break
+            job = self.jobs.get(job_id)
+            if job:
+                job['pages'] = page
+                if job['on_progress']:
+                    job['on_progress'](job_id, page)
+        for job_id, job in list(self.jobs.items()):
+            if not job['future'].done():
+                continue
+            del self.jobs[job_id]
+            try:
+                result, error = job['future'].result(), None
+            except Exception as e:
+                result, error = None, e
+            if job['on_done']:
+                job['on_done'](job_id, job['spec'], result, error)
 
-        relevant_indices = self._check_relevance_batch(news_items)
-        if not relevant_indices:
-            self.db.delete_old_unsaved_news()
-            return
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.manager is not None:
+            self.manager.shutdown()
 
-        relevant_articles = [news_items[i] for i in relevant_indices if i < len(news_items)]
 
-        for item in relevant_articles:
-            url = item.get('url')
-            title = item.get('title')
+BATCH_REPORT_KINDS = {
+    'sumario_executivo': ("Sumário Executivo", build_sumario_executivo_spec),
+    'analise_previa': ("Análise Prévia", build_analise_previa_spec),
+}
 
-            article_text = self._get_article_text(url)
-            if not article_text:
-                time.sleep(4)
-                continue
 
-            summary = self._get_summary(article_text, title)
+def _safe_filename(text):
+    return re.sub(r'[^\w\-]+', '_', str(text or ''), flags=re.UNICODE).strip('_')[:80] or 'SemTitulo'
+
+
+def _render_table_of_contents(entries, file_path, first_page_offset):
+    """Sumário do documento consolidado; entries: (título, oportunidade, cliente, página inicial relativa)."""
+    rows = [['Documento', 'Oportunidade', 'Cliente', 'Página']]
+    rows += [[title, ('p', escape(opportunity)), ('p', escape(client or '')), start + first_page_offset] for title, opportunity, client, start in entries]
+    spec = {'file_path': file_path, 'signature': False, 'blocks': [
+        ('paragraph', "Relatórios de Oportunidades", 'h1'), ('spacer', 6),
+        ('paragraph', f"{len(entries)} documentos", 'BodyText'), ('spacer', 18),
+        ('table', rows, [1.4, 2.6, 1.6, 0.6], 'interacoes', 1),
+    ]}
+    return render_report_spec(spec)['pages']
+
+
+def export_report_batch(db, filters, kinds, output_path, merged=False, workers=PDF_RENDER_WORKERS,
+                        on_progress=None, cancel_event=None, executor=None):
+    """Gera os PDFs ('kinds') de todas as oportunidades do filtro do Histórico, em paralelo.
+
+    Saída: uma pasta existente, um .zip com um PDF por documento ou, com merged=True, um único PDF com sumário
+    e marcadores (requer pypdf). Cada PDF é renderizado em disco por um processo (do 'executor' informado ou de
+    um pool próprio) e o número de trabalhos em andamento é limitado, de modo que, na pasta e no ZIP, a memória
+    não cresce com o tamanho do lote. O PDF único é montado pelo PdfWriter com todas as páginas em memória, por
+    isso é limitado a BATCH_MERGED_MAX_DOCUMENTS documentos. Oportunidades excluídas durante a exportação são
+    ignoradas e contadas em 'skipped'."""
+    if merged and PdfWriter is None:
+        raise RuntimeError("A exportação consolidada requer o pacote 'pypdf' (pip install pypdf).")
+    started = time.perf_counter()
+    oportunidades = db.get_historico_oportunidades(filters)
+    jobs = [(op, kind) for op in oportunidades for kind in kinds]
+    total = len(jobs)
+    if merged and total > BATCH_MERGED_MAX_DOCUMENTS:
+        raise ValueError(f"O PDF único aceita até {BATCH_MERGED_MAX_DOCUMENTS} documentos ({total} no lote). Use a exportação em ZIP.")
+    results = {}  # índice -> (info do PDF, título, oportunidade, cliente)
+
+    to_directory = not merged and os.path.isdir(output_path)
+
+    with contextlib.ExitStack() as stack:
+        tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        if executor is None:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+        render_dir = output_path if to_directory else tmp_dir
+        archive = zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) if not (merged or to_directory) else None
+        try:
+            pending = {}
+            next_job = 0
+            done_count = 0
+            skipped = 0
+            loaded = (None, None)  # (id, snapshot) da oportunidade atual: os documentos dela são consecutivos
+            while next_job < len(jobs) or pending:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise InterruptedError("Exportação em lote cancelada.")
+                # Mantém no máximo 2 trabalhos por processo em andamento
+                while next_job < len(jobs) and len(pending) < workers * 2:
+                    op, kind = jobs[next_job]
+                    title, build_spec = BATCH_REPORT_KINDS[kind]
+                    if loaded[0] != op['id']:
+                        loaded = (op['id'], OpportunityAggregate(db).load(op['id']))
+                    snapshot = loaded[1]
+                    if snapshot is None:
+                        # Excluída depois da consulta do lote (a exportação roda enquanto o usuário edita): pula
+                        next_job += 1
+                        skipped += 1
+                        total -= 1
+                        if on_progress:
+                            on_progress(done_count, max(total, 1), f"{title}: {op['numero_oportunidade']} (excluída, ignorada)")
+                        continue
+                    name = f"{_safe_filename(op['numero_oportunidade'])}_{kind}.pdf"
+                    if not to_directory:
+                        name = f"{next_job + 1:04d}_{name}"
+                    spec = build_spec(snapshot, os.path.join(render_dir, name))
+                    pending[executor.submit(render_report_spec, spec)] = (next_job, title, op)
+                    next_job += 1
+
+                finished, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, title, op = pending.pop(future)
+                    info = future.result()
+                    done_count += 1
+                    if archive is not None:
+                        archive.write(info['file_path'], arcname=os.path.basename(info['file_path']))
+                        os.remove(info['file_path'])
+                    results[index] = (info, title, f"{op['numero_oportunidade']} - {op['titulo']}", op['nome_empresa'])
+                    if on_progress:
+                        on_progress(done_count, total, f"{title}: {op['numero_oportunidade']}")
+        finally:
+            if archive is not None:
+                archive.close()
+
+        total_pages = sum(info['pages'] for info, *_ in results.values())
+        if merged:
+            ordered = [results[index] for index in sorted(results)]
+            entries, start = [], 1
+            for info, title, opportunity, client in ordered:
+                entries.append((title, opportunity, client, start))
+                start += info['pages']
+            toc_path = os.path.join(tmp_dir, 'sumario.pdf')
+            # A numeração depende do tamanho do próprio sumário: mede-o antes de gerar a versão final
+            toc_pages = _render_table_of_contents(entries, toc_path, 0)
+            _render_table_of_contents(entries, toc_path, toc_pages)
+            writer = PdfWriter()
+            writer.append(toc_path)
+            for info, title, opportunity, client in ordered:
+                writer.append(info['file_path'], outline_item=f"{title} - {opportunity}")
+            with open(output_path, 'wb') as f:
+                writer.write(f)
+            writer.close()
+            total_pages += toc_pages
+
+    return {'output': output_path, 'documents': total, 'skipped': skipped, 'pages': total_pages,
+            'seconds': time.perf_counter() - started}
+
+
+# --- 7. EXPORTAÇÃO E IMPORTAÇÃO DE PLANILHAS ---
+# As listagens das telas (Histórico, Eventos, Logs, Empresas Referência, Interações) são lidas do SQLite em páginas
+# de um cursor e gravadas em CSV, XLSX ou Parquet, com valores tipados (números e datas reais) em vez dos textos
+# formatados das tabelas. Colunas: (chave na linha do banco, título, tipo); tipos: 'text', 'int', 'float', 'money',
+# 'date', 'datetime' e 'bool'.
+
+EXPORT_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y')
+SPREADSHEET_FORMATS = {'.xlsx': "Planilha Excel", '.csv': "Arquivo CSV", '.parquet': "Apache Parquet"}
+
+INTERACTION_EXPORT_COLUMNS = [
+    ('data_interacao', 'Data', 'datetime'), ('tipo', 'Tipo', 'text'), ('usuario', 'Usuário', 'text'),
+    ('contato_nome', 'Contato', 'text'), ('responsavel_institucional', 'Resp. Institucional', 'bool'),
+    ('resumo', 'Resumo', 'text'),
+]
 
-            article_data = {
-                'title': title,
-                'url': url,
-                'source': item.get('source'),
-                'content_summary': summary,
-                'published_date': ''
-            }
-            if item.get('date'):
-                try:
-                    dt_obj = datetime.fromisoformat(item['date'].replace('Z', '+00:00'))
-                    article_data['published_date'] = dt_obj.strftime('%Y-%m-%d')
-                except ValueError:
-                    pass
+SPREADSHEET_DATASETS = {
+    'historico': ("Histórico de Oportunidades", [
+        ('numero_oportunidade', 'Nº Oport.', 'text'), ('titulo', 'Título', 'text'), ('nome_empresa', 'Cliente', 'text'),
+        ('estagio_nome', 'Estágio Atual', 'text'), ('valor', 'Valor (R$)', 'money'), ('data_criacao', 'Data Criação', 'date'),
+        ('ultimo_resultado', 'Último Resultado', 'text'),
+    ]),
+    'eventos': ("Eventos", [
+        ('numero_identificador', 'ID Evento', 'text'), ('tipo', 'Tipo', 'text'), ('cliente_nome', 'Cliente', 'text'),
+        ('oportunidade_titulo', 'Oportunidade', 'text'), ('valor', 'Valor (R$)', 'money'),
+        ('data_notificacao', 'Data Notif.', 'date'), ('data_desvio', 'Data Desvio', 'date'),
+        ('respondida', 'Respondida', 'bool'), ('data_resposta', 'Data Resposta', 'date'),
+        ('descricao_desvio', 'Descrição', 'text'),
+    ]),
+    'logs': ("Log do Sistema", [
+        ('timestamp', 'Data/Hora', 'datetime'), ('username', 'Usuário', 'text'), ('action', 'Ação', 'text'),
+        ('details', 'Detalhes', 'text'),
+    ]),
+    'carteira': ("Carteira de Contratos", [
+        ('numero_oportunidade', 'Nº Oport.', 'text'), ('titulo', 'Título', 'text'), ('nome_empresa', 'Cliente', 'text'),
+        ('estado', 'UF', 'text'), ('valor_original', 'Valor Original (R$)', 'money'),
+        ('quantidade_aditivos', 'Aditivos', 'int'), ('valor_aditivos', 'Valor Aditivos (R$)', 'money'),
+        ('valor_atual', 'Valor Atual (R$)', 'money'), ('run_rate_mensal', 'Run-rate Mensal (R$)', 'money'),
+        ('data_fim_atual', 'Fim Vigente', 'date'),
+    ]),
+    'empresas_referencia': ("Empresas Referência", [
+        ('id', 'ID', 'int'), ('nome_empresa', 'Empresa', 'text'), ('tipo_servico', 'Tipo de Serviço', 'text'),
+        ('tipo_equipe_nome', 'Tipo de Equipe', 'text'), ('estado', 'UF', 'text'), ('concessionaria', 'Concessionária', 'text'),
+        ('ano_referencia', 'Ano Ref.', 'int'), ('valor_mensal', 'Valor Mensal', 'money'),
+        ('volumetria_minima', 'Vol. Mínima', 'float'), ('valor_por_pessoa', 'Valor/Pessoa', 'money'),
+        ('valor_us_ups_upe_ponto', 'Valor US/UPS/UPE/Ponto', 'money'), ('ativa', 'Ativa', 'bool'),
+        ('observacoes', 'Obs.', 'text'),
+    ]),
+}
 
-            self.db.add_news_article(article_data)
-            time.sleep(4) # Respeitar o limite de RPM da API
 
-        self.db.delete_old_unsaved_news()
+def export_value(value, kind):
+    """Converte o valor do banco para o tipo da coluna; vazio ou inválido vira None (célula vazia)."""
+    if value is None or value == '':
+        return None
+    if kind in ('float', 'money'):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if kind == 'int':
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return None
+    if kind == 'bool':
+        return bool(value)
+    if kind in ('date', 'datetime'):
+        for date_format in EXPORT_DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(str(value).strip(), date_format)
+            except ValueError:
+                continue
+            return parsed.date() if kind == 'date' else parsed
+        return None
+    return str(value)
+
+
+def _typed_rows(columns, page):
+    for row in page:
+        keys = row.keys()
+        yield [export_value(row[key] if key in keys else None, kind) for key, _, kind in columns]
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'Sim' if value else 'Não'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float):
+        return str(value).replace('.', ',')
+    return value
+
+
+def _write_csv(columns, pages, file_path):
+    count = 0
+    # utf-8-sig para o Excel reconhecer a acentuação; ';' com vírgula decimal (padrão do Excel em pt-BR) e datas ISO
+    with open(file_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow([title for _, title, _ in columns])
+        for page in pages:
+            writer.writerows([_csv_value(value) for value in values] for values in _typed_rows(columns, page))
+            count += len(page)
+    return count
+
+
+def _write_xlsx(columns, pages, file_path, sheet_title):
+    if Workbook is None:
+        raise RuntimeError("A exportação para Excel requer o pacote 'openpyxl' (pip install openpyxl).")
+    number_formats = {'money': '#,##0.00', 'float': '#,##0.##', 'date': 'DD/MM/YYYY', 'datetime': 'DD/MM/YYYY HH:MM'}
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_title[:31])
+    sheet.append([title for _, title, _ in columns])
+    count = 0
+    for page in pages:
+        for values in _typed_rows(columns, page):
+            cells = []
+            for value, (_, _, kind) in zip(values, columns):
+                cell = WriteOnlyCell(sheet, value=value)
+                if value is not None and kind in number_formats:
+                    cell.number_format = number_formats[kind]
+                cells.append(cell)
+            sheet.append(cells)
+        count += len(page)
+    workbook.save(file_path)
+    return count
+
+
+def _write_parquet(columns, pages, file_path):
+    if pa is None:
+        raise RuntimeError("A exportação para Parquet requer o pacote 'pyarrow' (pip install pyarrow).")
+    arrow_types = {'text': pa.string(), 'int': pa.int64(), 'float': pa.float64(), 'money': pa.float64(),
+                   'date': pa.date32(), 'datetime': pa.timestamp('s'), 'bool': pa.bool_()}
+    schema = pa.schema([(title, arrow_types[kind]) for _, title, kind in columns])
+    count = 0
+    with pq.ParquetWriter(file_path, schema) as writer:
+        for page in pages:
+            rows = list(_typed_rows(columns, page))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)], schema=schema))
+            count += len(rows)
+        if count == 0:
+            writer.write_table(schema.empty_table())
+    return count
+
+
+def write_spreadsheet(columns, pages, file_path, sheet_title="Dados"):
+    """Grava páginas de linhas do banco no formato indicado pela extensão (.csv, .xlsx ou .parquet). Retorna o total de linhas."""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.xlsx':
+        return _write_xlsx(columns, pages, file_path, sheet_title)
+    if extension == '.parquet':
+        return _write_parquet(columns, pages, file_path)
+    if extension == '.csv':
+        return _write_csv(columns, pages, file_path)
+    raise ValueError(f"Formato de planilha não suportado: {extension or file_path}")
+
+
+def available_spreadsheet_formats():
+    """Extensões exportáveis neste ambiente (XLSX e Parquet dependem de pacotes opcionais)."""
+    return [ext for ext in SPREADSHEET_FORMATS
+            if (ext != '.xlsx' or Workbook is not None) and (ext != '.parquet' or pa is not None)]
+
+
+def export_dataset(db, name, file_path, filters=None, page_size=EXPORT_PAGE_SIZE):
+    """Exporta uma das listagens de SPREADSHEET_DATASETS, com os mesmos filtros da tela, direto do banco para o arquivo."""
+    title, columns = SPREADSHEET_DATASETS[name]
+    return write_spreadsheet(columns, db.iter_dataset(name, filters, page_size), file_path, sheet_title=title)
+
+
+DASHBOARD_AGGREGATES = {
+    'oportunidades_por_cliente': 'get_opportunity_stats_by_client',
+    'clientes_por_setor': 'get_client_count_by_setor',
+    'clientes_por_segmento': 'get_client_count_by_segmento',
+    'oportunidades_por_estagio': 'get_opportunity_count_by_stage',
+    'interacoes_por_oportunidade': 'get_interaction_count_by_opportunity',
+}
+
+
+def export_dashboard_aggregates(db, file_path):
+    """Grava em JSON os agregados exibidos no Dashboard de Análise. Retorna o número de linhas gravadas."""
+    data = {name: [dict(row) for row in getattr(db, method)()] for name, method in DASHBOARD_AGGREGATES.items()}
+    for name, frame in pipeline_velocity_report(db).items():
+        data[name] = json.loads(frame.reset_index().to_json(orient='records', force_ascii=False))
+    forecast = PIPELINE_FORECASTER.forecast(db)
+    data['previsao_receita'] = json.loads(forecast['totais'].join(forecast['curva']).reset_index().to_json(orient='records', force_ascii=False))
+    data['gerado_em'] = datetime.now().isoformat(timespec='seconds')
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return sum(len(rows) for name, rows in data.items() if name != 'gerado_em')
+
+
+# Importação de tabelas de preço das concessionárias (Empresas Referência), em CSV ou XLSX.
+# Cabeçalhos são reconhecidos pelos títulos da exportação ou pelos nomes dos campos, sem diferenciar acentos e
+# maiúsculas. A chave de uma referência é (empresa, serviço, tipo de equipe, UF, concessionária, ano): linhas com chave
+# já cadastrada atualizam a referência existente (a de menor id); as demais são inseridas.
+
+PRICE_IMPORT_TEXT_FIELDS = ('nome_empresa', 'tipo_servico', 'tipo_equipe', 'estado', 'concessionaria', 'ano_referencia', 'observacoes')
+PRICE_IMPORT_NUMBER_FIELDS = ('valor_mensal', 'volumetria_minima', 'valor_por_pessoa', 'valor_us_ups_upe_ponto')
+PRICE_IMPORT_REQUIRED = ('nome_empresa', 'tipo_servico', 'valor_mensal')
+PRICE_IMPORT_KEY = ('nome_empresa', 'tipo_servico', 'tipo_equipe_id', 'estado', 'concessionaria', 'ano_referencia')
+PRICE_IMPORT_COMPARED = PRICE_IMPORT_NUMBER_FIELDS + ('ativa', 'observacoes')
+PRICE_IMPORT_INSERT_COLUMNS = PRICE_IMPORT_KEY + PRICE_IMPORT_COMPARED
+PRICE_IMPORT_TRUE = {'1', 'sim', 's', 'true', 'verdadeiro', 'x', 'ativa', 'ativo'}
+PRICE_IMPORT_FALSE = {'0', 'nao', 'n', 'false', 'falso', 'inativa', 'inativo'}
+
+PRICE_IMPORT_PREVIEW_ROWS = 500
+PRICE_IMPORT_REPORT_COLUMNS = [
+    ('linha', 'Linha', 'int'), ('acao', 'Ação', 'text'), ('nome_empresa', 'Empresa', 'text'),
+    ('tipo_servico', 'Tipo de Serviço', 'text'), ('tipo_equipe', 'Tipo de Equipe', 'text'), ('estado', 'UF', 'text'),
+    ('concessionaria', 'Concessionária', 'text'), ('ano_referencia', 'Ano Ref.', 'text'), ('detalhes', 'Detalhes', 'text'),
+]
 
 
-# --- 6. APLICAÇÃO PRINCIPAL ---
+def _header_key(text):
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    return re.sub(r'[^a-z0-9]', '', ''.join(char for char in text if not unicodedata.combining(char)))
+
+
+def _price_import_aliases():
+    """Cabeçalho normalizado -> campo da importação (títulos da exportação de Empresas Referência e nomes dos campos)."""
+    fields = set(PRICE_IMPORT_TEXT_FIELDS + PRICE_IMPORT_NUMBER_FIELDS) | {'ativa'}
+    aliases = {_header_key(field): field for field in fields}
+    for key, title, _ in SPREADSHEET_DATASETS['empresas_referencia'][1]:
+        field = 'tipo_equipe' if key == 'tipo_equipe_nome' else key
+        if field in fields:
+            aliases[_header_key(title)] = field
+    aliases.update({'empresa': 'nome_empresa', 'servico': 'tipo_servico', 'equipe': 'tipo_equipe', 'uf': 'estado', 'ano': 'ano_referencia'})
+    return aliases
+
+
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def _xlsx_column(ref):
+    return _xlsx_column_index(ref.rstrip('0123456789'))
+
+
+@functools.lru_cache(maxsize=None)
+def _xlsx_column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def read_xlsx_rows(file_path):
+    """Linhas da primeira aba de um .xlsx lidas do XML em fluxo (o openpyxl leva dezenas de segundos para 100 mil
+    linhas). Gera (número da linha, valores): textos, números (float) e booleanos; células vazias são None."""
+    with zipfile.ZipFile(file_path) as archive:
+        workbook = etree.fromstring(archive.read('xl/workbook.xml'))
+        sheet_id = workbook.find(f'{XLSX_NS}sheets/{XLSX_NS}sheet').get(f'{XLSX_REL_NS}id')
+        relations = etree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        target = next(rel.get('Target') for rel in relations if rel.get('Id') == sheet_id)
+        sheet_path = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+
+        shared = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            with archive.open('xl/sharedStrings.xml') as f:
+                for _, item in etree.iterparse(f, tag=f'{XLSX_NS}si'):
+                    shared.append(''.join(text.text or '' for text in item.iter(f'{XLSX_NS}t')))
+                    item.clear()
+
+        value_tag, text_tag = f'{XLSX_NS}v', f'{XLSX_NS}t'
+        with archive.open(sheet_path) as f:
+            line = 0
+            for _, row in etree.iterparse(f, tag=f'{XLSX_NS}row'):
+                line = int(row.get('r') or line + 1)
+                values = []
+                for cell in row:
+                    ref = cell.get('r')
+                    if ref:
+                        values.extend([None] * (_xlsx_column(ref) - len(values)))
+                    kind = cell.get('t')
+                    # O valor costuma ser o primeiro filho; em fórmulas, o <v> vem depois do <f>
+                    raw = None
+                    if len(cell):
+                        raw = cell[0].text if cell[0].tag == value_tag else cell.findtext(value_tag)
+                    if kind == 'inlineStr':
+                        value = ''.join(text.text or '' for text in cell.iter(text_tag))
+                    elif not raw:
+                        value = None
+                    elif kind == 's':
+                        value = shared[int(raw)]
+                    elif kind == 'b':
+                        value = raw == '1'
+                    elif kind in ('str', 'e'):
+                        value = raw
+                    else:
+                        value = float(raw)
+                    values.append(value)
+                # Descarta as linhas já lidas para a árvore não crescer (e a iteração não desacelerar)
+                row.clear()
+                while row.getprevious() is not None:
+                    del row.getparent()[0]
+                yield line, values
+
+
+def read_price_table(file_path):
+    """Lê a planilha (.csv com ';' ou ',', ou .xlsx) com as colunas renomeadas para os campos da importação.
+    O índice do resultado é o número da linha na planilha (cabeçalho = 1); linhas em branco são descartadas."""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        with open(file_path, encoding='utf-8-sig', newline='') as f:
+            header = f.readline()
+        raw = pd.read_csv(file_path, sep=';' if header.count(';') >= header.count(',') else ',', dtype=str,
+                          keep_default_na=False, skip_blank_lines=False, encoding='utf-8-sig')
+        raw.index = raw.index + 2
+    elif extension == '.xlsx':
+        rows = read_xlsx_rows(file_path)
+        _, header = next(rows, (1, []))
+        lines, values = [], []
+        for line, row in rows:
+            lines.append(line)
+            values.append(row[:len(header)] + [None] * (len(header) - len(row)))
+        raw = pd.DataFrame(values, index=lines, dtype=object,
+                           columns=[str(title) if title is not None else f"coluna_{i}" for i, title in enumerate(header)])
+    else:
+        raise ValueError(f"Formato de planilha não suportado para importação: {extension or file_path}")
+    raw = raw[raw.apply(lambda column: column.notna() & column.astype(str).str.strip().ne('')).any(axis=1)]
+
+    aliases = _price_import_aliases()
+    mapped = {column: aliases[_header_key(column)] for column in raw.columns if _header_key(column) in aliases}
+    table = raw[list(mapped)].rename(columns=mapped)
+    table = table.loc[:, ~table.columns.duplicated()]
+    missing = [field for field in PRICE_IMPORT_REQUIRED if field not in table.columns]
+    if missing:
+        raise ValueError(f"Coluna(s) obrigatória(s) ausente(s) na planilha: {', '.join(missing)}")
+    return table
+
+
+def _text_column(values):
+    text = values.where(values.notna(), '').astype(str).str.strip()
+    return text.str.replace(r'^(\d+)\.0$', r'\1', regex=True)  # números inteiros lidos do Excel como float (ex.: ano)
+
+
+def _number_column(values):
+    """Números de células do Excel ou textos ('1.234,56', 'R$ 1234.56', '1234.5'); vazio vale 0.
+    Retorna (valores, máscara de inválidos)."""
+    is_text = values.map(type).eq(str)
+    text = values.where(is_text, '').str.replace('R$', '', regex=False).str.replace(r'\s', '', regex=True)
+    brazilian = text.str.contains(',', regex=False) | text.str.fullmatch(r'-?\d{1,3}(\.\d{3})+')
+    text = text.where(~brazilian, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    numbers = pd.to_numeric(text.where(is_text), errors='coerce')
+    numbers = numbers.where(is_text, pd.to_numeric(values.where(~is_text), errors='coerce'))
+    blank = (is_text & text.eq('')) | values.isna()
+    return numbers.where(~blank, 0.0).astype(float), numbers.isna() & ~blank
+
+
+def _price_changes(merged, fields):
+    """Compara os campos da planilha com as colunas '<campo>_atual' do cadastro.
+    Retorna (descrição das alterações, máscara das linhas alteradas)."""
+    changes = pd.Series('', index=merged.index)
+    changed_any = pd.Series(False, index=merged.index)
+    for field in fields:
+        new, old = merged[field], merged[f"{field}_atual"]
+        if field in PRICE_IMPORT_NUMBER_FIELDS:
+            # Valor vazio no cadastro (NULL) equivale à célula em branco da planilha, lida como 0
+            old = pd.to_numeric(old, errors='coerce').fillna(0.0)
+            changed = ~np.isclose(new.to_numpy(dtype=float), old.to_numpy(dtype=float), rtol=0, atol=0.005)
+            changed = pd.Series(changed, index=merged.index)
+        elif field == 'ativa':
+            changed = pd.to_numeric(old, errors='coerce').fillna(1).astype(int).ne(new)
+        else:
+            old = _text_column(old)
+            changed = old.ne(new)
+        changed_any |= changed
+        changes = changes.where(~changed, changes + field + ": " + old.astype(str) + " → " + new.astype(str) + "; ")
+    return changes, changed_any
+
+
+def plan_price_import(db, table):
+    """Valida a planilha (em operações sobre colunas) e compara com o cadastro, sem gravar nada.
+    Retorna {'linhas', 'inserir', 'atualizar', 'inalteradas', 'erros', 'campos'}; 'atualizar' traz o id e as alterações."""
+    rows = pd.DataFrame({'linha': table.index.to_numpy()}, index=table.index)
+    errors = pd.Series('', index=table.index)
+
+    def flag(mask, message):
+        nonlocal errors
+        errors = errors.where(~mask, errors + message + '; ')
+
+    for field in PRICE_IMPORT_TEXT_FIELDS:
+        rows[field] = _text_column(table[field]) if field in table.columns else ''
+    flag(rows['nome_empresa'].eq(''), "empresa não informada")
+    flag(rows['tipo_servico'].eq(''), "tipo de serviço não informado")
+
+    servicos = {servico['nome'].lower(): servico['nome'] for servico in db.get_all_servicos()}
+    informed = rows['tipo_servico'].ne('')
+    rows['tipo_servico'] = rows['tipo_servico'].str.lower().map(servicos).fillna(rows['tipo_servico'])
+    flag(informed & ~rows['tipo_servico'].str.lower().isin(servicos), "tipo de serviço não cadastrado")
+
+    rows['estado'] = rows['estado'].str.upper()
+    flag(rows['estado'].ne('') & ~rows['estado'].isin(BRAZILIAN_STATES), "UF inválida")
+
+    # Tipo de equipe -> id: busca única em memória pelo par (serviço, equipe) e, se o nome for único, só pela equipe
+    team_types = pd.DataFrame([dict(team) for team in db.get_all_team_types()], columns=['id', 'nome', 'servico_nome'])
+    by_service = pd.Series(team_types['id'].to_numpy(),
+                           index=pd.MultiIndex.from_arrays([team_types['servico_nome'].str.lower(), team_types['nome'].str.lower()]))
+    by_service = by_service[~by_service.index.duplicated()]
+    names = team_types['nome'].str.lower()
+    by_name = pd.Series(team_types['id'].to_numpy(), index=names)[~names.duplicated(keep=False).to_numpy()]
+    wanted = pd.MultiIndex.from_arrays([rows['tipo_servico'].str.lower(), rows['tipo_equipe'].str.lower()])
+    team_ids = pd.Series(by_service.reindex(wanted).to_numpy(), index=rows.index)
+    team_ids = team_ids.fillna(rows['tipo_equipe'].str.lower().map(by_name))
+    flag(rows['tipo_equipe'].ne('') & team_ids.isna(), "tipo de equipe não encontrado para o serviço")
+    rows['tipo_equipe_id'] = team_ids.fillna(-1).astype(int)  # -1: sem tipo de equipe
+
+    for field in PRICE_IMPORT_NUMBER_FIELDS:
+        if field in table.columns:
+            rows[field], invalid = _number_column(table[field])
+            flag(invalid, f"{field} não numérico")
+        else:
+            rows[field] = 0.0
+    flag(_text_column(table['valor_mensal']).eq(''), "valor mensal não informado")
+
+    if 'ativa' in table.columns:
+        ativa = _text_column(table['ativa']).map(_header_key)
+        flag(ativa.ne('') & ~ativa.isin(PRICE_IMPORT_TRUE | PRICE_IMPORT_FALSE), "valor inválido em 'ativa'")
+        rows['ativa'] = (~ativa.isin(PRICE_IMPORT_FALSE)).astype(int)
+    else:
+        rows['ativa'] = 1
+
+    key = list(PRICE_IMPORT_KEY)
+    # Só os campos presentes na planilha são comparados e atualizados
+    fields = [field for field in PRICE_IMPORT_COMPARED if field in table.columns]
+    existing = db.get_empresas_referencia_frame()
+    for field in ('nome_empresa', 'tipo_servico', 'estado', 'concessionaria', 'ano_referencia'):
+        existing[field] = _text_column(existing[field])
+    existing['tipo_equipe_id'] = pd.to_numeric(existing['tipo_equipe_id'], errors='coerce').fillna(-1).astype(int)
+    existing = existing[key + ['id'] + list(PRICE_IMPORT_COMPARED)]
+
+    # Linhas iguais a um registro do cadastro não alteram nada, mesmo quando o cadastro já repete a chave
+    # (ex.: a própria exportação reimportada); as demais repetições da chave na planilha são erro
+    pairs = rows.merge(existing, on=key, how='inner', suffixes=('', '_atual'))
+    _, pair_changed = _price_changes(pairs, fields)
+    identical = rows['linha'].isin(pairs.loc[~pair_changed.to_numpy(), 'linha'])
+    first_line = rows.groupby(key, sort=False)['linha'].transform('first')
+    repeated = rows.duplicated(key, keep='first') & ~identical
+    errors = errors.where(~repeated, errors + "chave repetida na planilha (linha " + first_line.astype(str) + "); ")
+
+    invalid_rows = errors.ne('')
+    error_report = rows.loc[invalid_rows].assign(acao='erro', detalhes=errors[invalid_rows].str.rstrip('; '))
+    unchanged = identical & ~invalid_rows
+    valid = rows.loc[~invalid_rows & ~identical]
+
+    # Chave repetida no cadastro: a linha é comparada com (e atualiza) o registro de menor id
+    merged = valid.merge(existing.drop_duplicates(key, keep='first'), on=key, how='left', suffixes=('', '_atual'))
+    merged.index = valid.index
+
+    changes, changed_any = _price_changes(merged, fields)
+
+    found = merged['id'].notna()
+    inserts = merged.loc[~found].assign(acao='inserir', detalhes='')
+    updates = merged.loc[found & changed_any].assign(acao='atualizar', detalhes=changes[found & changed_any].str.rstrip('; '))
+    updates['id'] = updates['id'].astype(int)
+    return {'linhas': len(rows), 'inserir': inserts, 'atualizar': updates,
+            'inalteradas': int(unchanged.sum()) + int((found & ~changed_any).sum()),
+            'erros': error_report, 'campos': fields}
+
+
+def _none_if(values, empty):
+    return [None if value == empty else value for value in values]
+
+
+def apply_price_import(db, plan):
+    """Grava as inserções e atualizações de um plano de plan_price_import (linhas com erro são ignoradas)."""
+    inserts = plan['inserir']
+    insert_columns = [inserts[field].tolist() for field in PRICE_IMPORT_INSERT_COLUMNS]
+    for position, field in enumerate(PRICE_IMPORT_INSERT_COLUMNS):
+        if field == 'tipo_equipe_id':
+            insert_columns[position] = _none_if(insert_columns[position], -1)
+        elif field in ('estado', 'concessionaria', 'ano_referencia', 'observacoes'):
+            insert_columns[position] = _none_if(insert_columns[position], '')
+    updates = plan['atualizar']
+    update_rows = zip(*[updates[field].tolist() for field in plan['campos']], updates['id'].tolist())
+    db.apply_empresas_referencia_import(list(zip(*insert_columns)), list(update_rows), plan['campos'])
+    return len(inserts) + len(updates)
+
+
+def import_price_table(db, file_path, apply=False):
+    """Lê, valida e compara a planilha com o cadastro; com apply=True grava o resultado. Retorna o plano (ver
+    plan_price_import) com 'aplicado' e 'segundos'."""
+    started = time.perf_counter()
+    plan = plan_price_import(db, read_price_table(file_path))
+    if apply:
+        apply_price_import(db, plan)
+    plan.update(aplicado=apply, segundos=time.perf_counter() - started)
+    return plan
+
+
+def price_import_report_rows(plan):
+    """Linhas do relatório de diferenças (erros, inserções e atualizações), na ordem da planilha."""
+    report = pd.concat([plan['erros'], plan['inserir'], plan['atualizar']]).sort_values('linha', kind='stable')
+    report['tipo_equipe'] = report['tipo_equipe'].where(report['tipo_equipe'].ne(''), '---')
+    return report[[key for key, _, _ in PRICE_IMPORT_REPORT_COLUMNS]].to_dict('records')
+
+
+def write_price_import_report(plan, file_path):
+    """Grava o relatório de diferenças da importação como planilha (.csv, .xlsx ou .parquet)."""
+    return write_spreadsheet(PRICE_IMPORT_REPORT_COLUMNS, [price_import_report_rows(plan)], file_path, "Importação")
+
+
+# --- 8. APLICAÇÃO PRINCIPAL ---
 class CRMApp:
     def __init__(self, root):
         self.root = root
@@ -1650,6 +5139,15 @@ class CRMApp:
         self.current_user = dict(master_user)
 
         self.news_service = NewsService(self.db)
+        self.news_scheduler = NewsScheduler(self.db, self.news_service, on_run_finished=self._on_news_run_finished)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.visit_index = None
+        self.visit_scheduler = None
+        self.news_feed = NewsFeedModel(self.db)
+        self.report_service = ReportService()
+        self.report_poll_active = False
+        self.report_jobs_win = None
+        self.report_job_rows = {}
         self.root.title("CRM Dolp Engenharia")
         self.root.geometry("1600x900")
         self.root.minsize(1280, 720)
@@ -1668,7 +5166,7 @@ class CRMApp:
         self.kanban_segmento_filter = 'Todos'
         self._create_main_container()
         self.show_main_menu()
-        self.fetch_news_thread()
+        self.news_scheduler.start()
 
     def _configure_styles(self):
         style = ttk.Style(self.root)
@@ -1789,49 +5287,43 @@ class CRMApp:
 
         return scrollable_frame
 
+    def _render_paginated(self, container, items, render_item, page_size=None):
+        """Renderiza os cards de uma lista em páginas, com um botão para carregar os próximos."""
+        page_size = page_size or DETAIL_CARDS_PAGE_SIZE
+        state = {'shown': 0, 'button': None}
+
+        def show_next_page():
+            if state['button'] is not None:
+                state['button'].destroy()
+                state['button'] = None
+            for item in items[state['shown']:state['shown'] + page_size]:
+                render_item(item)
+            state['shown'] = min(state['shown'] + page_size, len(items))
+            remaining = len(items) - state['shown']
+            if remaining > 0:
+                state['button'] = ttk.Button(container, text=f"Carregar mais ({remaining} restantes)", command=show_next_page, style='TButton')
+                state['button'].pack(pady=10)
+
+        show_next_page()
+
     def clear_content(self):
         # Limpar quaisquer eventos globais para evitar erros de widgets destruídos
         self.root.unbind_all("<MouseWheel>")
         for widget in self.content_frame.winfo_children():
             widget.destroy()
 
-    def should_fetch_news(self):
-        if not os.path.exists(LAST_FETCH_FILE):
-            return True
-        try:
-            with open(LAST_FETCH_FILE, 'r') as f:
-                last_fetch_time = datetime.fromisoformat(f.read().strip())
-            if (datetime.now() - last_fetch_time) > timedelta(hours=FETCH_INTERVAL_HOURS):
-                return True
-        except (IOError, ValueError):
-            return True
-        return False
+    def on_close(self):
+        """Cancela a busca de notícias em andamento e encerra o aplicativo."""
+        self.news_scheduler.stop()
+        self.report_service.shutdown()
+        self.root.destroy()
 
-    def update_last_fetch_time(self):
+    def _on_news_run_finished(self, run_id):
+        """Chamado pelo agendador (em sua thread) após uma busca concluída: insere as novas notícias no painel."""
         try:
-            with open(LAST_FETCH_FILE, 'w') as f:
-                f.write(datetime.now().isoformat())
-        except IOError:
-            print("Aviso: Não foi possível atualizar o horário da última busca de notícias.")
-
-    def fetch_news_thread(self):
-        """Inicia a busca de notícias em uma thread separada para não bloquear a UI."""
-        def run_fetch():
-            if not self.should_fetch_news():
-                print("Busca de notícias recente já realizada. Pulando.")
-                return
-
-            self.news_service.fetch_and_store_news()
-            self.update_last_fetch_time()
-
-            try:
-                if self.content_frame.winfo_exists() and self.content_frame.winfo_children() and isinstance(self.content_frame.winfo_children()[0], ttk.Label) and self.content_frame.winfo_children()[0].cget("text") == "Menu Principal":
-                     self.root.after(0, self.show_main_menu)
-            except tk.TclError:
-                pass
-
-        thread = threading.Thread(target=run_fetch, daemon=True)
-        thread.start()
+            self.root.after(0, self.news_feed.refresh)
+        except (tk.TclError, RuntimeError):
+            pass
 
     def show_main_menu(self):
         self.clear_content()
@@ -1899,18 +5391,86 @@ class CRMApp:
         news_scrollbar.pack(side="right", fill="y")
         # ------------------------------------
 
-        latest_news = self.db.get_latest_news()
+        self._bind_news_feed(scrollable_news_frame, news_canvas, news_scrollbar)
 
-        if not latest_news:
-            ttk.Label(scrollable_news_frame, text="Buscando notícias relevantes...", style='Value.White.TLabel', font=('Segoe UI', 10, 'italic')).pack(pady=20)
-        else:
-            for news_item in latest_news:
-                self.create_news_card(scrollable_news_frame, news_item, self.show_main_menu)
+    def _bind_news_feed(self, container, canvas, scrollbar):
+        """Liga o painel ao NewsFeedModel: novas notícias entram no topo e a rolagem pagina em uma janela de
+        até NEWS_FEED_MAX_CARDS cards (os da ponta oposta são descartados e voltam ao rolar de volta)."""
+        feed = self.news_feed
+        cards = {}  # id -> (card, atualizar_botão)
+        placeholder = ttk.Label(container, text="Buscando notícias relevantes...", style='Value.White.TLabel', font=('Segoe UI', 10, 'italic'))
+        paging = {'pending': False}
 
-    def create_news_card(self, parent, news_item, refresh_callback):
-        """Cria um card para uma notícia."""
+        def add_cards(items, at_top):
+            placeholder.pack_forget()
+            first = container.pack_slaves()[0] if at_top and container.pack_slaves() else None
+            for item in items:
+                card, update_button = self.create_news_card(container, item, lambda news_id, saved: feed.set_saved(news_id, saved))
+                card.pack(fill='x', pady=5, padx=5, **({'before': first} if first is not None else {}))
+                cards[item['id']] = (card, update_button)
+
+        def remove_cards(news_ids):
+            for news_id in news_ids:
+                if news_id in cards:
+                    cards.pop(news_id)[0].destroy()
+            if not cards:
+                placeholder.pack(pady=20)
+
+        def on_update(item):
+            if item['id'] in cards:
+                cards[item['id']][1](item)
+
+        def keep_position(load):
+            """Carrega uma página mantendo na mesma posição da tela o card que estava visível no topo."""
+            slaves = [widget for widget in container.pack_slaves() if widget is not placeholder]
+            top = canvas.canvasy(0)
+            anchor = next((w for w in slaves if w.winfo_y() + w.winfo_height() > top), None)
+            before = anchor.winfo_y() if anchor is not None else 0
+            loaded = load()
+            if loaded and anchor is not None and anchor.winfo_exists():
+                container.update_idletasks()
+                canvas.configure(scrollregion=canvas.bbox("all"))
+                canvas.yview_moveto(max(0, top + anchor.winfo_y() - before) / max(container.winfo_height(), 1))
+
+        def load_page(first, last):
+            paging['pending'] = False
+            if not container.winfo_exists():
+                return
+            # Perto do fim carrega notícias antigas; perto do topo (fora da janela inicial) volta às mais novas
+            if last >= 0.98 and not feed.exhausted:
+                keep_position(feed.load_older)
+            elif first <= 0.02 and not feed.at_newest:
+                keep_position(feed.load_newer)
+
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            if not paging['pending']:
+                paging['pending'] = True
+                self.root.after_idle(load_page, float(first), float(last))
+
+        feed.on_insert = lambda items: add_cards(items, at_top=True)
+        feed.on_append = lambda items: add_cards(items, at_top=False)
+        feed.on_update = on_update
+        feed.on_remove = remove_cards
+
+        def unbind(event):
+            # O painel foi destruído (troca de tela): o modelo continua, sem view associada
+            if event.widget is container:
+                feed.on_insert = feed.on_append = feed.on_update = feed.on_remove = None
+        container.bind('<Destroy>', unbind, add='+')
+
+        canvas.configure(yscrollcommand=on_scroll)
+
+        if feed.items:
+            add_cards(feed.items, at_top=False)
+        feed.refresh()
+        if not feed.items:
+            placeholder.pack(pady=20)
+
+    def create_news_card(self, parent, news_item, on_saved_changed):
+        """Cria (sem posicionar) o card de uma notícia. Retorna (card, atualizar_botão_salvar)."""
+        news_item = dict(news_item)
         card = ttk.Frame(parent, style='Card.TFrame', padding=15, relief='solid', borderwidth=1)
-        card.grid(sticky='ew', pady=5, padx=5)
 
         # Top frame for title and buttons
         top_frame = ttk.Frame(card, style='Card.TFrame')
@@ -1926,23 +5486,39 @@ class CRMApp:
         actions_frame.pack(side='right', anchor='ne')
 
         def toggle_save():
-            new_status = not bool(news_item['saved'])
-            self.db.set_news_saved_status(news_item['id'], new_status)
-            refresh_callback()
+            news_item['saved'] = 0 if news_item['saved'] else 1
+            update_save_button(news_item)
+            on_saved_changed(news_item['id'], bool(news_item['saved']))
+
+        def update_save_button(item):
+            news_item['saved'] = item['saved']
+            if item['saved']:
+                save_button.config(text="Salvo ✓", style='Success.TButton')
+            else:
+                save_button.config(text="Salvar", style='Primary.TButton')
 
         save_button = ttk.Button(actions_frame, command=toggle_save)
-        if news_item['saved']:
-            save_button.config(text="Salvo ✓", style='Success.TButton')
-        else:
-            save_button.config(text="Salvar", style='Primary.TButton')
+        update_save_button(news_item)
         save_button.pack()
 
         # Info line
         info_text = f"Fonte: {news_item['source'] or 'N/A'} | Data: {news_item['published_date'] or 'N/A'}"
         ttk.Label(card, text=info_text, style='Card.TLabel', font=('Segoe UI', 9, 'italic')).pack(anchor='w', pady=(5,0))
 
+        # Outras fontes que publicaram a mesma notícia
+        alternate_sources = json.loads(news_item['alternate_sources']) if news_item['alternate_sources'] else []
+        if alternate_sources:
+            alt_frame = ttk.Frame(card, style='Card.TFrame')
+            alt_frame.pack(anchor='w', pady=(2,0))
+            ttk.Label(alt_frame, text="Também em:", style='Card.TLabel', font=('Segoe UI', 9, 'italic')).pack(side='left')
+            for entry in alternate_sources:
+                alt_label = ttk.Label(alt_frame, text=entry.get('source') or urlsplit(entry['url']).netloc, style='Card.TLabel', cursor="hand2", font=('Segoe UI', 9, 'underline'))
+                alt_label.pack(side='left', padx=(5,0))
+                alt_label.bind("<Button-1>", lambda e, url=entry['url']: open_link(url))
+
         # Summary
         ttk.Label(card, text=news_item['content_summary'] or 'Sem resumo.', style='Card.TLabel', wraplength=800, justify='left').pack(anchor='w', pady=(5,0))
+        return card, update_save_button
 
     def show_events_dashboard_view(self):
         """Mostra o painel de gerenciamento de eventos."""
@@ -2027,6 +5603,8 @@ class CRMApp:
                 ))
 
         ttk.Button(filters_frame, text="🔍 Filtrar", command=load_events, style='Primary.TButton').grid(row=0, column=2, padx=(20, 0))
+        ttk.Button(filters_frame, text="📤 Exportar Planilha", style='TButton',
+                   command=lambda: self.export_dataset_dialog('eventos', {'cliente': client_filter.get()})).grid(row=0, column=3, padx=(10, 0))
 
         load_events()
 
@@ -2065,12 +5643,24 @@ class CRMApp:
         main_scrollbar.pack(side="right", fill="y")
 
         saved_news = self.db.get_saved_news()
+        empty_label = ttk.Label(scrollable_frame, text="Nenhuma notícia salva ainda.", style='Value.White.TLabel', font=('Segoe UI', 10, 'italic'))
+        cards = {}
+
+        def on_saved_changed(news_id, saved):
+            # Grava pelo modelo (o painel do Menu Principal também é atualizado) e tira o card da lista de salvas
+            self.news_feed.set_saved(news_id, saved)
+            if not saved and news_id in cards:
+                cards.pop(news_id).destroy()
+                if not cards:
+                    empty_label.grid(pady=20)
 
         if not saved_news:
-            ttk.Label(scrollable_frame, text="Nenhuma notícia salva ainda.", style='Value.White.TLabel', font=('Segoe UI', 10, 'italic')).pack(pady=20)
+            empty_label.grid(pady=20)
         else:
             for news_item in saved_news:
-                self.create_news_card(scrollable_frame, news_item, self.show_saved_news_view)
+                card, _ = self.create_news_card(scrollable_frame, news_item, on_saved_changed)
+                card.grid(sticky='ew', pady=5, padx=5)
+                cards[news_item['id']] = card
 
     def _apply_kanban_filters(self):
         """Salva o estado atual dos filtros e recarrega a visão do kanban."""
@@ -2107,6 +5697,23 @@ class CRMApp:
         popup.grab_set()
         self.root.wait_window(popup)
 
+    def get_visit_index(self):
+        """Retorna o índice de visitas em memória, construindo-o na primeira chamada."""
+        if self.visit_index is None:
+            self.visit_index = VisitIndex(self.db.get_visitas())
+        return self.visit_index
+
+    def get_visit_scheduler(self):
+        """Retorna o detector de conflitos de visitas, construído a partir do índice em memória."""
+        if self.visit_scheduler is None:
+            self.visit_scheduler = VisitScheduler(self.get_visit_index().all())
+        return self.visit_scheduler
+
+    def invalidate_visit_index(self):
+        """Descarta o índice e o detector de conflitos de visitas após inclusão, edição ou exclusão."""
+        self.visit_index = None
+        self.visit_scheduler = None
+
     def show_cronograma_view(self):
         self.clear_content()
 
@@ -2115,6 +5722,7 @@ class CRMApp:
         title_frame.pack(fill='x', pady=(0, 20))
         ttk.Label(title_frame, text="Cronograma de Visitas", style='Title.TLabel').pack(side='left')
         ttk.Button(title_frame, text="Nova Visita", command=lambda: self.show_visita_form(), style='Success.TButton').pack(side='right')
+        ttk.Button(title_frame, text="Conflitos do Trimestre", command=self.show_visit_conflicts_report, style='Warning.TButton').pack(side='right', padx=(0, 10))
         ttk.Button(title_frame, text="← Voltar", command=self.show_main_menu, style='TButton').pack(side='right', padx=(0, 10))
 
         # Container Principal Dividido
@@ -2182,21 +5790,19 @@ class CRMApp:
             # Converter para YYYY-MM-DD para busca no banco
             try:
                 date_obj = datetime.strptime(selected_date_str, '%d/%m/%Y')
-                date_db_str = date_obj.strftime('%Y-%m-%d')
                 details_label_text.set(f"Visitas em: {selected_date_str}")
             except ValueError:
                 # Fallback se o locale não estiver setado corretamente
                  # Tentar parsear mm/dd/yyyy se o sistema estiver em en_US
                 try:
                      date_obj = datetime.strptime(selected_date_str, '%m/%d/%y')
-                     date_db_str = date_obj.strftime('%Y-%m-%d')
                      details_label_text.set(f"Visitas em: {date_obj.strftime('%d/%m/%Y')}")
                 except ValueError:
                     print(f"Erro de formato de data no calendário: {selected_date_str}")
                     return
 
-            # Buscar visitas que começam ou atravessam essa data
-            all_visits = self.db.get_visitas({'active_on_date': date_db_str})
+            # Buscar visitas que começam ou atravessam essa data (no índice em memória)
+            all_visits = self.get_visit_index().visits_on(date_obj.date())
 
             if not all_visits:
                 ttk.Label(visits_scrollable_frame, text="Nenhuma visita agendada para este dia.", style='Value.White.TLabel').pack(pady=20, padx=10)
@@ -2243,40 +5849,30 @@ class CRMApp:
 
         self.calendar.bind("<<CalendarSelected>>", load_visits_for_date)
 
-        def mark_calendar_days():
-            # Remove all existing tags/events markers
-            # Fetch all visits
-            visits = self.db.get_visitas()
-
-            for v in visits:
-                try:
-                    # Parse start date
-                    start_str = v['data_ida'].split(' ')[0]
-                    start_date = datetime.strptime(start_str, '%Y-%m-%d').date()
-
-                    # Parse end date (or use start date if missing)
-                    if v['data_volta']:
-                        end_str = v['data_volta'].split(' ')[0]
-                        end_date = datetime.strptime(end_str, '%Y-%m-%d').date()
-                    else:
-                        end_date = start_date
-
-                    # Ensure end date is not before start date
-                    if end_date < start_date:
-                        end_date = start_date
-
-                    color = v['cor'] if v['cor'] else 'blue'
-                    tag_name = f"tag_{color}"
+        def mark_calendar_days(event=None):
+            # Apenas o mês exibido recebe marcadores; os demais são criados ao navegar
+            self.calendar.calevent_remove('all')
+            month, year = self.calendar.get_displayed_month()
+            month_start = datetime(year, month, 1).date()
+            next_month = datetime(year + (month == 12), month % 12 + 1, 1).date()
+            month_end = next_month - timedelta(days=1)
+
+            configured_tags = set()
+            for start_date, end_date, v in self.get_visit_index().query_range(month_start, month_end):
+                color = v['cor'] if v['cor'] else 'blue'
+                tag_name = f"tag_{color}"
+                if tag_name not in configured_tags:
                     self.calendar.tag_config(tag_name, background=color, foreground='white')
+                    configured_tags.add(tag_name)
 
-                    # Loop through range and add event for each day
-                    current_date = start_date
-                    while current_date <= end_date:
-                        self.calendar.calevent_create(current_date, v['pautas'] or "Visita", tags=tag_name)
-                        current_date += timedelta(days=1)
+                # Loop through range (clipped to the displayed month) and add event for each day
+                current_date = max(start_date, month_start)
+                last_date = min(end_date, month_end)
+                while current_date <= last_date:
+                    self.calendar.calevent_create(current_date, v['pautas'] or "Visita", tags=tag_name)
+                    current_date += timedelta(days=1)
 
-                except (ValueError, IndexError):
-                    continue
+        self.calendar.bind("<<CalendarMonthChanged>>", mark_calendar_days)
 
         # Initial Load
         mark_calendar_days()
@@ -2476,12 +6072,24 @@ class CRMApp:
                     'pautas': pautas_text.get('1.0', 'end-1c').strip()
                 }
 
+                conflicts = self.get_visit_scheduler().find_conflicts(data, exclude_id=visita_id)
+                if conflicts['responsavel'] or conflicts['cliente']:
+                    lines = []
+                    for v in conflicts['responsavel']:
+                        lines.append(f"• Responsável já em visita a {v['nome_empresa']} ({v['data_ida'][:16]} → {(v['data_volta'] or '')[:16]})")
+                    for v in conflicts['cliente']:
+                        if v not in conflicts['responsavel']:
+                            lines.append(f"• Cliente já recebe visita de {v['responsavel_nome']} ({v['data_ida'][:16]} → {(v['data_volta'] or '')[:16]})")
+                    if not messagebox.askyesno("Conflito de Agenda", "Esta visita se sobrepõe a:\n\n" + "\n".join(lines) + "\n\nDeseja salvar mesmo assim?", parent=form_win):
+                        return
+
                 if visita_id:
                     self.db.update_visita(visita_id, data)
                     messagebox.showinfo("Sucesso", "Visita atualizada!", parent=form_win)
                 else:
                     self.db.add_visita(data)
                     messagebox.showinfo("Sucesso", "Visita agendada!", parent=form_win)
+                self.invalidate_visit_index()
 
                 form_win.destroy()
                 self.show_cronograma_view() # Refresh
@@ -2491,9 +6099,67 @@ class CRMApp:
 
         ttk.Button(main_frame, text="Salvar Agendamento", command=save, style='Success.TButton').pack(pady=20)
 
+    def show_visit_conflicts_report(self):
+        """Mostra as visitas sobrepostas (por responsável e por cliente) no trimestre exibido no calendário."""
+        try:
+            month, year = self.calendar.get_displayed_month()
+        except (AttributeError, tk.TclError):
+            month, year = datetime.now().month, datetime.now().year
+        first_month = 3 * ((month - 1) // 3) + 1
+        q_start = datetime(year, first_month, 1)
+        q_end = datetime(year + (first_month == 10), (first_month + 2) % 12 + 1, 1) - timedelta(seconds=1)
+
+        visits = [e[2] for e in self.get_visit_index().query_range(q_start.date(), q_end.date())]
+        conflicts = VisitScheduler.conflicts_in_period(visits, q_start, q_end)
+
+        win = Toplevel(self.root)
+        win.title("Conflitos de Agenda")
+        win.geometry("1000x500")
+        win.configure(bg=DOLP_COLORS['white'])
+
+        main_frame = ttk.Frame(win, padding=20, style='TFrame')
+        main_frame.pack(fill='both', expand=True)
+        quarter = (first_month - 1) // 3 + 1
+        ttk.Label(main_frame, text=f"Conflitos do {quarter}º Trimestre de {year} ({len(conflicts)})", style='Title.TLabel').pack(anchor='w', pady=(0, 15))
+
+        columns = ('tipo', 'visita_a', 'visita_b', 'periodo')
+        tree = ttk.Treeview(main_frame, columns=columns, show='headings')
+        tree.heading('tipo', text='Tipo')
+        tree.heading('visita_a', text='Visita')
+        tree.heading('visita_b', text='Sobreposta a')
+        tree.heading('periodo', text='Sobreposição')
+        tree.column('tipo', width=110, anchor='center')
+        tree.column('visita_a', width=330)
+        tree.column('visita_b', width=330)
+        tree.column('periodo', width=200, anchor='center')
+
+        scrollbar = ttk.Scrollbar(main_frame, orient='vertical', command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        def describe(v):
+            return f"{v['nome_empresa']} - {v['responsavel_nome']} ({v['data_ida'][:16]})"
+
+        for c in conflicts:
+            tree.insert('', 'end', values=(
+                'Responsável' if c['tipo'] == 'responsavel' else 'Cliente',
+                describe(c['visita_a']),
+                describe(c['visita_b']),
+                f"{c['inicio'].strftime('%d/%m %H:%M')} - {c['fim'].strftime('%d/%m %H:%M')}"
+            ))
+
+        def on_double_click(event):
+            selection = tree.selection()
+            if selection:
+                self.show_visita_form(conflicts[tree.index(selection[0])]['visita_b']['id'])
+
+        tree.bind('<Double-1>', on_double_click)
+
     def delete_visita_confirm(self, visita_id):
         if messagebox.askyesno("Confirmar Exclusão", "Tem certeza que deseja excluir esta visita?"):
             self.db.delete_visita(visita_id)
+            self.invalidate_visit_index()
             # Refresh current view
             self.show_cronograma_view()
 
@@ -2508,6 +6174,7 @@ class CRMApp:
 
         ttk.Button(title_frame, text="Oport. Canceladas", command=self.show_cancelled_view, style='Danger.TButton').pack(side='right', padx=(0, 10))
         ttk.Button(title_frame, text="Histórico", command=self.show_historico_view, style='Warning.TButton').pack(side='right', padx=(0,10))
+        ttk.Button(title_frame, text="Carteira", command=self.show_carteira_view, style='Primary.TButton').pack(side='right', padx=(0,10))
         ttk.Button(title_frame, text="Nova Oportunidade", command=lambda: self.show_opportunity_form(), style='Success.TButton').pack(side='right', padx=(0, 10))
         ttk.Button(title_frame, text="← Voltar", command=self.show_main_menu, style='TButton').pack(side='right', padx=(0, 10))
 
@@ -2766,6 +6433,12 @@ class CRMApp:
         self.add_opportunities_by_stage_chart(scrollable_frame, 2, 0)
         self.add_interactions_by_opportunity_chart(scrollable_frame, 2, 1)
 
+        velocity = pipeline_velocity_report(self.db)
+        self.add_time_in_stage_chart(scrollable_frame, 3, 0, velocity['tempo_em_estagio'])
+        self.add_stage_conversion_table(scrollable_frame, 3, 1, velocity['conversao_por_estagio'])
+        self.add_monthly_throughput_chart(scrollable_frame, 4, 0, velocity['vazao_mensal'])
+        self.add_revenue_forecast_chart(scrollable_frame, 5, 0)
+
     def _create_chart_frame(self, parent, title):
         """Cria um contêiner padronizado para um gráfico."""
         chart_lf = ttk.LabelFrame(parent, text=title, padding=15, style='White.TLabelframe')
@@ -2882,6 +6555,97 @@ class CRMApp:
         canvas.draw()
         canvas.get_tk_widget().pack(fill='both', expand=True)
 
+    def add_time_in_stage_chart(self, parent, row, col, summary):
+        chart_frame = self._create_chart_frame(parent, "Tempo em Cada Etapa (dias)")
+        chart_frame.grid(row=row, column=col)
+        summary = summary.dropna(subset=['mediana_dias'])
+        if summary.empty:
+            ttk.Label(chart_frame, text="Não há movimentações suficientes.").pack()
+            return
+        fig = Figure(figsize=(6, 4), dpi=100)
+        ax = fig.add_subplot(111)
+        summary[['mediana_dias', 'p90_dias']].iloc[::-1].plot(kind='barh', ax=ax, color=[DOLP_COLORS['primary_blue'], DOLP_COLORS['dolp_cyan']])
+        ax.set_title("Mediana e P90 do Tempo por Etapa", fontsize=12)
+        ax.set_xlabel("Dias")
+        ax.set_ylabel("Etapa do Funil")
+        ax.legend(["Mediana", "P90"])
+        fig.tight_layout()
+        canvas = FigureCanvasTkAgg(fig, master=chart_frame)
+        canvas.draw()
+        canvas.get_tk_widget().pack(fill='both', expand=True)
+
+    def add_stage_conversion_table(self, parent, row, col, summary):
+        chart_frame = self._create_chart_frame(parent, "Conversão por Etapa")
+        chart_frame.grid(row=row, column=col)
+        if summary.empty:
+            ttk.Label(chart_frame, text="Não há movimentações suficientes.").pack()
+            return
+        columns = [('estagio', 'Etapa', 220, 'w'), ('saidas', 'Saídas', 70, 'center'), ('avancos', 'Avanços', 70, 'center'),
+                   ('perdas', 'Perdas', 70, 'center'), ('retornos', 'Retornos', 70, 'center'), ('taxa', 'Conversão', 90, 'center')]
+        tree = ttk.Treeview(chart_frame, columns=[key for key, _, _, _ in columns], show='headings', height=12)
+        for key, text, width, anchor in columns:
+            tree.heading(key, text=text)
+            tree.column(key, width=width, anchor=anchor)
+        for stage in summary.itertuples():
+            tree.insert('', 'end', values=(stage.Index, stage.saidas, stage.avancos, stage.perdas, stage.retornos,
+                                           f"{stage.taxa_conversao:.0%}"))
+        tree.pack(fill='both', expand=True)
+
+    def add_monthly_throughput_chart(self, parent, row, col, throughput):
+        chart_frame = self._create_chart_frame(parent, "Vazão Mensal do Funil")
+        chart_frame.grid(row=row, column=col, columnspan=2)
+        if throughput.empty:
+            ttk.Label(chart_frame, text="Não há movimentações suficientes.").pack()
+            return
+        fig = Figure(figsize=(12, 4), dpi=100)
+        ax = fig.add_subplot(111)
+        throughput.tail(24).plot(kind='bar', stacked=True, ax=ax, colormap='tab20')
+        ax.set_title("Entradas por Etapa a Cada Mês", fontsize=12)
+        ax.set_xlabel("Mês")
+        ax.set_ylabel("Oportunidades")
+        ax.legend(fontsize=8, loc='upper left', bbox_to_anchor=(1, 1))
+        fig.tight_layout()
+        canvas = FigureCanvasTkAgg(fig, master=chart_frame)
+        canvas.draw()
+        canvas.get_tk_widget().pack(fill='both', expand=True)
+
+    def add_revenue_forecast_chart(self, parent, row, col):
+        chart_frame = self._create_chart_frame(parent, "Previsão de Receita do Funil (ponderada por estágio)")
+        chart_frame.grid(row=row, column=col, columnspan=2)
+
+        mode_labels = {label: mode for mode, label in PipelineForecaster.MODES.items()}
+        mode_combo = ttk.Combobox(chart_frame, values=list(mode_labels), state='readonly', width=40)
+        mode_combo.set(PipelineForecaster.MODES['configurada'])
+        mode_combo.pack(anchor='w', pady=(0, 10))
+        chart_area = ttk.Frame(chart_frame, style='TFrame')
+        chart_area.pack(fill='both', expand=True)
+
+        def render(event=None):
+            for widget in chart_area.winfo_children():
+                widget.destroy()
+            forecast = PIPELINE_FORECASTER.forecast(self.db, mode_labels[mode_combo.get()])
+            totals = forecast['totais']
+            if not totals['receita_bruta'].any():
+                ttk.Label(chart_area, text="Não há oportunidades em aberto para projetar.").pack()
+                return
+            fig = Figure(figsize=(12, 4), dpi=100)
+            ax = fig.add_subplot(111)
+            forecast['curva'].plot(kind='bar', stacked=True, ax=ax, colormap='tab20', width=0.8)
+            ax.plot(range(len(totals)), totals['receita_bruta'].to_numpy(), color=DOLP_COLORS['primary_blue'],
+                    linestyle='--', marker='o', markersize=3, label="Receita bruta (sem ponderação)")
+            ax.set_title("Receita Esperada por Mês", fontsize=12)
+            ax.set_xlabel("Mês")
+            ax.set_ylabel("Receita (R$)")
+            ax.yaxis.set_major_formatter(FuncFormatter(lambda x, p: f'R${x/1e6:,.1f}M'))
+            ax.legend(fontsize=8, loc='upper left', bbox_to_anchor=(1, 1))
+            fig.tight_layout()
+            canvas = FigureCanvasTkAgg(fig, master=chart_area)
+            canvas.draw()
+            canvas.get_tk_widget().pack(fill='both', expand=True)
+
+        mode_combo.bind('<<ComboboxSelected>>', render)
+        render()
+
     def add_interactions_by_opportunity_chart(self, parent, row, col):
         chart_frame = self._create_chart_frame(parent, "Top 15 Oportunidades por Interações")
         chart_frame.grid(row=row, column=col)
@@ -2983,14 +6747,7 @@ class CRMApp:
         """Adiciona registro de movimentação no histórico"""
         user = self.db.get_user_by_id(user_id) # Supondo que você crie este método
         username = user['username'] if user else 'Sistema'
-        data = {
-            'oportunidade_id': op_id,
-            'data_interacao': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'tipo': 'Movimentação',
-            'resumo': f"Movida de '{from_stage}' para '{to_stage}' - Resultado: {result}",
-            'usuario': username
-        }
-        self.db.add_interaction(data)
+        self.db.record_stage_transition(op_id, from_stage, to_stage, result, username)
 
     def show_cancelled_view(self):
         """Mostra oportunidades canceladas"""
@@ -3067,6 +6824,108 @@ class CRMApp:
                        ),
                        tags=(str(op['id']),))
 
+    def show_carteira_view(self):
+        """Carteira de contratos em execução: valor atual (com aditivos), run-rate mensal e vigência por cliente ou estado."""
+        self.clear_content()
+
+        title_frame = ttk.Frame(self.content_frame, style='TFrame')
+        title_frame.pack(fill='x', pady=(0, 20))
+
+        ttk.Label(title_frame, text="Carteira de Contratos", style='Title.TLabel').pack(side='left')
+        ttk.Button(title_frame, text="← Voltar", command=self.show_kanban_view, style='TButton').pack(side='right')
+        ttk.Button(title_frame, text="📤 Exportar Planilha", style='Primary.TButton',
+                   command=lambda: self.export_dataset_dialog('carteira', selected_filters())).pack(side='right', padx=(0, 10))
+
+        # Totais da carteira
+        totals_frame = ttk.LabelFrame(self.content_frame, text="Resumo", padding=15, style='White.TLabelframe')
+        totals_frame.pack(fill='x', pady=(0, 10))
+        totals_labels = {}
+        for col, (key, text) in enumerate([('contratos', "Contratos:"), ('valor_original', "Valor Original:"),
+                                           ('valor_aditivos', "Aditivos:"), ('valor_atual', "Valor Atual:"),
+                                           ('run_rate_mensal', "Run-rate Mensal:")]):
+            ttk.Label(totals_frame, text=text, style='Metric.White.TLabel').grid(row=0, column=col * 2, sticky='w', padx=(0, 5))
+            totals_labels[key] = ttk.Label(totals_frame, text="---", style='Value.White.TLabel', font=('Segoe UI', 11, 'bold'))
+            totals_labels[key].grid(row=0, column=col * 2 + 1, sticky='w', padx=(0, 20))
+
+        group_frame = ttk.Frame(self.content_frame, style='TFrame')
+        group_frame.pack(fill='x', pady=(0, 10))
+        ttk.Label(group_frame, text="Agrupar por:", style='TLabel').pack(side='left', padx=(0, 5))
+        group_var = tk.StringVar(value='cliente')
+        ttk.Radiobutton(group_frame, text="Cliente", variable=group_var, value='cliente', command=lambda: load_groups()).pack(side='left', padx=5)
+        ttk.Radiobutton(group_frame, text="Estado", variable=group_var, value='estado', command=lambda: load_groups()).pack(side='left', padx=5)
+
+        panes = ttk.PanedWindow(self.content_frame, orient='vertical')
+        panes.pack(fill='both', expand=True)
+
+        def make_tree(parent, columns, height):
+            frame = ttk.Frame(parent, style='TFrame')
+            tree = ttk.Treeview(frame, columns=[key for key, _, _, _ in columns], show='headings', height=height)
+            for key, text, width, anchor in columns:
+                tree.heading(key, text=text)
+                tree.column(key, width=width, anchor=anchor)
+            scrollbar = ttk.Scrollbar(frame, orient='vertical', command=tree.yview)
+            tree.configure(yscrollcommand=scrollbar.set)
+            tree.pack(side='left', fill='both', expand=True)
+            scrollbar.pack(side='right', fill='y')
+            return frame, tree
+
+        groups_frame, groups_tree = make_tree(panes, [
+            ('grupo', 'Cliente / UF', 260, 'w'), ('contratos', 'Contratos', 80, 'center'),
+            ('valor_original', 'Valor Original', 130, 'e'), ('valor_aditivos', 'Aditivos', 130, 'e'),
+            ('valor_atual', 'Valor Atual', 140, 'e'), ('run_rate_mensal', 'Run-rate Mensal', 130, 'e'),
+            ('proximo_fim', 'Próximo Fim', 100, 'center'), ('ultimo_fim', 'Último Fim', 100, 'center')], 8)
+        contracts_frame, contracts_tree = make_tree(panes, [
+            ('num_op', 'Nº Oport.', 100, 'center'), ('titulo', 'Título', 260, 'w'), ('cliente', 'Cliente', 180, 'w'),
+            ('uf', 'UF', 50, 'center'), ('aditivos', 'Aditivos', 70, 'center'), ('valor_atual', 'Valor Atual', 140, 'e'),
+            ('run_rate_mensal', 'Run-rate Mensal', 130, 'e'), ('data_fim', 'Fim Vigente', 100, 'center')], 10)
+        panes.add(groups_frame, weight=1)
+        panes.add(contracts_frame, weight=1)
+
+        def display_date(iso_date):
+            try:
+                return datetime.strptime(iso_date, '%Y-%m-%d').strftime('%d/%m/%Y')
+            except (TypeError, ValueError):
+                return iso_date or '---'
+
+        def selected_filters():
+            selection = groups_tree.selection()
+            if not selection:
+                return {}
+            return {'estado' if group_var.get() == 'estado' else 'cliente': selection[0]}
+
+        def load_groups():
+            groups_tree.delete(*groups_tree.get_children())
+            contracts_tree.delete(*contracts_tree.get_children())
+            groups = self.db.get_carteira_agregada(group_var.get())
+            for group in groups:
+                groups_tree.insert('', 'end', iid=group['grupo'], values=(
+                    group['grupo'], group['contratos'], format_currency(group['valor_original']),
+                    format_currency(group['valor_aditivos']), format_currency(group['valor_atual']),
+                    format_currency(group['run_rate_mensal']), display_date(group['proximo_fim']), display_date(group['ultimo_fim'])))
+            for key, label in totals_labels.items():
+                total = sum(group[key] or 0 for group in groups)
+                label.config(text=str(total) if key == 'contratos' else format_currency(total))
+
+        def load_contracts(event=None):
+            contracts_tree.delete(*contracts_tree.get_children())
+            if not groups_tree.selection():
+                return
+            for contract in self.db.get_carteira_contratos(selected_filters()):
+                contracts_tree.insert('', 'end', values=(
+                    contract['numero_oportunidade'], contract['titulo'], contract['nome_empresa'], contract['estado'],
+                    contract['quantidade_aditivos'], format_currency(contract['valor_atual']),
+                    format_currency(contract['run_rate_mensal']), display_date(contract['data_fim_atual'])),
+                    tags=(str(contract['id']),))
+
+        def on_contract_double_click(event):
+            selection = contracts_tree.selection()
+            if selection:
+                self.show_opportunity_details(int(contracts_tree.item(selection[0])['tags'][0]))
+
+        groups_tree.bind('<<TreeviewSelect>>', load_contracts)
+        contracts_tree.bind('<Double-1>', on_contract_double_click)
+        load_groups()
+
     def show_historico_view(self):
         """Mostra histórico de oportunidades com filtros avançados"""
         self.clear_content()
@@ -3129,6 +6988,13 @@ class CRMApp:
                                command=lambda: self.apply_historico_filters(num_op_filter, client_filter, stage_filter, result_filter, period_filter, min_value_filter, results_tree))
         search_btn.grid(row=0, column=4, padx=(20, 0))
 
+        batch_btn = ttk.Button(filter_row2, text="📦 Exportar Lote (PDF)", style='TButton',
+                               command=lambda: self.show_batch_export_dialog(self._historico_filters(num_op_filter, client_filter, stage_filter, result_filter, period_filter, min_value_filter)))
+        batch_btn.grid(row=0, column=5, padx=(10, 0))
+
+        ttk.Button(filter_row2, text="📤 Exportar Planilha", style='TButton',
+                   command=lambda: self.export_dataset_dialog('historico', self._historico_filters(num_op_filter, client_filter, stage_filter, result_filter, period_filter, min_value_filter))).grid(row=0, column=6, padx=(10, 0))
+
         # Tabela de resultados
         results_frame = ttk.Frame(self.content_frame, style='TFrame')
         results_frame.pack(fill='both', expand=True)
@@ -3179,21 +7045,129 @@ class CRMApp:
 
         results_tree.bind('<Double-1>', on_item_double_click)
 
-        # Carregar todas as oportunidades inicialmente
-        self.load_historico_data(results_tree)
+        # Carregar todas as oportunidades inicialmente
+        self.load_historico_data(results_tree)
+
+    def _historico_filters(self, num_op_filter, client_filter, stage_filter, result_filter, period_filter, min_value_filter):
+        """Monta o dicionário de filtros do histórico a partir dos campos da tela"""
+        return {
+            'numero_oportunidade': num_op_filter.get().strip() if num_op_filter.get().strip() else None,
+            'cliente': client_filter.get() if client_filter.get() != 'Todos' else None,
+            'estagio': stage_filter.get() if stage_filter.get() != 'Todos' else None,
+            'resultado': result_filter.get() if result_filter.get() != 'Todos' else None,
+            'periodo': period_filter.get() if period_filter.get() != 'Todos' else None,
+            'valor_min': min_value_filter.get().strip() if min_value_filter.get().strip() else None
+        }
+
+    def apply_historico_filters(self, num_op_filter, client_filter, stage_filter, result_filter, period_filter, min_value_filter, results_tree):
+        """Aplica filtros e atualiza a tabela de histórico"""
+        filters = self._historico_filters(num_op_filter, client_filter, stage_filter, result_filter, period_filter, min_value_filter)
+        self.load_historico_data(results_tree, filters)
+
+    def show_batch_export_dialog(self, filters):
+        """Exporta em lote os PDFs das oportunidades do filtro atual (ZIP ou PDF único com sumário)"""
+        total = len(self.db.get_historico_oportunidades(filters))
+        if not total:
+            messagebox.showinfo("Exportar Lote", "Nenhuma oportunidade encontrada para os filtros atuais.", parent=self.root)
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Exportar Lote de PDFs")
+        dialog.geometry("460x330")
+        dialog.configure(bg=DOLP_COLORS['white'])
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        main_frame = ttk.Frame(dialog, padding=20, style='TFrame')
+        main_frame.pack(fill='both', expand=True)
+        ttk.Label(main_frame, text=f"{total} oportunidade(s) no filtro atual", style='TLabel', font=('Segoe UI', 11, 'bold')).pack(anchor='w', pady=(0, 10))
+
+        ttk.Label(main_frame, text="Documentos:", style='TLabel').pack(anchor='w')
+        kind_vars = {}
+        for kind, (title, _) in BATCH_REPORT_KINDS.items():
+            kind_vars[kind] = tk.BooleanVar(value=(kind == 'sumario_executivo'))
+            ttk.Checkbutton(main_frame, text=title, variable=kind_vars[kind]).pack(anchor='w', padx=(10, 0))
+
+        ttk.Label(main_frame, text="Formato:", style='TLabel').pack(anchor='w', pady=(10, 0))
+        format_var = tk.StringVar(value='zip')
+        ttk.Radiobutton(main_frame, text="Arquivo ZIP (um PDF por documento)", value='zip', variable=format_var).pack(anchor='w', padx=(10, 0))
+        merged_rb = ttk.Radiobutton(main_frame, text="PDF único com sumário", value='merged', variable=format_var)
+        merged_rb.pack(anchor='w', padx=(10, 0))
+        if PdfWriter is None:
+            merged_rb.configure(state='disabled', text="PDF único com sumário (requer o pacote pypdf)")
+
+        progress_var = tk.DoubleVar(value=0)
+        progress_bar = ttk.Progressbar(main_frame, variable=progress_var, maximum=100, mode='determinate')
+        status_label = ttk.Label(main_frame, text="", style='TLabel')
+        buttons_frame = ttk.Frame(main_frame, style='TFrame')
+        buttons_frame.pack(side='bottom', fill='x', pady=(10, 0))
+        progress_bar.pack(side='bottom', fill='x', pady=(10, 0))
+        status_label.pack(side='bottom', anchor='w')
+
+        cancel_event = threading.Event()
+
+        def on_progress(done, count, label):
+            self.root.after(0, lambda: (progress_var.set(done * 100 / count), status_label.config(text=f"{done}/{count} - {label}")))
+
+        def on_finished(result=None, error=None):
+            if not dialog.winfo_exists():
+                return
+            export_btn.config(state='normal')
+            if error is not None:
+                status_label.config(text="")
+                if not isinstance(error, InterruptedError):
+                    messagebox.showerror("Erro", f"Erro na exportação em lote: {error}", parent=dialog)
+                return
+            messagebox.showinfo("Exportar Lote",
+                                f"{result['documents']} documento(s), {result['pages']} página(s) em {result['seconds']:.1f}s."
+                                + (f"\n{result['skipped']} documento(s) de oportunidades excluídas durante a exportação foram ignorados." if result['skipped'] else "")
+                                + f"\n\nArquivo salvo em:\n{result['output']}",
+                                parent=dialog)
+            dialog.destroy()
+
+        def start_export():
+            kinds = [kind for kind, var in kind_vars.items() if var.get()]
+            if not kinds:
+                messagebox.showwarning("Exportar Lote", "Selecione ao menos um documento.", parent=dialog)
+                return
+            merged = format_var.get() == 'merged'
+            if merged and total * len(kinds) > BATCH_MERGED_MAX_DOCUMENTS:
+                # O PDF único é montado em memória: lotes grandes vão para o ZIP, que grava um documento por vez
+                messagebox.showwarning("Exportar Lote",
+                                       f"O PDF único aceita até {BATCH_MERGED_MAX_DOCUMENTS} documentos ({total * len(kinds)} selecionados).\n"
+                                       "A saída foi alterada para Arquivo ZIP.", parent=dialog)
+                format_var.set('zip')
+                return
+            extension = '.pdf' if merged else '.zip'
+            file_path = filedialog.asksaveasfilename(
+                parent=dialog, defaultextension=extension,
+                filetypes=[("Documentos PDF", "*.pdf")] if merged else [("Arquivo ZIP", "*.zip")],
+                initialfile=f"Relatorios_Oportunidades_{datetime.now().strftime('%Y%m%d')}{extension}",
+                title="Salvar Lote de Relatórios")
+            if not file_path:
+                return
+            export_btn.config(state='disabled')
+            cancel_event.clear()
+
+            def worker():
+                try:
+                    result = export_report_batch(self.db, filters, kinds, file_path, merged=merged,
+                                                 on_progress=on_progress, cancel_event=cancel_event)
+                    self.root.after(0, lambda: on_finished(result=result))
+                except Exception as e:
+                    print(f"Erro na exportação em lote: {e}")
+                    self.root.after(0, lambda e=e: on_finished(error=e))
+
+            threading.Thread(target=worker, daemon=True).start()
 
-    def apply_historico_filters(self, num_op_filter, client_filter, stage_filter, result_filter, period_filter, min_value_filter, results_tree):
-        """Aplica filtros e atualiza a tabela de histórico"""
-        filters = {
-            'numero_oportunidade': num_op_filter.get().strip() if num_op_filter.get().strip() else None,
-            'cliente': client_filter.get() if client_filter.get() != 'Todos' else None,
-            'estagio': stage_filter.get() if stage_filter.get() != 'Todos' else None,
-            'resultado': result_filter.get() if result_filter.get() != 'Todos' else None,
-            'periodo': period_filter.get() if period_filter.get() != 'Todos' else None,
-            'valor_min': min_value_filter.get().strip() if min_value_filter.get().strip() else None
-        }
+        def on_cancel():
+            cancel_event.set()
+            dialog.destroy()
 
-        self.load_historico_data(results_tree, filters)
+        export_btn = ttk.Button(buttons_frame, text="Exportar", command=start_export, style='Success.TButton')
+        export_btn.pack(side='right')
+        ttk.Button(buttons_frame, text="Cancelar", command=on_cancel, style='TButton').pack(side='right', padx=(0, 10))
+        dialog.protocol("WM_DELETE_WINDOW", on_cancel)
 
     def load_historico_data(self, tree, filters=None):
         """Carrega dados do histórico na tabela"""
@@ -3206,7 +7180,7 @@ class CRMApp:
 
         for op in oportunidades:
             # Obter último resultado da oportunidade
-            ultimo_resultado = self.db.get_ultimo_resultado_oportunidade(op['id'])
+            ultimo_resultado = op['ultimo_resultado']
 
             data_criacao_str = '---'
             if op['data_criacao']:
@@ -3229,7 +7203,7 @@ class CRMApp:
                        ),
                        tags=(str(op['id']),))  # Armazenar ID nas tags
 
-    def show_opportunity_form(self, op_id=None, client_to_prefill=None):
+    def show_opportunity_form(self, op_id=None, client_to_prefill=None, snapshot=None):
         form_win = Toplevel(self.root)
         form_win.title("Nova Oportunidade" if not op_id else "Editar Oportunidade")
         form_win.geometry("1100x800") # Aumentado para melhor visualização
@@ -3611,101 +7585,55 @@ class CRMApp:
         servicos_tree.pack(fill='x', pady=5)
         entries['servicos_tree'] = servicos_tree
 
+        def _collect_servicos_data():
+            """Serviços marcados e suas equipes, como gravados em 'servicos_data'."""
+            servicos_data = []
+            tipos_servico_vars = entries.get('tipos_servico_vars', {})
+            for servico_nome, equipe_rows in entries.get('servicos_data', {}).items():
+                if tipos_servico_vars.get(servico_nome) and tipos_servico_vars[servico_nome].get():
+                    equipes = [{
+                        "tipo_equipe": row_widgets['tipo_combo'].get(),
+                        "quantidade": row_widgets['qtd_entry'].get(),
+                        "volumetria": row_widgets['vol_entry'].get(),
+                        "base": row_widgets['base_combo'].get(),
+                        "empresa_referencia": row_widgets['empresa_combo'].get()
+                    } for row_widgets in equipe_rows]
+                    servicos_data.append({"servico_nome": servico_nome, "equipes": equipes})
+            return servicos_data
+
         def calcular_precos_automaticos():
-            # 2. Limpar a árvore de resultados e resetar o faturamento
+            servicos_data = _collect_servicos_data()
+            teams = team_table(servicos_data)
+            priced = price_teams(teams, self.db.get_reference_prices(teams['empresa_referencia']))
+            summary = summarize_services(priced, [servico['servico_nome'] for servico in servicos_data])
+
+            invalid = summary[summary['invalido']]
+            if not invalid.empty:
+                messagebox.showerror("Erro de Formato", f"Verifique os valores de Quantidade e Volumetria para o serviço '{invalid['servico'].iloc[0]}'. Devem ser números.", parent=form_win)
+                return
+
             for item in servicos_tree.get_children():
                 servicos_tree.delete(item)
 
-            faturamento_total = 0.0
-
-            # 3. Iterar sobre os serviços configurados no formulário
-            servico_equipes_data = entries.get('servicos_data', {})
-            tipos_servico_vars = entries.get('tipos_servico_vars', {})
-
-            for servico_nome, equipe_rows in servico_equipes_data.items():
-                # Verificar se o serviço está ativo (checkbox marcado)
-                if not (tipos_servico_vars.get(servico_nome) and tipos_servico_vars[servico_nome].get()):
+            for servico in summary.itertuples(index=False):
+                quantidade = f"{servico.quantidade:g}"
+                volumetria = f"{servico.volumetria:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+                if servico.sem_referencia and servico.valor_total == 0:
+                    servicos_tree.insert('', 'end', values=(servico.servico, quantidade, volumetria, 'N/A', 'Ref. não encontrada', 'N/A'))
                     continue
-
-                total_qtd_equipes = 0
-                total_volumetria = 0.0
-                preco_total_servico = 0.0
-                preco_unitario_display = "Varia"
-
-                has_error = False
-
-                for row_widgets in equipe_rows:
-                    try:
-                        qtd = int(row_widgets['qtd_entry'].get() or 0)
-                        vol = float(row_widgets['vol_entry'].get().replace(',', '.') or 0)
-                        total_qtd_equipes += qtd
-                        total_volumetria += vol
-
-                        # Get per-row reference company
-                        empresa_ref_str = row_widgets['empresa_combo'].get()
-                        if not empresa_ref_str:
-                            continue
-
-                        # Parse "Name - State - Service"
-                        # Try to find the company in DB. Since string format is unique enough
-                        # We can iterate over all companies or try to parse
-                        # Robust parsing: "Name - State - Service Type"
-                        # Use rsplit to handle cases where company name contains hyphen
-                        # But format is "{nome} - {estado} - {tipo_servico}"
-                        # So we expect exactly 2 " - " separators.
-                        parts = empresa_ref_str.split(" - ")
-                        if len(parts) >= 3:
-                            # If name contains " - ", parts will have more than 3 elements.
-                            # The last element is type, second last is state. Everything before is name.
-                            tipo_servico_ref = parts[-1]
-                            # estado = parts[-2]
-                            nome_empresa = " - ".join(parts[:-2])
-
-                            ref_data = self.db.get_empresa_referencia_by_nome_e_tipo(nome_empresa, tipo_servico_ref)
-
-                            if ref_data:
-                                preco_unitario = ref_data['valor_mensal']
-                                preco_total_servico += qtd * preco_unitario
-
-                                current_price_str = format_currency(preco_unitario)
-                                if preco_unitario_display == "Varia":
-                                    if total_qtd_equipes == qtd: # First item processed (since total_qtd_equipes accumulates)
-                                        preco_unitario_display = current_price_str
-                                    # else: already variable, keep it "Varia"
-                                elif preco_unitario_display != current_price_str:
-                                     preco_unitario_display = "Varia"
-                            else:
-                                has_error = True
-                        else:
-                             has_error = True
-
-                    except (ValueError, TypeError):
-                        messagebox.showerror("Erro de Formato", f"Verifique os valores de Quantidade e Volumetria para o serviço '{servico_nome}'. Devem ser números.", parent=form_win)
-                        return
-
-                if has_error and preco_total_servico == 0:
-                     servicos_tree.insert('', 'end', values=(servico_nome, total_qtd_equipes, f"{total_volumetria:,.2f}", 'N/A', 'Ref. não encontrada', 'N/A'))
-                     continue
-
-                faturamento_total += preco_total_servico
-
-                # Calcular Valor US/UPS/UPE
-                valor_us_ups = preco_total_servico / total_volumetria if total_volumetria > 0 else 0.0
-
-                # 7. Inserir na árvore
                 servicos_tree.insert('', 'end', values=(
-                    servico_nome,
-                    total_qtd_equipes,
-                    f"{total_volumetria:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."),
-                    preco_unitario_display,
-                    format_currency(preco_total_servico),
-                    format_currency(valor_us_ups)
+                    servico.servico,
+                    quantidade,
+                    volumetria,
+                    "Varia" if servico.varia else format_currency(servico.preco_unitario),
+                    format_currency(servico.valor_total),
+                    format_currency(servico.valor_unitario)
                 ))
 
-            # 8. Atualizar campo de faturamento estimado
+            # Atualizar campo de faturamento estimado
+            faturamento_total = summary['valor_total'].sum()
             entries['faturamento_estimado'].delete(0, 'end')
-            faturamento_estimado_str = f"{faturamento_total:.2f}".replace('.', ',')
-            entries['faturamento_estimado'].insert(0, faturamento_estimado_str)
+            entries['faturamento_estimado'].insert(0, f"{faturamento_total:.2f}".replace('.', ','))
             messagebox.showinfo("Sucesso", "Cálculo de preços concluído e Faturamento Estimado atualizado.", parent=form_win)
 
 
@@ -3724,7 +7652,10 @@ class CRMApp:
         # Carregar dados se editando oportunidade existente
         if op_id:
             try:
-                op_data = self.db.get_opportunity_details(op_id)
+                if snapshot and snapshot.opportunity['id'] == op_id:
+                    op_data = snapshot.opportunity
+                else:
+                    op_data = self.db.get_opportunity_details(op_id)
                 if not op_data:
                     messagebox.showerror("Erro", f"Não foi possível encontrar os dados para a oportunidade com ID {op_id}.", parent=form_win)
                     return
@@ -3889,27 +7820,7 @@ class CRMApp:
                 data['bases_nomes'] = json.dumps([entry.get().strip() for entry in base_widgets if entry.get().strip()])
 
                 # Coletar dados da nova estrutura dinâmica de serviços e equipes
-                servicos_data_to_save = []
-                tipos_servico_vars = entries.get('tipos_servico_vars', {})
-                servico_equipes_data = entries.get('servicos_data', {})
-
-                for servico_nome, equipe_rows in servico_equipes_data.items():
-                    if tipos_servico_vars.get(servico_nome) and tipos_servico_vars[servico_nome].get():
-                        equipes_to_save = []
-                        for row_widgets in equipe_rows:
-                            equipe_data = {
-                                "tipo_equipe": row_widgets['tipo_combo'].get(),
-                                "quantidade": row_widgets['qtd_entry'].get(),
-                                "volumetria": row_widgets['vol_entry'].get(),
-                                "base": row_widgets['base_combo'].get(),
-                                "empresa_referencia": row_widgets['empresa_combo'].get()
-                            }
-                            equipes_to_save.append(equipe_data)
-
-                        servico_entry = { "servico_nome": servico_nome, "equipes": equipes_to_save }
-                        servicos_data_to_save.append(servico_entry)
-
-                data['servicos_data'] = json.dumps(servicos_data_to_save)
+                data['servicos_data'] = json.dumps(_collect_servicos_data())
 
                 # Coletar dados do formulário de qualificação
                 qualificacao_answers = {}
@@ -3975,11 +7886,12 @@ class CRMApp:
         details_win.geometry("900x700")
         details_win.configure(bg=DOLP_COLORS['white'])
 
-        op_data = self.db.get_opportunity_details(op_id)
-        if not op_data:
+        snapshot = OpportunityAggregate(self.db).load(op_id)
+        if not snapshot:
             messagebox.showerror("Erro", "Oportunidade não encontrada!")
             details_win.destroy()
             return
+        op_data = snapshot.opportunity
 
         op_keys = op_data.keys()
 
@@ -3988,229 +7900,213 @@ class CRMApp:
 
         title_text = f"{op_data['numero_oportunidade'] if 'numero_oportunidade' in op_keys else 'OPP-?????'}: {op_data['titulo'] if 'titulo' in op_keys else 'Sem Título'}"
         ttk.Label(header_frame, text=title_text, style='Title.TLabel').pack(side='left')
-        ttk.Button(header_frame, text="Editar Detalhes", command=lambda: [details_win.destroy(), self.show_opportunity_form(op_id)], style='Primary.TButton').pack(side='right')
+        ttk.Button(header_frame, text="Editar Detalhes", command=lambda: [details_win.destroy(), self.show_opportunity_form(op_id, snapshot=snapshot)], style='Primary.TButton').pack(side='right')
         ttk.Button(header_frame, text="← Voltar", command=details_win.destroy, style='TButton').pack(side='right', padx=(0, 10))
 
         notebook = ttk.Notebook(details_win, padding=10)
         notebook.pack(fill='both', expand=True, padx=20, pady=(0, 20))
 
-        # --- Refatoração para usar abas com rolagem ---
+        # As abas são montadas sob demanda: cada uma só é construída na primeira vez em que é exibida.
+        # Os dados de todas elas já vêm do snapshot carregado em uma única transação.
+        tab_builders = {}
+        built_tabs = set()
 
         # Aba 1: Análise Prévia de Viabilidade
-        analise_tab = self._create_scrollable_tab(notebook, '  Análise Prévia de Viabilidade  ')
-
-        # Botão de Exportar
-        export_analise_btn = ttk.Button(analise_tab, text="Exportar para PDF", command=lambda: self.export_analise_previa_pdf(op_id), style='Primary.TButton')
-        export_analise_btn.pack(anchor='ne', pady=(0, 10))
-
-        info_frame = ttk.LabelFrame(analise_tab, text="Informações Básicas", padding=15, style='White.TLabelframe')
-        info_frame.pack(fill='x', pady=(0, 10))
-
-        basic_info = [
-            ("Cliente:", op_data['nome_empresa'] if 'nome_empresa' in op_keys else '---'),
-            ("Estágio:", op_data['estagio_nome'] if 'estagio_nome' in op_keys else '---'),
-            ("Valor Estimado:", format_currency(op_data['valor'] if 'valor' in op_keys else 0)),
-            ("Tempo de Contrato:", f"{op_data['tempo_contrato_meses']} meses" if 'tempo_contrato_meses' in op_keys and op_data['tempo_contrato_meses'] else "---"),
-            ("Regional:", op_data['regional'] if 'regional' in op_keys else '---'),
-            ("Polo:", op_data['polo'] if 'polo' in op_keys else '---')
-            # ("Empresa Referência:", op_data['empresa_referencia'] if 'empresa_referencia' in op_keys else '---') # Removed global reference
-        ]
+        def _build_analise(analise_tab):
+            # Botão de Exportar
+            export_analise_btn = ttk.Button(analise_tab, text="Exportar para PDF", command=lambda: self.export_analise_previa_pdf(op_id, snapshot=snapshot), style='Primary.TButton')
+            export_analise_btn.pack(anchor='ne', pady=(0, 10))
+
+            info_frame = ttk.LabelFrame(analise_tab, text="Informações Básicas", padding=15, style='White.TLabelframe')
+            info_frame.pack(fill='x', pady=(0, 10))
+
+            basic_info = [
+                ("Cliente:", op_data['nome_empresa'] if 'nome_empresa' in op_keys else '---'),
+                ("Estágio:", op_data['estagio_nome'] if 'estagio_nome' in op_keys else '---'),
+                ("Valor Estimado:", format_currency(op_data['valor'] if 'valor' in op_keys else 0)),
+                ("Tempo de Contrato:", f"{op_data['tempo_contrato_meses']} meses" if 'tempo_contrato_meses' in op_keys and op_data['tempo_contrato_meses'] else "---"),
+                ("Regional:", op_data['regional'] if 'regional' in op_keys else '---'),
+                ("Polo:", op_data['polo'] if 'polo' in op_keys else '---')
+                # ("Empresa Referência:", op_data['empresa_referencia'] if 'empresa_referencia' in op_keys else '---') # Removed global reference
+            ]
 
-        info_frame.columnconfigure(1, weight=1)
-        for i, (label, value) in enumerate(basic_info):
-            ttk.Label(info_frame, text=label, style='Metric.White.TLabel').grid(row=i, column=0, sticky='w', pady=2)
-            ttk.Label(info_frame, text=str(value), style='Value.White.TLabel', wraplength=400).grid(row=i, column=1, sticky='w', pady=2, padx=(10,0))
+            info_frame.columnconfigure(1, weight=1)
+            for i, (label, value) in enumerate(basic_info):
+                ttk.Label(info_frame, text=label, style='Metric.White.TLabel').grid(row=i, column=0, sticky='w', pady=2)
+                ttk.Label(info_frame, text=str(value), style='Value.White.TLabel', wraplength=400).grid(row=i, column=1, sticky='w', pady=2, padx=(10,0))
 
-        bases_nomes_json = op_data['bases_nomes'] if 'bases_nomes' in op_keys else None
-        if bases_nomes_json:
-            try:
-                bases_nomes = json.loads(bases_nomes_json)
-                if bases_nomes:
-                    bases_frame = ttk.LabelFrame(analise_tab, text="Bases Alocadas", padding=15, style='White.TLabelframe')
-                    bases_frame.pack(fill='x', pady=(10, 0))
-                    for i, base in enumerate(bases_nomes, 1):
-                        base_frame = ttk.Frame(bases_frame)
-                        base_frame.pack(fill='x', pady=2)
-                        ttk.Label(base_frame, text=f"Base {i}:", style='Metric.White.TLabel', width=10).pack(side='left')
-                        ttk.Label(base_frame, text=base, style='Value.White.TLabel').pack(side='left', padx=(10, 0))
-            except (json.JSONDecodeError, TypeError):
-                print(f"Alerta: Falha ao carregar nomes de bases na tela de detalhes: {bases_nomes_json}")
+            bases_nomes_json = op_data['bases_nomes'] if 'bases_nomes' in op_keys else None
+            if bases_nomes_json:
+                try:
+                    bases_nomes = json.loads(bases_nomes_json)
+                    if bases_nomes:
+                        bases_frame = ttk.LabelFrame(analise_tab, text="Bases Alocadas", padding=15, style='White.TLabelframe')
+                        bases_frame.pack(fill='x', pady=(10, 0))
+                        for i, base in enumerate(bases_nomes, 1):
+                            base_frame = ttk.Frame(bases_frame)
+                            base_frame.pack(fill='x', pady=2)
+                            ttk.Label(base_frame, text=f"Base {i}:", style='Metric.White.TLabel', width=10).pack(side='left')
+                            ttk.Label(base_frame, text=base, style='Value.White.TLabel').pack(side='left', padx=(10, 0))
+                except (json.JSONDecodeError, TypeError):
+                    print(f"Alerta: Falha ao carregar nomes de bases na tela de detalhes: {bases_nomes_json}")
 
-        qual_frame = ttk.LabelFrame(analise_tab, text="Formulário de Análise de Qualificação da Oportunidade", padding=15, style='White.TLabelframe')
-        qual_frame.pack(fill='x', pady=(10, 0))
-        qualificacao_data_json = op_data['qualificacao_data'] if 'qualificacao_data' in op_keys else None
-        qualificacao_answers = {}
-        if qualificacao_data_json:
-            try:
-                qualificacao_answers = json.loads(qualificacao_data_json)
-            except (json.JSONDecodeError, TypeError):
-                pass
-        q_diferenciais = "Quais são nossos diferenciais competitivos claros para esta oportunidade específica?"
-        q_riscos = "Quais os principais riscos (técnicos, logísticos, regulatórios, políticos) associados ao projeto?"
-        for section, questions in QUALIFICATION_CHECKLIST.items():
-            section_frame = ttk.LabelFrame(qual_frame, text=section, padding=10, style='White.TLabelframe')
-            section_frame.pack(fill='x', expand=True, pady=5)
-            section_frame.columnconfigure(1, weight=1)
-            row_idx = 0
-            for question in questions:
-                if question == q_diferenciais:
-                    ttk.Label(section_frame, text=question, style='Metric.White.TLabel').grid(row=row_idx, column=0, sticky='w', pady=2)
-                    diferenciais_text = (op_data['diferenciais_competitivos'] if 'diferenciais_competitivos' in op_keys and op_data['diferenciais_competitivos'] else "---")
-                    ttk.Label(section_frame, text=diferenciais_text, style='Value.White.TLabel', wraplength=600).grid(row=row_idx, column=1, sticky='w', pady=2, padx=(10,0))
-                    row_idx +=1
-                elif question == q_riscos:
-                    ttk.Label(section_frame, text=question, style='Metric.White.TLabel').grid(row=row_idx, column=0, sticky='w', pady=2)
-                    riscos_text = (op_data['principais_riscos'] if 'principais_riscos' in op_keys and op_data['principais_riscos'] else "---")
-                    ttk.Label(section_frame, text=riscos_text, style='Value.White.TLabel', wraplength=600).grid(row=row_idx, column=1, sticky='w', pady=2, padx=(10,0))
-                    row_idx +=1
-                elif question in qualificacao_answers:
-                    answer = qualificacao_answers[question] or "Não respondido"
-                    ttk.Label(section_frame, text=question, wraplength=600, justify='left', style='Value.White.TLabel').grid(row=row_idx, column=0, sticky='w')
-                    ttk.Label(section_frame, text=answer, style='Value.White.TLabel').grid(row=row_idx, column=1, sticky='e', padx=10)
-                    row_idx += 1
+            qual_frame = ttk.LabelFrame(analise_tab, text="Formulário de Análise de Qualificação da Oportunidade", padding=15, style='White.TLabelframe')
+            qual_frame.pack(fill='x', pady=(10, 0))
+            qualificacao_data_json = op_data['qualificacao_data'] if 'qualificacao_data' in op_keys else None
+            qualificacao_answers = {}
+            if qualificacao_data_json:
+                try:
+                    qualificacao_answers = json.loads(qualificacao_data_json)
+                except (json.JSONDecodeError, TypeError):
+                    pass
+            q_diferenciais = "Quais são nossos diferenciais competitivos claros para esta oportunidade específica?"
+            q_riscos = "Quais os principais riscos (técnicos, logísticos, regulatórios, políticos) associados ao projeto?"
+            for section, questions in QUALIFICATION_CHECKLIST.items():
+                section_frame = ttk.LabelFrame(qual_frame, text=section, padding=10, style='White.TLabelframe')
+                section_frame.pack(fill='x', expand=True, pady=5)
+                section_frame.columnconfigure(1, weight=1)
+                row_idx = 0
+                for question in questions:
+                    if question == q_diferenciais:
+                        ttk.Label(section_frame, text=question, style='Metric.White.TLabel').grid(row=row_idx, column=0, sticky='w', pady=2)
+                        diferenciais_text = (op_data['diferenciais_competitivos'] if 'diferenciais_competitivos' in op_keys and op_data['diferenciais_competitivos'] else "---")
+                        ttk.Label(section_frame, text=diferenciais_text, style='Value.White.TLabel', wraplength=600).grid(row=row_idx, column=1, sticky='w', pady=2, padx=(10,0))
+                        row_idx +=1
+                    elif question == q_riscos:
+                        ttk.Label(section_frame, text=question, style='Metric.White.TLabel').grid(row=row_idx, column=0, sticky='w', pady=2)
+                        riscos_text = (op_data['principais_riscos'] if 'principais_riscos' in op_keys and op_data['principais_riscos'] else "---")
+                        ttk.Label(section_frame, text=riscos_text, style='Value.White.TLabel', wraplength=600).grid(row=row_idx, column=1, sticky='w', pady=2, padx=(10,0))
+                        row_idx +=1
+                    elif question in qualificacao_answers:
+                        answer = qualificacao_answers[question] or "Não respondido"
+                        ttk.Label(section_frame, text=question, wraplength=600, justify='left', style='Value.White.TLabel').grid(row=row_idx, column=0, sticky='w')
+                        ttk.Label(section_frame, text=answer, style='Value.White.TLabel').grid(row=row_idx, column=1, sticky='e', padx=10)
+                        row_idx += 1
 
         # Aba 2: Sumário Executivo
-        sumario_tab = self._create_scrollable_tab(notebook, '  Sumário Executivo  ')
-
-        export_sumario_btn = ttk.Button(sumario_tab, text="Exportar para PDF", command=lambda: self.export_sumario_executivo_pdf(op_id), style='Primary.TButton')
-        export_sumario_btn.pack(anchor='ne', pady=(0, 10))
-        edital_frame = ttk.LabelFrame(sumario_tab, text="Informações do Edital", padding=15, style='White.TLabelframe')
-        edital_frame.pack(fill='x', pady=(0, 10))
-        edital_info = [
-            ("Número do Edital:", op_data['numero_edital'] if 'numero_edital' in op_keys else '---'),
-            ("Data de Abertura:", op_data['data_abertura'] if 'data_abertura' in op_keys else '---'),
-            ("Modalidade:", op_data['modalidade'] if 'modalidade' in op_keys else '---'),
-            ("Contato Principal:", op_data['contato_principal'] if 'contato_principal' in op_keys else '---')
-        ]
-        edital_frame.columnconfigure(1, weight=1)
-        for i, (label, value) in enumerate(edital_info):
-            ttk.Label(edital_frame, text=label, style='Metric.White.TLabel').grid(row=i, column=0, sticky='w', pady=2)
-            ttk.Label(edital_frame, text=str(value), style='Value.White.TLabel').grid(row=i, column=1, sticky='w', pady=2, padx=(10,0))
-        link_docs = op_data['link_documentos'] if 'link_documentos' in op_keys else None
-        if link_docs:
-            row_index = len(edital_info)
-            ttk.Label(edital_frame, text="Pasta de Documentos:", style='Metric.White.TLabel').grid(row=row_index, column=0, sticky='w', pady=2)
-            link_label = ttk.Label(edital_frame, text="Abrir Pasta", style='Link.White.TLabel', cursor="hand2")
-            link_label.grid(row=row_index, column=1, sticky='w', pady=2, padx=(10,0))
-            link_label.bind("<Button-1>", lambda e, url=link_docs: open_link(url))
-        financeiro_frame = ttk.LabelFrame(sumario_tab, text="Informações Financeiras e de Pessoal", padding=15, style='White.TLabelframe')
-        financeiro_frame.pack(fill='x', pady=(10, 10))
-        financeiro_info = [
-            ("Faturamento Estimado:", format_currency(op_data['faturamento_estimado'] if 'faturamento_estimado' in op_keys else 0)),
-            ("Duração do Contrato:", f"{op_data['duracao_contrato']} meses" if 'duracao_contrato' in op_keys and op_data['duracao_contrato'] else "---"),
-            ("MOD (Mão de Obra Direta):", op_data['mod'] if 'mod' in op_keys else '---'),
-            ("MOI (Mão de Obra Indireta):", op_data['moi'] if 'moi' in op_keys else '---'),
-            ("Total de Pessoas:", op_data['total_pessoas'] if 'total_pessoas' in op_keys else '---'),
-            ("Margem de Contribuição:", f"{op_data['margem_contribuicao']}%" if 'margem_contribuicao' in op_keys and op_data['margem_contribuicao'] else "---")
-        ]
-        financeiro_frame.columnconfigure(1, weight=1)
-        for i, (label, value) in enumerate(financeiro_info):
-            ttk.Label(financeiro_frame, text=label, style='Metric.White.TLabel').grid(row=i, column=0, sticky='w', pady=2)
-            ttk.Label(financeiro_frame, text=str(value), style='Value.White.TLabel').grid(row=i, column=1, sticky='w', pady=2, padx=(10,0))
-        servicos_data_json_str = op_data['servicos_data'] if 'servicos_data' in op_keys else None
-        if servicos_data_json_str:
-            try:
-                servicos_data = json.loads(servicos_data_json_str)
-                if servicos_data:
-                    servicos_frame = ttk.LabelFrame(sumario_tab, text="Serviços e Equipes Configurados", padding=15, style='White.TLabelframe')
-                    servicos_frame.pack(fill='x', pady=(10,0))
-                    for servico_info in servicos_data:
-                        servico_nome = servico_info.get("servico_nome", "N/A")
-                        equipes = servico_info.get("equipes", [])
-                        ttk.Label(servicos_frame, text=servico_nome, style='Metric.White.TLabel', font=('Segoe UI', 11, 'bold')).pack(anchor='w', pady=(5,2))
-                        if not equipes:
-                            ttk.Label(servicos_frame, text="  - Nenhuma equipe configurada", style='Value.White.TLabel').pack(anchor='w', padx=(15,0))
-                        else:
-                            for equipe in equipes:
-                                equipe_nome = equipe.get('tipo_equipe', 'N/A')
-                                qtd_str = equipe.get('quantidade', '0')
-                                vol_str = equipe.get('volumetria', '0')
-                                base = equipe.get('base', 'N/A')
-                                empresa_ref = equipe.get('empresa_referencia', '')
-
-                                # Calculations
-                                try:
-                                    qtd = float(str(qtd_str).replace(',', '.'))
-                                except: qtd = 0.0
-
-                                try:
-                                    vol = float(str(vol_str).replace(',', '.'))
-                                except: vol = 0.0
-
-                                unit_price = self.db.get_empresa_referencia_price_by_string(empresa_ref)
-                                total_team_value = unit_price * qtd
-                                value_us_ups_upe = (total_team_value / vol) if vol > 0 else 0.0
-
-                                info_text = f"  - Equipe: {equipe_nome} | Qtd: {qtd_str} | Volumetria: {vol_str} | Base: {base} | Ref: {empresa_ref}"
-                                calc_text = f"    Valor Total Equipe: {format_currency(total_team_value)} | Valor US/UPS/UPE: {format_currency(value_us_ups_upe)}"
-
-                                team_frame = ttk.Frame(servicos_frame)
-                                team_frame.pack(fill='x', padx=(15,0), pady=2)
-                                ttk.Label(team_frame, text=info_text, style='Value.White.TLabel').pack(anchor='w')
-                                ttk.Label(team_frame, text=calc_text, style='Value.White.TLabel', foreground=DOLP_COLORS['secondary_blue']).pack(anchor='w')
-            except (json.JSONDecodeError, TypeError):
-                print(f"Alerta: Falha ao carregar dados de serviço na tela de detalhes: {servicos_data_json_str}")
-        descricao_detalhada = op_data['descricao_detalhada'] if 'descricao_detalhada' in op_keys else None
-        if descricao_detalhada:
-            desc_frame = ttk.LabelFrame(sumario_tab, text="Descrição Detalhada", padding=15, style='White.TLabelframe')
-            desc_frame.pack(fill='both', expand=True, pady=(10, 0))
-            desc_text = tk.Text(desc_frame, height=5, wrap='word', bg='white', font=('Segoe UI', 10), state='disabled')
-            desc_scrollbar = ttk.Scrollbar(desc_frame, orient="vertical", command=desc_text.yview)
-            desc_text.configure(yscrollcommand=desc_scrollbar.set)
-            desc_text.pack(side="left", fill="both", expand=True)
-            desc_scrollbar.pack(side="right", fill="y")
-            desc_text.config(state='normal')
-            desc_text.insert('1.0', descricao_detalhada)
-            desc_text.config(state='disabled')
+        def _build_sumario(sumario_tab):
+            export_sumario_btn = ttk.Button(sumario_tab, text="Exportar para PDF", command=lambda: self.export_sumario_executivo_pdf(op_id, snapshot=snapshot), style='Primary.TButton')
+            export_sumario_btn.pack(anchor='ne', pady=(0, 10))
+            edital_frame = ttk.LabelFrame(sumario_tab, text="Informações do Edital", padding=15, style='White.TLabelframe')
+            edital_frame.pack(fill='x', pady=(0, 10))
+            edital_info = [
+                ("Número do Edital:", op_data['numero_edital'] if 'numero_edital' in op_keys else '---'),
+                ("Data de Abertura:", op_data['data_abertura'] if 'data_abertura' in op_keys else '---'),
+                ("Modalidade:", op_data['modalidade'] if 'modalidade' in op_keys else '---'),
+                ("Contato Principal:", op_data['contato_principal'] if 'contato_principal' in op_keys else '---')
+            ]
+            edital_frame.columnconfigure(1, weight=1)
+            for i, (label, value) in enumerate(edital_info):
+                ttk.Label(edital_frame, text=label, style='Metric.White.TLabel').grid(row=i, column=0, sticky='w', pady=2)
+                ttk.Label(edital_frame, text=str(value), style='Value.White.TLabel').grid(row=i, column=1, sticky='w', pady=2, padx=(10,0))
+            link_docs = op_data['link_documentos'] if 'link_documentos' in op_keys else None
+            if link_docs:
+                row_index = len(edital_info)
+                ttk.Label(edital_frame, text="Pasta de Documentos:", style='Metric.White.TLabel').grid(row=row_index, column=0, sticky='w', pady=2)
+                link_label = ttk.Label(edital_frame, text="Abrir Pasta", style='Link.White.TLabel', cursor="hand2")
+                link_label.grid(row=row_index, column=1, sticky='w', pady=2, padx=(10,0))
+                link_label.bind("<Button-1>", lambda e, url=link_docs: open_link(url))
+            financeiro_frame = ttk.LabelFrame(sumario_tab, text="Informações Financeiras e de Pessoal", padding=15, style='White.TLabelframe')
+            financeiro_frame.pack(fill='x', pady=(10, 10))
+            financeiro_info = [
+                ("Faturamento Estimado:", format_currency(op_data['faturamento_estimado'] if 'faturamento_estimado' in op_keys else 0)),
+                ("Duração do Contrato:", f"{op_data['duracao_contrato']} meses" if 'duracao_contrato' in op_keys and op_data['duracao_contrato'] else "---"),
+                ("MOD (Mão de Obra Direta):", op_data['mod'] if 'mod' in op_keys else '---'),
+                ("MOI (Mão de Obra Indireta):", op_data['moi'] if 'moi' in op_keys else '---'),
+                ("Total de Pessoas:", op_data['total_pessoas'] if 'total_pessoas' in op_keys else '---'),
+                ("Margem de Contribuição:", f"{op_data['margem_contribuicao']}%" if 'margem_contribuicao' in op_keys and op_data['margem_contribuicao'] else "---")
+            ]
+            financeiro_frame.columnconfigure(1, weight=1)
+            for i, (label, value) in enumerate(financeiro_info):
+                ttk.Label(financeiro_frame, text=label, style='Metric.White.TLabel').grid(row=i, column=0, sticky='w', pady=2)
+                ttk.Label(financeiro_frame, text=str(value), style='Value.White.TLabel').grid(row=i, column=1, sticky='w', pady=2, padx=(10,0))
+            servicos_data_json_str = op_data['servicos_data'] if 'servicos_data' in op_keys else None
+            if servicos_data_json_str:
+                try:
+                    servicos_data = json.loads(servicos_data_json_str)
+                    if servicos_data:
+                        servicos_frame = ttk.LabelFrame(sumario_tab, text="Serviços e Equipes Configurados", padding=15, style='White.TLabelframe')
+                        servicos_frame.pack(fill='x', pady=(10,0))
+                        priced = snapshot.priced_teams()
+                        for idx, servico_info in enumerate(servicos_data):
+                            servico_nome = servico_info.get("servico_nome", "N/A")
+                            equipes = priced[priced['servico_idx'] == idx]
+                            ttk.Label(servicos_frame, text=servico_nome, style='Metric.White.TLabel', font=('Segoe UI', 11, 'bold')).pack(anchor='w', pady=(5,2))
+                            if equipes.empty:
+                                ttk.Label(servicos_frame, text="  - Nenhuma equipe configurada", style='Value.White.TLabel').pack(anchor='w', padx=(15,0))
+                            else:
+                                for equipe in equipes.itertuples(index=False):
+                                    info_text = f"  - Equipe: {equipe.tipo_equipe} | Qtd: {equipe.quantidade} | Volumetria: {equipe.volumetria} | Base: {equipe.base} | Ref: {equipe.empresa_referencia}"
+                                    calc_text = f"    Valor Total Equipe: {format_currency(equipe.valor_total)} | Valor US/UPS/UPE: {format_currency(equipe.valor_unitario)}"
+
+                                    team_frame = ttk.Frame(servicos_frame)
+                                    team_frame.pack(fill='x', padx=(15,0), pady=2)
+                                    ttk.Label(team_frame, text=info_text, style='Value.White.TLabel').pack(anchor='w')
+                                    ttk.Label(team_frame, text=calc_text, style='Value.White.TLabel', foreground=DOLP_COLORS['secondary_blue']).pack(anchor='w')
+                except (json.JSONDecodeError, TypeError):
+                    print(f"Alerta: Falha ao carregar dados de serviço na tela de detalhes: {servicos_data_json_str}")
+            descricao_detalhada = op_data['descricao_detalhada'] if 'descricao_detalhada' in op_keys else None
+            if descricao_detalhada:
+                desc_frame = ttk.LabelFrame(sumario_tab, text="Descrição Detalhada", padding=15, style='White.TLabelframe')
+                desc_frame.pack(fill='both', expand=True, pady=(10, 0))
+                desc_text = tk.Text(desc_frame, height=5, wrap='word', bg='white', font=('Segoe UI', 10), state='disabled')
+                desc_scrollbar = ttk.Scrollbar(desc_frame, orient="vertical", command=desc_text.yview)
+                desc_text.configure(yscrollcommand=desc_scrollbar.set)
+                desc_text.pack(side="left", fill="both", expand=True)
+                desc_scrollbar.pack(side="right", fill="y")
+                desc_text.config(state='normal')
+                desc_text.insert('1.0', descricao_detalhada)
+                desc_text.config(state='disabled')
 
         # Aba 3: Histórico de Interações
-        interacoes_tab = self._create_scrollable_tab(notebook, '  Histórico de Interações  ')
-
-        try:
-            # --- Filtros para Interações ---
-            filters_interactions_frame = ttk.LabelFrame(interacoes_tab, text="Filtros", padding=15, style='White.TLabelframe')
-            filters_interactions_frame.pack(fill='x', pady=(0, 10))
-
-            # Tipo
-            ttk.Label(filters_interactions_frame, text="Tipo:", style='TLabel').grid(row=0, column=0, sticky='w', padx=(0, 5))
-            interaction_types = ['Todos'] + self.db.get_interaction_types()
-            tipo_int_filter = ttk.Combobox(filters_interactions_frame, values=interaction_types, state='readonly')
-            tipo_int_filter.set('Todos')
-            tipo_int_filter.grid(row=0, column=1, padx=(0, 20))
-
-            # Data Início
-            ttk.Label(filters_interactions_frame, text="De:", style='TLabel').grid(row=0, column=2, sticky='w', padx=(0, 5))
-            start_date_int_filter = DateEntry(filters_interactions_frame, date_pattern='dd/mm/yyyy', width=12)
-            start_date_int_filter.delete(0, 'end') # Limpar campo inicial
-            start_date_int_filter.grid(row=0, column=3, padx=(0, 20))
-
-            # Data Fim
-            ttk.Label(filters_interactions_frame, text="Até:", style='TLabel').grid(row=0, column=4, sticky='w', padx=(0, 5))
-            end_date_int_filter = DateEntry(filters_interactions_frame, date_pattern='dd/mm/yyyy', width=12)
-            end_date_int_filter.delete(0, 'end') # Limpar campo inicial
-            end_date_int_filter.grid(row=0, column=5, padx=(0, 20))
-
-            # Container para os resultados
-            interactions_results_frame = ttk.Frame(interacoes_tab, style='TFrame')
-            interactions_results_frame.pack(fill='both', expand=True, pady=(10,0))
-        except Exception as e:
-            ttk.Label(interacoes_tab, text=f"Erro ao carregar aba: {e}", foreground='red').pack(pady=20)
+        def _build_interacoes(interacoes_tab):
+            try:
+                # --- Filtros para Interações ---
+                filters_interactions_frame = ttk.LabelFrame(interacoes_tab, text="Filtros", padding=15, style='White.TLabelframe')
+                filters_interactions_frame.pack(fill='x', pady=(0, 10))
+
+                # Tipo
+                ttk.Label(filters_interactions_frame, text="Tipo:", style='TLabel').grid(row=0, column=0, sticky='w', padx=(0, 5))
+                interaction_types = ['Todos'] + list(snapshot.interaction_types)
+                tipo_int_filter = ttk.Combobox(filters_interactions_frame, values=interaction_types, state='readonly')
+                tipo_int_filter.set('Todos')
+                tipo_int_filter.grid(row=0, column=1, padx=(0, 20))
+
+                # Data Início
+                ttk.Label(filters_interactions_frame, text="De:", style='TLabel').grid(row=0, column=2, sticky='w', padx=(0, 5))
+                start_date_int_filter = DateEntry(filters_interactions_frame, date_pattern='dd/mm/yyyy', width=12)
+                start_date_int_filter.delete(0, 'end') # Limpar campo inicial
+                start_date_int_filter.grid(row=0, column=3, padx=(0, 20))
+
+                # Data Fim
+                ttk.Label(filters_interactions_frame, text="Até:", style='TLabel').grid(row=0, column=4, sticky='w', padx=(0, 5))
+                end_date_int_filter = DateEntry(filters_interactions_frame, date_pattern='dd/mm/yyyy', width=12)
+                end_date_int_filter.delete(0, 'end') # Limpar campo inicial
+                end_date_int_filter.grid(row=0, column=5, padx=(0, 20))
+
+                # Container para os resultados
+                interactions_results_frame = ttk.Frame(interacoes_tab, style='TFrame')
+                interactions_results_frame.pack(fill='both', expand=True, pady=(10,0))
+            except Exception as e:
+                ttk.Label(interacoes_tab, text=f"Erro ao carregar aba: {e}", foreground='red').pack(pady=20)
 
-        def _refilter_interactions():
-            # Limpar resultados antigos com verificação de existência
-            if interactions_results_frame.winfo_exists():
-                for widget in interactions_results_frame.winfo_children():
-                    widget.destroy()
+            def _refilter_interactions(use_snapshot=False):
+                # Limpar resultados antigos com verificação de existência
+                if interactions_results_frame.winfo_exists():
+                    for widget in interactions_results_frame.winfo_children():
+                        widget.destroy()
 
-            # Obter valores dos filtros
-            tipo = tipo_int_filter.get()
-            start_date = start_date_int_filter.get()
-            end_date = end_date_int_filter.get()
+                # Obter valores dos filtros
+                tipo = tipo_int_filter.get()
+                start_date = start_date_int_filter.get()
+                end_date = end_date_int_filter.get()
 
-            interacoes = self.db.get_interactions_for_opportunity(op_id, tipo, start_date, end_date)
+                if use_snapshot:
+                    interacoes = snapshot.interacoes
+                else:
+                    interacoes = self.db.get_interactions_for_opportunity(op_id, tipo, start_date, end_date)
 
-            if interacoes:
-                for interacao in interacoes:
+                def _render_interaction(interacao):
                     # Formatação do cabeçalho e detalhes
                     header_text = f"{interacao['tipo']} - {interacao['data_interacao']}"
 
@@ -4237,53 +8133,53 @@ class CRMApp:
                                command=lambda i_id=interacao['id']: self.edit_interaction_dialog(i_id, op_id, details_win)).pack(side='right')
 
                     ttk.Label(int_frame, text=interacao['resumo'], style='Value.White.TLabel', wraplength=750, justify='left').pack(anchor='w', pady=(5, 0))
-            else:
-                ttk.Label(interactions_results_frame, text="Nenhuma interação encontrada para os filtros selecionados.", style='Value.White.TLabel').pack(pady=20)
-
-        # Botão de Filtrar
-        ttk.Button(filters_interactions_frame, text="🔍 Filtrar", command=_refilter_interactions, style='Primary.TButton').grid(row=0, column=6, padx=(20, 0))
-
-        # Botão de Nova Interação (movido para o frame de filtros para melhor layout)
-        ttk.Button(filters_interactions_frame, text="Nova Interação", command=lambda: self.add_interaction_dialog(op_id, details_win), style='Success.TButton').grid(row=0, column=7, padx=(10,0))
 
-        # Export PDF Button
-        def _export_current_interactions():
-            # Re-fetch based on current filters to ensure we are exporting what is visible/selected criteria
-            tipo = tipo_int_filter.get()
-            start_date = start_date_int_filter.get()
-            end_date = end_date_int_filter.get()
-            current_interactions = self.db.get_interactions_for_opportunity(op_id, tipo, start_date, end_date)
+                if interacoes:
+                    self._render_paginated(interactions_results_frame, interacoes, _render_interaction)
+                else:
+                    ttk.Label(interactions_results_frame, text="Nenhuma interação encontrada para os filtros selecionados.", style='Value.White.TLabel').pack(pady=20)
 
-            if current_interactions:
-                self.export_interactions_pdf(op_id, current_interactions)
-            else:
-                messagebox.showinfo("Exportar PDF", "Não há interações para exportar com os filtros atuais.")
+            # Botão de Filtrar
+            ttk.Button(filters_interactions_frame, text="🔍 Filtrar", command=_refilter_interactions, style='Primary.TButton').grid(row=0, column=6, padx=(20, 0))
 
-        ttk.Button(filters_interactions_frame, text="Exportar PDF", command=_export_current_interactions, style='Primary.TButton').grid(row=0, column=8, padx=(10,0))
+            # Botão de Nova Interação (movido para o frame de filtros para melhor layout)
+            ttk.Button(filters_interactions_frame, text="Nova Interação", command=lambda: self.add_interaction_dialog(op_id, details_win), style='Success.TButton').grid(row=0, column=7, padx=(10,0))
 
-        # Carregar interações iniciais
-        _refilter_interactions()
+            # Export PDF Button
+            def _export_current_interactions(export):
+                # Exporta a consulta com os filtros atuais; as interações são lidas em páginas durante a exportação
+                query = {'db_name': self.db.db_name, 'op_id': op_id, 'tipo': tipo_int_filter.get(),
+                         'start_date': start_date_int_filter.get(), 'end_date': end_date_int_filter.get()}
 
-        # Aba 4: Eventos (Gestão de Notificações)
-        eventos_tab = self._create_scrollable_tab(notebook, '  Eventos  ')
+                if self.db.count_interactions_for_opportunity(op_id, query['tipo'], query['start_date'], query['end_date']):
+                    export(op_id, query, snapshot=snapshot)
+                else:
+                    messagebox.showinfo("Exportar", "Não há interações para exportar com os filtros atuais.")
 
-        # Frame de Ação
-        events_action_frame = ttk.Frame(eventos_tab, style='TFrame')
-        events_action_frame.pack(fill='x', pady=(0, 10))
-        ttk.Button(events_action_frame, text="Novo Evento", style='Success.TButton', command=lambda: self.add_event_dialog(op_id, details_win)).pack(side='right')
+            ttk.Button(filters_interactions_frame, text="Exportar PDF", command=lambda: _export_current_interactions(self.export_interactions_pdf), style='Primary.TButton').grid(row=0, column=8, padx=(10,0))
+            ttk.Button(filters_interactions_frame, text="Exportar Planilha", command=lambda: _export_current_interactions(self.export_interactions_table), style='Primary.TButton').grid(row=0, column=9, padx=(10,0))
 
-        # Container para os eventos
-        events_results_frame = ttk.Frame(eventos_tab, style='TFrame')
-        events_results_frame.pack(fill='both', expand=True)
+            # Carregar interações iniciais
+            _refilter_interactions(use_snapshot=True)
 
-        def _refresh_events():
-            for widget in events_results_frame.winfo_children():
-                widget.destroy()
+        # Aba 4: Eventos (Gestão de Notificações)
+        def _build_eventos(eventos_tab):
+            # Frame de Ação
+            events_action_frame = ttk.Frame(eventos_tab, style='TFrame')
+            events_action_frame.pack(fill='x', pady=(0, 10))
+            ttk.Button(events_action_frame, text="Novo Evento", style='Success.TButton', command=lambda: self.add_event_dialog(op_id, details_win)).pack(side='right')
+
+            # Container para os eventos
+            events_results_frame = ttk.Frame(eventos_tab, style='TFrame')
+            events_results_frame.pack(fill='both', expand=True)
+
+            def _refresh_events():
+                for widget in events_results_frame.winfo_children():
+                    widget.destroy()
 
-            events = self.db.get_events_for_opportunity(op_id)
+                events = snapshot.events
 
-            if events:
-                for event in events:
+                def _render_event(event):
                     # Formatar datas de ISO para PT-BR
                     data_notif_display = event['data_notificacao']
                     if data_notif_display:
@@ -4341,241 +8237,266 @@ class CRMApp:
                     ttk.Button(btn_frame, text="Excluir", style='Danger.TButton', width=10,
                              command=lambda e_id=event['id']: self.delete_event_confirm(e_id, op_id, details_win)).pack(side='right')
 
-            else:
-                ttk.Label(events_results_frame, text="Nenhum evento registrado.", style='Value.White.TLabel').pack(pady=20)
+                if events:
+                    self._render_paginated(events_results_frame, events, _render_event)
+                else:
+                    ttk.Label(events_results_frame, text="Nenhum evento registrado.", style='Value.White.TLabel').pack(pady=20)
 
-        _refresh_events()
+            _refresh_events()
 
         # Aba 5: Termos Aditivos
-        aditivos_tab = self._create_scrollable_tab(notebook, '  Termos Aditivos  ')
-
-        # === CONTEÚDO DA ABA DE TERMOS ADITIVOS ===
-        # Resumo
-        summary_aditivo_frame = ttk.LabelFrame(aditivos_tab, text="Resumo Financeiro e Contratual", padding=15, style='White.TLabelframe')
-        summary_aditivo_frame.pack(fill='x', pady=(0, 10))
-
-        # Cálculos
-        original_value = op_data['valor'] if 'valor' in op_keys else 0
-        aditivos = self.db.get_termos_aditivos(op_id)
-        total_aditivos = sum(a['valor_global_aditivo'] for a in aditivos)
-        current_global = original_value + total_aditivos
-
-        # Data Fim Original (estimada baseada na duração)
-        data_fim_original = "---"
-        data_fim_atual = "---"
-
-        # Tentativa de calcular data fim original
-        # Isso depende de termos data_assinatura ou data_inicio_contrato na oportunidade, que talvez não tenhamos explicitamente
-        # Mas podemos usar a data_criacao ou data_abertura como proxy se não houver melhor campo
-        # O ideal seria ter um campo 'data_inicio_vigencia' na oportunidade.
-        # Por enquanto, vamos exibir o que temos.
-
-
-        summary_aditivo_frame.columnconfigure(1, weight=1)
-        summary_aditivo_frame.columnconfigure(3, weight=1)
-
-        ttk.Label(summary_aditivo_frame, text="Valor Inicial:", style='Metric.White.TLabel').grid(row=0, column=0, sticky='w')
-        ttk.Label(summary_aditivo_frame, text=format_currency(original_value), style='Value.White.TLabel').grid(row=0, column=1, sticky='w')
-
-        ttk.Label(summary_aditivo_frame, text="Total em Aditivos:", style='Metric.White.TLabel').grid(row=0, column=2, sticky='w')
-        ttk.Label(summary_aditivo_frame, text=format_currency(total_aditivos), style='Value.White.TLabel', foreground=DOLP_COLORS['primary_blue']).grid(row=0, column=3, sticky='w')
-
-        ttk.Label(summary_aditivo_frame, text="Valor Global Atual:", style='Metric.White.TLabel').grid(row=1, column=0, sticky='w', pady=(10,0))
-        ttk.Label(summary_aditivo_frame, text=format_currency(current_global), style='Value.White.TLabel', font=('Segoe UI', 12, 'bold')).grid(row=1, column=1, sticky='w', pady=(10,0))
-
-        # Botão Novo Termo
-        ttk.Button(summary_aditivo_frame, text="Novo Termo Aditivo", style='Success.TButton',
-                   command=lambda: self.show_termo_aditivo_form(op_id, parent_win=details_win)).grid(row=1, column=3, sticky='e', pady=(10,0))
-
-        # Tabela de Histórico
-        history_aditivo_frame = ttk.LabelFrame(aditivos_tab, text="Histórico de Termos", padding=15, style='White.TLabelframe')
-        history_aditivo_frame.pack(fill='both', expand=True, pady=10)
-
-        cols_aditivo = ('numero', 'data', 'tipo', 'mensal', 'prazo', 'global')
-        tree_aditivo = ttk.Treeview(history_aditivo_frame, columns=cols_aditivo, show='headings', height=8)
-
-        tree_aditivo.heading('numero', text='Nº Termo')
-        tree_aditivo.heading('data', text='Data Assinatura')
-        tree_aditivo.heading('tipo', text='Tipo')
-        tree_aditivo.heading('mensal', text='Adic. Mensal')
-        tree_aditivo.heading('prazo', text='Prazo (+)')
-        tree_aditivo.heading('global', text='Valor Global Aditivo')
-
-        tree_aditivo.column('numero', width=100)
-        tree_aditivo.column('data', width=100)
-        tree_aditivo.column('tipo', width=150)
-        tree_aditivo.column('mensal', width=120)
-        tree_aditivo.column('prazo', width=80)
-        tree_aditivo.column('global', width=120)
-
-        aditivo_scrollbar = ttk.Scrollbar(history_aditivo_frame, orient="vertical", command=tree_aditivo.yview)
-        tree_aditivo.configure(yscrollcommand=aditivo_scrollbar.set)
-
-        tree_aditivo.pack(side='left', fill='both', expand=True)
-        aditivo_scrollbar.pack(side='right', fill='y')
-
-        if aditivos:
-            for aditivo in aditivos:
-                tree_aditivo.insert('', 'end', tags=(str(aditivo['id']),), values=(
-                    aditivo['numero_termo'],
-                    aditivo['data_assinatura'],
-                    aditivo['tipo_alteracao'],
-                    format_currency(aditivo['valor_adicionado_mensal']),
-                    f"{aditivo['prazo_adicionado_meses']} meses",
-                    format_currency(aditivo['valor_global_aditivo'])
-                ))
+        def _build_aditivos(aditivos_tab):
+            # === CONTEÚDO DA ABA DE TERMOS ADITIVOS ===
+            # Resumo
+            summary_aditivo_frame = ttk.LabelFrame(aditivos_tab, text="Resumo Financeiro e Contratual", padding=15, style='White.TLabelframe')
+            summary_aditivo_frame.pack(fill='x', pady=(0, 10))
+
+            # Cálculos
+            original_value = op_data['valor'] if 'valor' in op_keys else 0
+            aditivos = snapshot.aditivos
+            total_aditivos = sum(a['valor_global_aditivo'] for a in aditivos)
+            current_global = original_value + total_aditivos
+
+            # Data Fim Original (estimada baseada na duração)
+            data_fim_original = "---"
+            data_fim_atual = "---"
+
+            # Tentativa de calcular data fim original
+            # Isso depende de termos data_assinatura ou data_inicio_contrato na oportunidade, que talvez não tenhamos explicitamente
+            # Mas podemos usar a data_criacao ou data_abertura como proxy se não houver melhor campo
+            # O ideal seria ter um campo 'data_inicio_vigencia' na oportunidade.
+            # Por enquanto, vamos exibir o que temos.
+
+
+            summary_aditivo_frame.columnconfigure(1, weight=1)
+            summary_aditivo_frame.columnconfigure(3, weight=1)
+
+            ttk.Label(summary_aditivo_frame, text="Valor Inicial:", style='Metric.White.TLabel').grid(row=0, column=0, sticky='w')
+            ttk.Label(summary_aditivo_frame, text=format_currency(original_value), style='Value.White.TLabel').grid(row=0, column=1, sticky='w')
+
+            ttk.Label(summary_aditivo_frame, text="Total em Aditivos:", style='Metric.White.TLabel').grid(row=0, column=2, sticky='w')
+            ttk.Label(summary_aditivo_frame, text=format_currency(total_aditivos), style='Value.White.TLabel', foreground=DOLP_COLORS['primary_blue']).grid(row=0, column=3, sticky='w')
+
+            ttk.Label(summary_aditivo_frame, text="Valor Global Atual:", style='Metric.White.TLabel').grid(row=1, column=0, sticky='w', pady=(10,0))
+            ttk.Label(summary_aditivo_frame, text=format_currency(current_global), style='Value.White.TLabel', font=('Segoe UI', 12, 'bold')).grid(row=1, column=1, sticky='w', pady=(10,0))
+
+            # Botão Novo Termo
+            ttk.Button(summary_aditivo_frame, text="Novo Termo Aditivo", style='Success.TButton',
+                       command=lambda: self.show_termo_aditivo_form(op_id, parent_win=details_win)).grid(row=1, column=3, sticky='e', pady=(10,0))
+
+            # Tabela de Histórico
+            history_aditivo_frame = ttk.LabelFrame(aditivos_tab, text="Histórico de Termos", padding=15, style='White.TLabelframe')
+            history_aditivo_frame.pack(fill='both', expand=True, pady=10)
+
+            cols_aditivo = ('numero', 'data', 'tipo', 'mensal', 'prazo', 'global')
+            tree_aditivo = ttk.Treeview(history_aditivo_frame, columns=cols_aditivo, show='headings', height=8)
+
+            tree_aditivo.heading('numero', text='Nº Termo')
+            tree_aditivo.heading('data', text='Data Assinatura')
+            tree_aditivo.heading('tipo', text='Tipo')
+            tree_aditivo.heading('mensal', text='Adic. Mensal')
+            tree_aditivo.heading('prazo', text='Prazo (+)')
+            tree_aditivo.heading('global', text='Valor Global Aditivo')
+
+            tree_aditivo.column('numero', width=100)
+            tree_aditivo.column('data', width=100)
+            tree_aditivo.column('tipo', width=150)
+            tree_aditivo.column('mensal', width=120)
+            tree_aditivo.column('prazo', width=80)
+            tree_aditivo.column('global', width=120)
+
+            aditivo_scrollbar = ttk.Scrollbar(history_aditivo_frame, orient="vertical", command=tree_aditivo.yview)
+            tree_aditivo.configure(yscrollcommand=aditivo_scrollbar.set)
+
+            tree_aditivo.pack(side='left', fill='both', expand=True)
+            aditivo_scrollbar.pack(side='right', fill='y')
+
+            if aditivos:
+                for aditivo in aditivos:
+                    tree_aditivo.insert('', 'end', tags=(str(aditivo['id']),), values=(
+                        aditivo['numero_termo'],
+                        aditivo['data_assinatura'],
+                        aditivo['tipo_alteracao'],
+                        format_currency(aditivo['valor_adicionado_mensal']),
+                        f"{aditivo['prazo_adicionado_meses']} meses",
+                        format_currency(aditivo['valor_global_aditivo'])
+                    ))
+
+            def on_aditivo_right_click(event):
+                selection = tree_aditivo.selection()
+                if selection:
+                    # Get ID from tags
+                    item_id = selection[0]
+                    aditivo_id = tree_aditivo.item(item_id, 'tags')[0]
+
+                    menu = tk.Menu(self.root, tearoff=0)
+                    menu.add_command(label="Editar", command=lambda: self.show_termo_aditivo_form(op_id, aditivo_id, parent_win=details_win))
+                    menu.add_command(label="Exportar PDF (Sumário Executivo)", command=lambda: self.export_termo_aditivo_pdf(aditivo_id))
+                    menu.add_separator()
+                    menu.add_command(label="Excluir", command=lambda: self.delete_termo_aditivo_confirm(aditivo_id, op_id, details_win))
+                    menu.tk_popup(event.x_root, event.y_root)
+
+            tree_aditivo.bind("<Button-3>", on_aditivo_right_click)
+
+            # Double click to edit
+            def on_aditivo_double_click(event):
+                selection = tree_aditivo.selection()
+                if selection:
+                    item_id = selection[0]
+                    aditivo_id = tree_aditivo.item(item_id, 'tags')[0]
+                    self.show_termo_aditivo_form(op_id, aditivo_id, parent_win=details_win)
+
+            tree_aditivo.bind("<Double-1>", on_aditivo_double_click)
 
-        def on_aditivo_right_click(event):
-            selection = tree_aditivo.selection()
-            if selection:
-                # Get ID from tags
-                item_id = selection[0]
-                aditivo_id = tree_aditivo.item(item_id, 'tags')[0]
-
-                menu = tk.Menu(self.root, tearoff=0)
-                menu.add_command(label="Editar", command=lambda: self.show_termo_aditivo_form(op_id, aditivo_id, parent_win=details_win))
-                menu.add_command(label="Exportar PDF (Sumário Executivo)", command=lambda: self.export_termo_aditivo_pdf(aditivo_id))
-                menu.add_separator()
-                menu.add_command(label="Excluir", command=lambda: self.delete_termo_aditivo_confirm(aditivo_id, op_id, details_win))
-                menu.tk_popup(event.x_root, event.y_root)
-
-        tree_aditivo.bind("<Button-3>", on_aditivo_right_click)
-
-        # Double click to edit
-        def on_aditivo_double_click(event):
-            selection = tree_aditivo.selection()
-            if selection:
-                item_id = selection[0]
-                aditivo_id = tree_aditivo.item(item_id, 'tags')[0]
-                self.show_termo_aditivo_form(op_id, aditivo_id, parent_win=details_win)
+        # Aba 6: Tarefas
+        def _build_tarefas(tarefas_tab):
+            try:
+                # --- Filtros para Tarefas ---
+                filters_tasks_frame = ttk.LabelFrame(tarefas_tab, text="Filtros", padding=15, style='White.TLabelframe')
+                filters_tasks_frame.pack(fill='x', pady=(0, 10))
+                filters_tasks_frame.columnconfigure(7, weight=1) # Coluna do botão de nova tarefa
+
+                # Status
+                ttk.Label(filters_tasks_frame, text="Status:", style='TLabel').grid(row=0, column=0, sticky='w', padx=(0, 5))
+                status_task_filter = ttk.Combobox(filters_tasks_frame, values=['Todos', 'Pendente', 'Concluída'], state='readonly')
+                status_task_filter.set('Todos')
+                status_task_filter.grid(row=0, column=1, padx=(0, 20))
+
+                # Responsável
+                ttk.Label(filters_tasks_frame, text="Responsável:", style='TLabel').grid(row=0, column=2, sticky='w', padx=(0, 5))
+                responsibles = ['Todos'] + list(snapshot.task_responsibles)
+                responsavel_filter = ttk.Combobox(filters_tasks_frame, values=responsibles, state='readonly')
+                responsavel_filter.set('Todos')
+                responsavel_filter.grid(row=0, column=3, padx=(0, 20))
+            except Exception as e:
+                ttk.Label(tarefas_tab, text=f"Erro ao carregar aba: {e}", foreground='red').pack(pady=20)
+
+            # Data Vencimento Início
+            ttk.Label(filters_tasks_frame, text="Vencimento de:", style='TLabel').grid(row=0, column=4, sticky='w', padx=(0, 5))
+            start_date_task_filter = DateEntry(filters_tasks_frame, date_pattern='dd/mm/yyyy', width=12)
+            start_date_task_filter.delete(0, 'end')
+            start_date_task_filter.grid(row=0, column=5, padx=(0, 20))
+
+            # Data Vencimento Fim
+            ttk.Label(filters_tasks_frame, text="Até:", style='TLabel').grid(row=0, column=6, sticky='w', padx=(0, 5))
+            end_date_task_filter = DateEntry(filters_tasks_frame, date_pattern='dd/mm/yyyy', width=12)
+            end_date_task_filter.delete(0, 'end')
+            end_date_task_filter.grid(row=0, column=7, padx=(0, 20))
+
+            # Categoria
+            ttk.Label(filters_tasks_frame, text="Categoria:", style='TLabel').grid(row=1, column=0, sticky='w', padx=(0, 5), pady=(10,0))
+            task_categories = snapshot.task_categories
+            category_map = {cat['name']: cat['id'] for cat in task_categories}
+            category_names = ['Todas'] + list(category_map.keys())
+            category_task_filter = ttk.Combobox(filters_tasks_frame, values=category_names, state='readonly')
+            category_task_filter.set('Todas')
+            category_task_filter.grid(row=1, column=1, pady=(10,0))
+
+            # Criticidade (Filtro Novo)
+            ttk.Label(filters_tasks_frame, text="Criticidade:", style='TLabel').grid(row=1, column=2, sticky='w', padx=(0, 5), pady=(10,0))
+            criticidade_task_filter = ttk.Combobox(filters_tasks_frame, values=['Todos', 'Alta', 'Média', 'Baixa'], state='readonly')
+            criticidade_task_filter.set('Todos')
+            criticidade_task_filter.grid(row=1, column=3, padx=(0, 20), pady=(10,0))
+
+            # Container para os resultados das tarefas
+            tasks_results_frame = ttk.Frame(tarefas_tab, style='TFrame')
+            tasks_results_frame.pack(fill='both', expand=True, pady=(10,0))
+
+            def _refilter_tasks(use_snapshot=False):
+                for widget in tasks_results_frame.winfo_children():
+                    widget.destroy()
 
-        tree_aditivo.bind("<Double-1>", on_aditivo_double_click)
+                status = status_task_filter.get()
+                responsavel = responsavel_filter.get()
+                start_date = start_date_task_filter.get()
+                end_date = end_date_task_filter.get()
+                category_name = category_task_filter.get()
+                criticidade = criticidade_task_filter.get()
+                category_id = None
+                if category_name != 'Todas':
+                    category_id = category_map.get(category_name)
 
 
-        # Aba 6: Tarefas
-        tarefas_tab = self._create_scrollable_tab(notebook, '  Tarefas  ')
+                if use_snapshot:
+                    tarefas = snapshot.tarefas
+                else:
+                    tarefas = self.db.get_tasks_for_opportunity(op_id, status, responsavel, start_date, end_date, category_id, criticidade)
+                all_categories = {cat['id']: cat['name'] for cat in task_categories}
 
-        try:
-            # --- Filtros para Tarefas ---
-            filters_tasks_frame = ttk.LabelFrame(tarefas_tab, text="Filtros", padding=15, style='White.TLabelframe')
-            filters_tasks_frame.pack(fill='x', pady=(0, 10))
-            filters_tasks_frame.columnconfigure(7, weight=1) # Coluna do botão de nova tarefa
-
-            # Status
-            ttk.Label(filters_tasks_frame, text="Status:", style='TLabel').grid(row=0, column=0, sticky='w', padx=(0, 5))
-            status_task_filter = ttk.Combobox(filters_tasks_frame, values=['Todos', 'Pendente', 'Concluída'], state='readonly')
-            status_task_filter.set('Todos')
-            status_task_filter.grid(row=0, column=1, padx=(0, 20))
-
-            # Responsável
-            ttk.Label(filters_tasks_frame, text="Responsável:", style='TLabel').grid(row=0, column=2, sticky='w', padx=(0, 5))
-            responsibles = ['Todos'] + self.db.get_task_responsibles(op_id)
-            responsavel_filter = ttk.Combobox(filters_tasks_frame, values=responsibles, state='readonly')
-            responsavel_filter.set('Todos')
-            responsavel_filter.grid(row=0, column=3, padx=(0, 20))
-        except Exception as e:
-            ttk.Label(tarefas_tab, text=f"Erro ao carregar aba: {e}", foreground='red').pack(pady=20)
-
-        # Data Vencimento Início
-        ttk.Label(filters_tasks_frame, text="Vencimento de:", style='TLabel').grid(row=0, column=4, sticky='w', padx=(0, 5))
-        start_date_task_filter = DateEntry(filters_tasks_frame, date_pattern='dd/mm/yyyy', width=12)
-        start_date_task_filter.delete(0, 'end')
-        start_date_task_filter.grid(row=0, column=5, padx=(0, 20))
-
-        # Data Vencimento Fim
-        ttk.Label(filters_tasks_frame, text="Até:", style='TLabel').grid(row=0, column=6, sticky='w', padx=(0, 5))
-        end_date_task_filter = DateEntry(filters_tasks_frame, date_pattern='dd/mm/yyyy', width=12)
-        end_date_task_filter.delete(0, 'end')
-        end_date_task_filter.grid(row=0, column=7, padx=(0, 20))
-
-        # Categoria
-        ttk.Label(filters_tasks_frame, text="Categoria:", style='TLabel').grid(row=1, column=0, sticky='w', padx=(0, 5), pady=(10,0))
-        task_categories = self.db.get_all_task_categories()
-        category_map = {cat['name']: cat['id'] for cat in task_categories}
-        category_names = ['Todas'] + list(category_map.keys())
-        category_task_filter = ttk.Combobox(filters_tasks_frame, values=category_names, state='readonly')
-        category_task_filter.set('Todas')
-        category_task_filter.grid(row=1, column=1, pady=(10,0))
-
-        # Criticidade (Filtro Novo)
-        ttk.Label(filters_tasks_frame, text="Criticidade:", style='TLabel').grid(row=1, column=2, sticky='w', padx=(0, 5), pady=(10,0))
-        criticidade_task_filter = ttk.Combobox(filters_tasks_frame, values=['Todos', 'Alta', 'Média', 'Baixa'], state='readonly')
-        criticidade_task_filter.set('Todos')
-        criticidade_task_filter.grid(row=1, column=3, padx=(0, 20), pady=(10,0))
-
-        # Container para os resultados das tarefas
-        tasks_results_frame = ttk.Frame(tarefas_tab, style='TFrame')
-        tasks_results_frame.pack(fill='both', expand=True, pady=(10,0))
-
-        def _refilter_tasks():
-            for widget in tasks_results_frame.winfo_children():
-                widget.destroy()
 
-            status = status_task_filter.get()
-            responsavel = responsavel_filter.get()
-            start_date = start_date_task_filter.get()
-            end_date = end_date_task_filter.get()
-            category_name = category_task_filter.get()
-            criticidade = criticidade_task_filter.get()
-            category_id = None
-            if category_name != 'Todas':
-                category_id = category_map.get(category_name)
+                if tarefas:
+                    for tarefa in tarefas:
+                        task_frame = ttk.LabelFrame(tasks_results_frame, text=f"Tarefa - {tarefa['status']}", padding=10, style='White.TLabelframe')
+                        task_frame.pack(fill='x', pady=5)
 
+                        # Top frame for description and buttons
+                        top_task_frame = ttk.Frame(task_frame)
+                        top_task_frame.pack(fill='x')
 
-            tarefas = self.db.get_tasks_for_opportunity(op_id, status, responsavel, start_date, end_date, category_id, criticidade)
-            all_categories = {cat['id']: cat['name'] for cat in self.db.get_all_task_categories()}
+                        ttk.Label(top_task_frame, text=tarefa['descricao'], style='Value.White.TLabel', wraplength=650, justify='left').pack(side='left', fill='x', expand=True)
 
+                        button_container = ttk.Frame(top_task_frame)
+                        button_container.pack(side='right')
 
-            if tarefas:
-                for tarefa in tarefas:
-                    task_frame = ttk.LabelFrame(tasks_results_frame, text=f"Tarefa - {tarefa['status']}", padding=10, style='White.TLabelframe')
-                    task_frame.pack(fill='x', pady=5)
+                        edit_btn = ttk.Button(button_container, text="Editar", style='Primary.TButton', width=8,
+                                            command=lambda t=tarefa: self.edit_task_dialog(t, details_win))
+                        edit_btn.pack(side='left', padx=(0,5))
 
-                    # Top frame for description and buttons
-                    top_task_frame = ttk.Frame(task_frame)
-                    top_task_frame.pack(fill='x')
+                        delete_btn = ttk.Button(button_container, text="Excluir", style='Danger.TButton', width=8,
+                                              command=lambda t_id=tarefa['id'], op_id=op_id: self.delete_task_confirm(t_id, op_id, details_win))
+                        delete_btn.pack(side='left')
 
-                    ttk.Label(top_task_frame, text=tarefa['descricao'], style='Value.White.TLabel', wraplength=650, justify='left').pack(side='left', fill='x', expand=True)
 
-                    button_container = ttk.Frame(top_task_frame)
-                    button_container.pack(side='right')
+                        # Bottom frame for info
+                        info_frame = ttk.Frame(task_frame)
+                        info_frame.pack(fill='x', pady=(5, 0))
 
-                    edit_btn = ttk.Button(button_container, text="Editar", style='Primary.TButton', width=8,
-                                        command=lambda t=tarefa: self.edit_task_dialog(t, details_win))
-                    edit_btn.pack(side='left', padx=(0,5))
+                        category_name = all_categories.get(tarefa['category_id'], 'Sem Categoria')
+                        criticidade_val = tarefa['criticidade'] if 'criticidade' in tarefa.keys() and tarefa['criticidade'] else 'Média'
 
-                    delete_btn = ttk.Button(button_container, text="Excluir", style='Danger.TButton', width=8,
-                                          command=lambda t_id=tarefa['id'], op_id=op_id: self.delete_task_confirm(t_id, op_id, details_win))
-                    delete_btn.pack(side='left')
+                        ttk.Label(info_frame, text=f"Categoria: {category_name}", style='Metric.White.TLabel').pack(side='left')
+                        ttk.Label(info_frame, text=f"Criticidade: {criticidade_val}", style='Metric.White.TLabel').pack(side='left', padx=20)
+                        ttk.Label(info_frame, text=f"Responsável: {tarefa['responsavel']}", style='Metric.White.TLabel').pack(side='left', padx=20)
+                        ttk.Label(info_frame, text=f"Vencimento: {tarefa['data_vencimento']}", style='Metric.White.TLabel').pack(side='right')
 
+                        if tarefa['status'] != 'Concluída':
+                            ttk.Button(task_frame, text="Marcar como Concluída",
+                                     command=lambda t_id=tarefa['id']: self.complete_task(t_id, op_id, details_win),
+                                     style='Success.TButton').pack(anchor='e', pady=(5, 0))
+                else:
+                    ttk.Label(tasks_results_frame, text="Nenhuma tarefa encontrada para os filtros selecionados.", style='Value.White.TLabel').pack(pady=20)
 
-                    # Bottom frame for info
-                    info_frame = ttk.Frame(task_frame)
-                    info_frame.pack(fill='x', pady=(5, 0))
+            ttk.Button(filters_tasks_frame, text="🔍 Filtrar", command=_refilter_tasks, style='Primary.TButton').grid(row=1, column=4, padx=(20, 0), pady=(10,0))
+            ttk.Button(filters_tasks_frame, text="Nova Tarefa", command=lambda: self.add_task_dialog(op_id, details_win), style='Success.TButton').grid(row=1, column=5, padx=(10,0), pady=(10,0))
 
-                    category_name = all_categories.get(tarefa['category_id'], 'Sem Categoria')
-                    criticidade_val = tarefa['criticidade'] if 'criticidade' in tarefa.keys() and tarefa['criticidade'] else 'Média'
+            # Carregar tarefas iniciais
+            _refilter_tasks(use_snapshot=True)
 
-                    ttk.Label(info_frame, text=f"Categoria: {category_name}", style='Metric.White.TLabel').pack(side='left')
-                    ttk.Label(info_frame, text=f"Criticidade: {criticidade_val}", style='Metric.White.TLabel').pack(side='left', padx=20)
-                    ttk.Label(info_frame, text=f"Responsável: {tarefa['responsavel']}", style='Metric.White.TLabel').pack(side='left', padx=20)
-                    ttk.Label(info_frame, text=f"Vencimento: {tarefa['data_vencimento']}", style='Metric.White.TLabel').pack(side='right')
+        def _register_tab(tab_text, builder):
+            tab = self._create_scrollable_tab(notebook, tab_text)
+            tab_builders[notebook.tabs()[-1]] = (tab, builder)
 
-                    if tarefa['status'] != 'Concluída':
-                        ttk.Button(task_frame, text="Marcar como Concluída",
-                                 command=lambda t_id=tarefa['id']: self.complete_task(t_id, op_id, details_win),
-                                 style='Success.TButton').pack(anchor='e', pady=(5, 0))
-            else:
-                ttk.Label(tasks_results_frame, text="Nenhuma tarefa encontrada para os filtros selecionados.", style='Value.White.TLabel').pack(pady=20)
+        _register_tab('  Análise Prévia de Viabilidade  ', _build_analise)
+        _register_tab('  Sumário Executivo  ', _build_sumario)
+        _register_tab('  Histórico de Interações  ', _build_interacoes)
+        _register_tab('  Eventos  ', _build_eventos)
+        _register_tab('  Termos Aditivos  ', _build_aditivos)
+        _register_tab('  Tarefas  ', _build_tarefas)
 
-        ttk.Button(filters_tasks_frame, text="🔍 Filtrar", command=_refilter_tasks, style='Primary.TButton').grid(row=1, column=4, padx=(20, 0), pady=(10,0))
-        ttk.Button(filters_tasks_frame, text="Nova Tarefa", command=lambda: self.add_task_dialog(op_id, details_win), style='Success.TButton').grid(row=1, column=5, padx=(10,0), pady=(10,0))
+        def _on_tab_changed(event=None):
+            selected = notebook.select()
+            if selected in built_tabs or selected not in tab_builders:
+                return
+            built_tabs.add(selected)
+            tab, builder = tab_builders[selected]
+            builder(tab)
 
-        # Carregar tarefas iniciais
-        _refilter_tasks()
+        notebook.bind('<<NotebookTabChanged>>', _on_tab_changed)
+        _on_tab_changed()
 
-    def export_analise_previa_pdf(self, op_id):
-        op_data = self.db.get_opportunity_details(op_id)
+    def export_analise_previa_pdf(self, op_id, snapshot=None):
+        snapshot = snapshot or OpportunityAggregate(self.db).load(op_id)
+        op_data = snapshot.opportunity if snapshot else None
         if not op_data:
             messagebox.showerror("Erro", "Oportunidade não encontrada!")
             return
@@ -4593,203 +8514,10 @@ class CRMApp:
         if not file_path:
             return
 
-        try:
-            doc = SimpleDocTemplate(file_path, pagesize=A4,
-                                    rightMargin=72, leftMargin=72,
-                                    topMargin=90, bottomMargin=72)
-            story = []
-            styles = getSampleStyleSheet()
-            styles.add(ParagraphStyle(name='Justify', alignment=4))
-
-            story.append(Paragraph("Análise Prévia de Viabilidade", styles['h1']))
-            story.append(Spacer(1, 12))
-            story.append(Paragraph(f"Oportunidade: {op_data['titulo']}", styles['h2']))
-            story.append(Spacer(1, 24))
-
-            story.append(Paragraph("1. Informações Básicas", styles['h3']))
-            story.append(Spacer(1, 12))
-
-            basic_info_data = [
-                ['Cliente:', op_data['nome_empresa']],
-                ['Estágio:', op_data['estagio_nome']],
-                ['Valor Estimado:', format_currency(op_data['valor'])],
-                ['Tempo de Contrato:', f"{op_data['tempo_contrato_meses']} meses" if 'tempo_contrato_meses' in op_keys and op_data['tempo_contrato_meses'] else "---"],
-                ['Regional:', op_data['regional'] if 'regional' in op_keys and op_data['regional'] else "---"],
-                ['Polo:', op_data['polo'] if 'polo' in op_keys and op_data['polo'] else "---"],
-                # ['Empresa Referência:', op_data['empresa_referencia'] if 'empresa_referencia' in op_keys and op_data['empresa_referencia'] else "---"], # Removed
-            ]
-
-            basic_info_table = Table(basic_info_data, colWidths=[1.5*inch, 4.5*inch])
-            basic_info_table.setStyle(TableStyle([
-                ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-                ('FONTNAME', (0,0), (0,-1), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-            ]))
-            story.append(basic_info_table)
-            story.append(Spacer(1, 24))
-
-            story.append(Paragraph("2. Formulário de Análise de Qualificação", styles['h3']))
-            story.append(Spacer(1, 12))
-
-            qualificacao_data_json = op_data['qualificacao_data'] if 'qualificacao_data' in op_keys else None
-            if qualificacao_data_json:
-                try:
-                    qualificacao_answers = json.loads(qualificacao_data_json)
-                    for section, questions in QUALIFICATION_CHECKLIST.items():
-                        story.append(Paragraph(f"<b>{section}</b>", styles['h4']))
-                        story.append(Spacer(1, 6))
-
-                        if section == "Análise Concorrencial e de Riscos":
-                            # Use a different layout for this specific section
-                            for question in questions:
-                                story.append(Paragraph(f"<b>{question}</b>", styles['BodyText']))
-                                story.append(Spacer(1, 4))
-                                if question == "Quais são nossos diferenciais competitivos claros para esta oportunidade específica?":
-                                    answer = op_data['diferenciais_competitivos'] if 'diferenciais_competitivos' in op_keys and op_data['diferenciais_competitivos'] else "---"
-                                elif question == "Quais os principais riscos (técnicos, logísticos, regulatórios, políticos) associados ao projeto?":
-                                    answer = op_data['principais_riscos'] if 'principais_riscos' in op_keys and op_data['principais_riscos'] else "---"
-                                else:
-                                    answer = "Não aplicável" # Should not happen for this section
-
-                                story.append(Paragraph(answer.replace('\n', '<br/>'), styles['Justify']))
-                                story.append(Spacer(1, 12))
-                        else:
-                            # Keep the original table layout for other sections
-                            question_data = []
-                            for question in questions:
-                                answer = qualificacao_answers.get(question, "Não respondido")
-                                question_data.append([Paragraph(question, styles['BodyText']), answer])
-
-                            question_table = Table(question_data, colWidths=[5*inch, 1*inch])
-                            question_table.setStyle(TableStyle([
-                                ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-                                ('VALIGN', (0,0), (-1,-1), 'TOP'),
-                                ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-                                ('LEFTPADDING', (0,0), (-1,-1), 6),
-                                ('RIGHTPADDING', (0,0), (-1,-1), 6),
-                                ('TOPPADDING', (0,0), (-1,-1), 6),
-                                ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-                            ]))
-                            story.append(question_table)
-                            story.append(Spacer(1, 12))
-
-                except (json.JSONDecodeError, TypeError):
-                    story.append(Paragraph("Erro ao carregar dados de qualificação.", styles['BodyText']))
-            else:
-                story.append(Paragraph("Dados de qualificação não preenchidos.", styles['BodyText']))
-            story.append(Spacer(1, 24))
-
-            story.append(Paragraph("3. Bases Alocadas", styles['h3']))
-            story.append(Spacer(1, 12))
-            bases_nomes_json = op_data['bases_nomes'] if 'bases_nomes' in op_keys else None
-            if bases_nomes_json:
-                try:
-                    bases_nomes = json.loads(bases_nomes_json)
-                    if bases_nomes:
-                        for base in bases_nomes:
-                            story.append(Paragraph(f"- {base}", styles['BodyText']))
-                    else:
-                        story.append(Paragraph("Nenhuma base alocada.", styles['BodyText']))
-                except (json.JSONDecodeError, TypeError):
-                    story.append(Paragraph("Erro ao carregar nomes de bases.", styles['BodyText']))
-            else:
-                story.append(Paragraph("Nenhuma base alocada.", styles['BodyText']))
-            story.append(Spacer(1, 24))
-
-            story.append(Paragraph("4. Serviços e Equipes", styles['h3']))
-            story.append(Spacer(1, 12))
-            servicos_data_json = op_data['servicos_data'] if 'servicos_data' in op_keys else None
-            if servicos_data_json:
-                try:
-                    servicos_data = json.loads(servicos_data_json)
-                    if servicos_data:
-                        for servico_info in servicos_data:
-                            story.append(Paragraph(f"<b>Serviço: {servico_info.get('servico_nome', 'N/A')}</b>", styles['h4']))
-                            equipes = servico_info.get('equipes', [])
-                            if equipes:
-                                # Headers
-                                equipe_data = [['Tipo de Equipe', 'Qtd', 'Vol.', 'Base', 'Empresa Ref.', 'Valor Total', 'Valor US/UPS']]
-                                # Widths - Adjusted to fit A4 width (~8.27 inch, margins are 72pt=1inch each side -> ~6.27 usable)
-                                # Reduced widths to fit more columns
-                                col_widths = [1.4*inch, 0.4*inch, 0.5*inch, 0.7*inch, 1.6*inch, 0.9*inch, 0.9*inch]
-
-                                for equipe in equipes:
-                                    # Calculate values
-                                    try:
-                                        qtd = float(str(equipe.get('quantidade', '0')).replace(',', '.'))
-                                    except: qtd = 0.0
-                                    try:
-                                        vol = float(str(equipe.get('volumetria', '0')).replace(',', '.'))
-                                    except: vol = 0.0
-
-                                    ref_str = equipe.get('empresa_referencia', '')
-                                    unit_price = self.db.get_empresa_referencia_price_by_string(ref_str)
-
-                                    total_val = unit_price * qtd
-                                    us_val = (total_val / vol) if vol > 0 else 0.0
-
-                                    equipe_data.append([
-                                        Paragraph(equipe.get('tipo_equipe', 'N/A'), styles['BodyText']),
-                                        equipe.get('quantidade', 'N/A'),
-                                        equipe.get('volumetria', 'N/A'),
-                                        equipe.get('base', 'N/A'),
-                                        Paragraph(ref_str, styles['BodyText']),
-                                        Paragraph(format_currency(total_val), styles['BodyText']),
-                                        Paragraph(format_currency(us_val), styles['BodyText'])
-                                    ])
-                                equipe_table = Table(equipe_data, colWidths=col_widths)
-                                equipe_table.setStyle(TableStyle([
-                                    ('BACKGROUND', (0,0), (-1,0), colors.grey),
-                                    ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                                    ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                                    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                                    ('BOTTOMPADDING', (0,0), (-1,0), 12),
-                                    ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-                                    ('GRID', (0,0), (-1,-1), 1, colors.black)
-                                ]))
-                                story.append(equipe_table)
-                                story.append(Spacer(1, 12))
-                            else:
-                                story.append(Paragraph("Nenhuma equipe configurada para este serviço.", styles['BodyText']))
-                    else:
-                        story.append(Paragraph("Nenhum serviço configurado.", styles['BodyText']))
-                except (json.JSONDecodeError, TypeError):
-                    story.append(Paragraph("Erro ao carregar dados de serviços.", styles['BodyText']))
-            else:
-                story.append(Paragraph("Nenhum serviço configurado.", styles['BodyText']))
-
-            def header_footer(canvas, doc):
-                canvas.saveState()
-                if os.path.exists(LOGO_PATH):
-                    try:
-                        logo = ImageReader(LOGO_PATH)
-                        img_width, img_height = logo.getSize()
-                        aspect = img_height / float(img_width)
-                        display_width = 1.5 * inch
-                        display_height = display_width * aspect
-                        canvas.drawImage(logo, doc.leftMargin, A4[1] - 1.0 * inch, width=display_width, height=display_height, mask='auto')
-                    except Exception as e:
-                        print(f"Erro ao desenhar logo no PDF: {e}")
-
-                now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-                canvas.setFont('Helvetica', 9)
-                canvas.drawRightString(A4[0] - doc.rightMargin, A4[1] - 0.75 * inch, f"Gerado em: {now}")
-
-                canvas.setFont('Helvetica', 10)
-                canvas.drawString(doc.leftMargin, 0.75 * inch, "_________________________________________")
-                canvas.drawString(doc.leftMargin, 0.5 * inch, "Assinatura da Diretoria")
-                canvas.restoreState()
-
-            doc.build(story, onFirstPage=header_footer, onLaterPages=header_footer)
-            messagebox.showinfo("Sucesso", f"PDF 'Análise Prévia de Viabilidade' gerado com sucesso em:\n{file_path}", parent=self.root)
-
-        except Exception as e:
-            messagebox.showerror("Erro ao Gerar PDF", f"Ocorreu um erro: {e}", parent=self.root)
-
+        self._submit_report(lambda: build_analise_previa_spec(snapshot, file_path))
 
-
-    def export_interactions_pdf(self, op_id, interactions_list):
-        op_data = self.db.get_opportunity_details(op_id)
+    def export_interactions_pdf(self, op_id, interactions, snapshot=None):
+        op_data = snapshot.opportunity if snapshot else self.db.get_opportunity_details(op_id)
         if not op_data:
             messagebox.showerror("Erro", "Oportunidade não encontrada!")
             return
@@ -4805,84 +8533,50 @@ class CRMApp:
         if not file_path:
             return
 
-        try:
-            doc = SimpleDocTemplate(file_path, pagesize=A4,
-                                    rightMargin=72, leftMargin=72,
-                                    topMargin=90, bottomMargin=72)
-            story = []
-            styles = getSampleStyleSheet()
-
-            # Title
-            story.append(Paragraph("Histórico de Interações", styles['h1']))
-            story.append(Spacer(1, 12))
-            story.append(Paragraph(f"Oportunidade: {op_data['titulo']}", styles['h2']))
-            story.append(Paragraph(f"Cliente: {op_data['nome_empresa']}", styles['h3']))
-            story.append(Spacer(1, 24))
-
-            # Table Header
-            data = [['Data', 'Tipo', 'Usuário', 'Resumo']]
-
-            # Table Data
-            for interaction in interactions_list:
-                # Format summary for cell (handle long text)
-                summary = Paragraph(interaction['resumo'].replace('\n', '<br/>'), styles['BodyText'])
-
-                row = [
-                    interaction['data_interacao'],
-                    interaction['tipo'],
-                    interaction['usuario'],
-                    summary
-                ]
-                data.append(row)
-
-            # Create Table
-            # Adjust column widths: Data, Tipo, Usuario are smaller, Resumo gets rest
-            # A4 width is ~595 pts. Margins 72*2 = 144. Usable = 451.
-            col_widths = [1.2*inch, 1.0*inch, 1.0*inch, 3.0*inch]
-
-            t = Table(data, colWidths=col_widths, repeatRows=1)
-            t.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.grey),
-                ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0,0), (-1,0), 12),
-                ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-                ('GRID', (0,0), (-1,-1), 1, colors.black),
-                ('VALIGN', (0,0), (-1,-1), 'TOP'),
-                ('LEFTPADDING', (0,0), (-1,-1), 6),
-                ('RIGHTPADDING', (0,0), (-1,-1), 6),
-                ('TOPPADDING', (0,0), (-1,-1), 6),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-            ]))
-
-            story.append(t)
-
-            def header_footer(canvas, doc):
-                canvas.saveState()
-                if os.path.exists(LOGO_PATH):
-                    try:
-                        logo = ImageReader(LOGO_PATH)
-                        img_width, img_height = logo.getSize()
-                        aspect = img_height / float(img_width)
-                        display_width = 1.5 * inch
-                        display_height = display_width * aspect
-                        canvas.drawImage(logo, doc.leftMargin, A4[1] - 1.0 * inch, width=display_width, height=display_height, mask='auto')
-                    except Exception: pass
-
-                now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-                canvas.setFont('Helvetica', 9)
-                canvas.drawRightString(A4[0] - doc.rightMargin, A4[1] - 0.75 * inch, f"Gerado em: {now}")
-                canvas.restoreState()
-
-            doc.build(story, onFirstPage=header_footer, onLaterPages=header_footer)
-            messagebox.showinfo("Sucesso", f"PDF gerado com sucesso em:\n{file_path}", parent=self.root)
+        self._submit_report(lambda: build_interactions_spec(op_data, interactions, file_path))
 
-        except Exception as e:
-            messagebox.showerror("Erro", f"Erro ao gerar PDF: {e}", parent=self.root)
+    def export_interactions_table(self, op_id, interactions, snapshot=None):
+        op_data = snapshot.opportunity if snapshot else self.db.get_opportunity_details(op_id)
+        if not op_data:
+            messagebox.showerror("Erro", "Oportunidade não encontrada!")
+            return
 
-    def export_sumario_executivo_pdf(self, op_id):
-        op_data = self.db.get_opportunity_details(op_id)
+        self._export_spreadsheet(lambda file_path: export_interactions_table(interactions, file_path),
+                                 "Salvar Histórico de Interações",
+                                 f"Interacoes_{op_data['numero_oportunidade']}_{op_data['titulo']}".replace(" ", "_"))
+
+    def export_dataset_dialog(self, name, filters):
+        """Exporta a listagem da tela (com os filtros atuais) para planilha."""
+        title, _ = SPREADSHEET_DATASETS[name]
+        self._export_spreadsheet(lambda file_path: export_dataset(self.db, name, file_path, filters),
+                                 f"Exportar {title}", f"{_safe_filename(title)}_{datetime.now().strftime('%Y%m%d')}")
+
+    def _export_spreadsheet(self, export, dialog_title, initial_name):
+        """Pede o arquivo de destino (formatos disponíveis) e executa a exportação em segundo plano."""
+        formats = available_spreadsheet_formats()
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=formats[0],
+            filetypes=[(SPREADSHEET_FORMATS[ext], f"*{ext}") for ext in formats],
+            title=dialog_title,
+            initialfile=initial_name + formats[0]
+        )
+
+        if not file_path:
+            return
+
+        def worker():
+            try:
+                count = export(file_path)
+                self.root.after(0, lambda: messagebox.showinfo("Sucesso", f"{count} linha(s) exportada(s) para:\n{file_path}"))
+            except Exception as e:
+                print(f"Erro ao exportar planilha: {e}")
+                self.root.after(0, lambda e=e: messagebox.showerror("Erro", f"Erro ao exportar planilha: {e}"))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def export_sumario_executivo_pdf(self, op_id, snapshot=None):
+        snapshot = snapshot or OpportunityAggregate(self.db).load(op_id)
+        op_data = snapshot.opportunity if snapshot else None
         if not op_data:
             messagebox.showerror("Erro", "Oportunidade não encontrada!")
             return
@@ -4900,164 +8594,7 @@ class CRMApp:
         if not file_path:
             return
 
-        try:
-            doc = SimpleDocTemplate(file_path, pagesize=A4,
-                                    rightMargin=72, leftMargin=72,
-                                    topMargin=90, bottomMargin=72) # Increased margins
-            story = []
-            styles = getSampleStyleSheet()
-            styles.add(ParagraphStyle(name='Justify', alignment=4)) # TA_JUSTIFY
-
-            # Title
-            story.append(Paragraph("Sumário Executivo", styles['h1']))
-            story.append(Spacer(1, 12))
-            story.append(Paragraph(f"Oportunidade: {op_data['titulo'] if 'titulo' in op_keys else 'N/A'}", styles['h2']))
-            story.append(Spacer(1, 24))
-
-            # Informações do Edital
-            # Section 1: Informações do Edital
-            edital_content = []
-            edital_content.append(Paragraph("1. Informações do Edital", styles['h3']))
-            edital_content.append(Spacer(1, 12))
-            edital_info_data = [
-                ['Número do Edital:', op_data['numero_edital'] if 'numero_edital' in op_keys and op_data['numero_edital'] else "---"],
-                ['Data de Abertura:', op_data['data_abertura'] if 'data_abertura' in op_keys and op_data['data_abertura'] else "---"],
-                ['Modalidade:', op_data['modalidade'] if 'modalidade' in op_keys and op_data['modalidade'] else "---"],
-                ['Contato Principal:', op_data['contato_principal'] if 'contato_principal' in op_keys and op_data['contato_principal'] else "---"],
-                ['Link dos Documentos:', op_data['link_documentos'] if 'link_documentos' in op_keys and op_data['link_documentos'] else "---"],
-            ]
-            edital_info_table = Table(edital_info_data, colWidths=[1.5*inch, 4.5*inch])
-            edital_info_table.setStyle(TableStyle([
-                ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('FONTNAME', (0,0), (0,-1), 'Helvetica-Bold'), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-            ]))
-            edital_content.append(edital_info_table)
-            story.append(KeepTogether(edital_content))
-            story.append(Spacer(1, 24))
-
-            # Section 2: Informações Financeiras e de Pessoal
-            financeiro_content = []
-            financeiro_content.append(Paragraph("2. Informações Financeiras e de Pessoal", styles['h3']))
-            financeiro_content.append(Spacer(1, 12))
-            financeiro_info_data = [
-                ['Faturamento Estimado:', format_currency(op_data['faturamento_estimado'] if 'faturamento_estimado' in op_keys else None)],
-                ['Duração do Contrato:', f"{op_data['duracao_contrato']} meses" if 'duracao_contrato' in op_keys and op_data['duracao_contrato'] else "---"],
-                ['MOD (Mão de Obra Direta):', op_data['mod'] if 'mod' in op_keys and op_data['mod'] else "---"],
-                ['MOI (Mão de Obra Indireta):', op_data['moi'] if 'moi' in op_keys and op_data['moi'] else "---"],
-                ['Total de Pessoas:', op_data['total_pessoas'] if 'total_pessoas' in op_keys and op_data['total_pessoas'] else "---"],
-                ['Margem de Contribuição:', f"{op_data['margem_contribuicao']}%" if 'margem_contribuicao' in op_keys and op_data['margem_contribuicao'] else "---"],
-            ]
-            financeiro_info_table = Table(financeiro_info_data, colWidths=[2*inch, 4*inch])
-            financeiro_info_table.setStyle(TableStyle([
-                ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('FONTNAME', (0,0), (0,-1), 'Helvetica-Bold'), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-            ]))
-            financeiro_content.append(financeiro_info_table)
-            story.append(KeepTogether(financeiro_content))
-            story.append(Spacer(1, 24))
-
-            # Section 3: Detalhes de Serviços e Preços
-            servicos_content = []
-            servicos_content.append(Paragraph("3. Detalhes de Serviços e Preços", styles['h3']))
-            servicos_content.append(Spacer(1, 12))
-            servicos_data_json = op_data['servicos_data'] if 'servicos_data' in op_keys else None
-            if servicos_data_json:
-                try:
-                    servicos_data = json.loads(servicos_data_json)
-                    if servicos_data:
-                        # Pre-fetch prices for reference companies
-                        empresas_ref = self.db.get_all_empresas_referencia()
-                        empresa_ref_map = {}
-                        for e in empresas_ref:
-                            key = f"{e['nome_empresa']} - {e['estado']} - {e['tipo_servico']}"
-                            empresa_ref_map[key] = e['valor_mensal']
-
-                        for servico_info in servicos_data:
-                            servico_block = [Paragraph(f"<b>Serviço: {servico_info.get('servico_nome', 'N/A')}</b>", styles['h4'])]
-                            equipes = servico_info.get('equipes', [])
-                            if equipes:
-                                equipe_data = [['Tipo de Equipe', 'Qtd', 'Vol.', 'Base', 'Empresa Ref.', 'Valor Total\npor Tipo de Equipe', 'Valor\nUS/UPS/UPE']]
-                                col_widths = [1.2*inch, 0.4*inch, 0.5*inch, 0.6*inch, 1.6*inch, 1.4*inch, 1.2*inch]
-                                for equipe in equipes:
-                                    try:
-                                        qtd = float(str(equipe.get('quantidade', 0)).replace(',', '.'))
-                                    except ValueError: qtd = 0.0
-                                    try:
-                                        vol = float(str(equipe.get('volumetria', 0)).replace(',', '.'))
-                                    except ValueError: vol = 0.0
-
-                                    ref_str = equipe.get('empresa_referencia', '')
-                                    valor_mensal = empresa_ref_map.get(ref_str, 0.0)
-                                    valor_total = valor_mensal * qtd
-                                    valor_unit = valor_total / vol if vol > 0 else 0.0
-
-                                    equipe_data.append([
-                                        Paragraph(equipe.get('tipo_equipe', 'N/A'), styles['BodyText']),
-                                        equipe.get('quantidade', 'N/A'),
-                                        equipe.get('volumetria', 'N/A'),
-                                        equipe.get('base', 'N/A'),
-                                        Paragraph(equipe.get('empresa_referencia', 'N/A'), styles['BodyText']),
-                                        format_currency(valor_total),
-                                        format_currency(valor_unit)
-                                    ])
-                                equipe_table = Table(equipe_data, colWidths=col_widths)
-                                equipe_table.setStyle(TableStyle([
-                                    ('BACKGROUND', (0,0), (-1,0), colors.grey), ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                                    ('ALIGN', (0,0), (-1,-1), 'CENTER'), ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                                    ('BOTTOMPADDING', (0,0), (-1,0), 12), ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-                                    ('GRID', (0,0), (-1,-1), 1, colors.black)
-                                ]))
-                                servico_block.append(equipe_table)
-                            else:
-                                servico_block.append(Paragraph("Nenhuma equipe configurada para este serviço.", styles['BodyText']))
-                            servicos_content.append(KeepTogether(servico_block))
-                            servicos_content.append(Spacer(1, 12))
-                    else:
-                        servicos_content.append(Paragraph("Nenhum serviço configurado.", styles['BodyText']))
-                except (json.JSONDecodeError, TypeError):
-                    servicos_content.append(Paragraph("Erro ao carregar dados de serviços.", styles['BodyText']))
-            else:
-                servicos_content.append(Paragraph("Nenhum serviço configurado.", styles['BodyText']))
-            story.append(KeepTogether(servicos_content))
-            story.append(Spacer(1, 24))
-
-            # Section 4: Descrição Detalhada
-            descricao_content = []
-            descricao_content.append(Paragraph("4. Descrição Detalhada", styles['h3']))
-            descricao_content.append(Spacer(1, 12))
-            descricao = (op_data['descricao_detalhada'] if 'descricao_detalhada' in op_keys and op_data['descricao_detalhada'] else 'Nenhuma descrição fornecida.')
-            descricao_content.append(Paragraph(descricao.replace('\n', '<br/>'), styles['BodyText']))
-            story.append(KeepTogether(descricao_content))
-            story.append(Spacer(1, 48))
-
-            # Header and Footer function
-            def header_footer(canvas, doc):
-                canvas.saveState()
-                # Header
-                if os.path.exists(LOGO_PATH):
-                    try:
-                        logo = ImageReader(LOGO_PATH)
-                        img_width, img_height = logo.getSize()
-                        aspect = img_height / float(img_width)
-                        display_width = 1.5 * inch
-                        display_height = display_width * aspect
-                        canvas.drawImage(logo, doc.leftMargin, A4[1] - 1.0 * inch, width=display_width, height=display_height, mask='auto')
-                    except Exception as e:
-                        print(f"Erro ao desenhar logo no PDF: {e}")
-
-                now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-                canvas.setFont('Helvetica', 9)
-                canvas.drawRightString(A4[0] - doc.rightMargin, A4[1] - 0.75 * inch, f"Gerado em: {now}")
-
-                # Footer (Signature Line)
-                canvas.setFont('Helvetica', 10)
-                canvas.drawString(doc.leftMargin, 0.75 * inch, "_________________________________________")
-                canvas.drawString(doc.leftMargin, 0.5 * inch, "Assinatura da Diretoria")
-                canvas.restoreState()
-
-            doc.build(story, onFirstPage=header_footer, onLaterPages=header_footer)
-            messagebox.showinfo("Sucesso", f"PDF 'Sumário Executivo' gerado com sucesso em:\n{file_path}", parent=self.root)
-
-        except Exception as e:
-            messagebox.showerror("Erro ao Gerar PDF", f"Ocorreu um erro: {e}", parent=self.root)
+        self._submit_report(lambda: build_sumario_executivo_spec(snapshot, file_path))
 
     def export_termo_aditivo_pdf(self, termo_id):
         termo = self.db.get_termo_aditivo_by_id(termo_id)
@@ -5079,135 +8616,81 @@ class CRMApp:
         if not file_path:
             return
 
-        try:
-            doc = SimpleDocTemplate(file_path, pagesize=A4,
-                                    rightMargin=72, leftMargin=72,
-                                    topMargin=90, bottomMargin=72)
-            story = []
-            styles = getSampleStyleSheet()
-            styles.add(ParagraphStyle(name='Justify', alignment=4))
-
-            story.append(Paragraph("Sumário Executivo - Termo Aditivo", styles['h1']))
-            story.append(Spacer(1, 12))
-            story.append(Paragraph(f"Oportunidade: {op_data['titulo']}", styles['h2']))
-            story.append(Spacer(1, 24))
-
-            # Info Básica
-            story.append(Paragraph("1. Informações do Termo", styles['h3']))
-            story.append(Spacer(1, 12))
-            info_data = [
-                ['Número do Termo:', termo['numero_termo']],
-                ['Data Assinatura:', termo['data_assinatura']],
-                ['Tipo de Alteração:', termo['tipo_alteracao']],
-                ['Prazo Adicionado:', f"{termo['prazo_adicionado_meses']} meses"],
-                ['Valor do Aditivo (Capa):', format_currency(termo.get('valor_aditivo_capa', 0))],
-                ['Valor Adicionado Mensal:', format_currency(termo['valor_adicionado_mensal'])],
-                ['Valor Global do Aditivo:', format_currency(termo['valor_global_aditivo'])],
-            ]
-            info_table = Table(info_data, colWidths=[2*inch, 4*inch])
-            info_table.setStyle(TableStyle([
-                ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('FONTNAME', (0,0), (0,-1), 'Helvetica-Bold'), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-            ]))
-            story.append(info_table)
-            story.append(Spacer(1, 24))
-
-            # Services
-            story.append(Paragraph("2. Detalhes de Serviços e Equipes (Aditivo)", styles['h3']))
-            story.append(Spacer(1, 12))
-
-            servicos_data_json = termo['servicos_data']
-            if servicos_data_json:
-                try:
-                    servicos_data = json.loads(servicos_data_json)
-                    if servicos_data:
-                        # Pre-fetch prices
-                        empresas_ref = self.db.get_all_empresas_referencia()
-                        empresa_ref_map = {}
-                        for e in empresas_ref:
-                            key = f"{e['nome_empresa']} - {e['estado']} - {e['tipo_servico']}"
-                            empresa_ref_map[key] = e['valor_mensal']
-
-                        for servico_info in servicos_data:
-                            servico_block = [Paragraph(f"<b>Serviço: {servico_info.get('servico_nome', 'N/A')}</b>", styles['h4'])]
-                            equipes = servico_info.get('equipes', [])
-                            if equipes:
-                                equipe_data = [['Tipo de Equipe', 'Qtd', 'Vol.', 'Base', 'Empresa Ref.', 'Valor Total\npor Tipo de Equipe', 'Valor\nUS/UPS/UPE']]
-                                col_widths = [1.2*inch, 0.4*inch, 0.5*inch, 0.6*inch, 1.6*inch, 1.4*inch, 1.2*inch]
-                                for equipe in equipes:
-                                    try:
-                                        qtd = float(str(equipe.get('quantidade', 0)).replace(',', '.'))
-                                    except ValueError: qtd = 0.0
-                                    try:
-                                        vol = float(str(equipe.get('volumetria', 0)).replace(',', '.'))
-                                    except ValueError: vol = 0.0
-
-                                    ref_str = equipe.get('empresa_referencia', '')
-                                    valor_mensal = empresa_ref_map.get(ref_str, 0.0)
-                                    valor_total = valor_mensal * qtd
-                                    valor_unit = valor_total / vol if vol > 0 else 0.0
-
-                                    equipe_data.append([
-                                        Paragraph(equipe.get('tipo_equipe', 'N/A'), styles['BodyText']),
-                                        equipe.get('quantidade', 'N/A'),
-                                        equipe.get('volumetria', 'N/A'),
-                                        equipe.get('base', 'N/A'),
-                                        Paragraph(equipe.get('empresa_referencia', 'N/A'), styles['BodyText']),
-                                        format_currency(valor_total),
-                                        format_currency(valor_unit)
-                                    ])
-                                equipe_table = Table(equipe_data, colWidths=col_widths)
-                                equipe_table.setStyle(TableStyle([
-                                    ('BACKGROUND', (0,0), (-1,0), colors.grey), ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                                    ('ALIGN', (0,0), (-1,-1), 'CENTER'), ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                                    ('BOTTOMPADDING', (0,0), (-1,0), 12), ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-                                    ('GRID', (0,0), (-1,-1), 1, colors.black)
-                                ]))
-                                servico_block.append(equipe_table)
-                            else:
-                                servico_block.append(Paragraph("Nenhuma equipe configurada.", styles['BodyText']))
-                            story.append(KeepTogether(servico_block))
-                            story.append(Spacer(1, 12))
-                    else:
-                        story.append(Paragraph("Nenhum serviço configurado.", styles['BodyText']))
-                except json.JSONDecodeError:
-                    story.append(Paragraph("Erro nos dados de serviços.", styles['BodyText']))
-            else:
-                story.append(Paragraph("Nenhum serviço configurado.", styles['BodyText']))
-
-            story.append(Spacer(1, 24))
-
-            # Observações
-            story.append(Paragraph("3. Observações", styles['h3']))
-            story.append(Spacer(1, 12))
-            obs = termo['observacoes'] if termo['observacoes'] else "Sem observações."
-            story.append(Paragraph(obs.replace('\n', '<br/>'), styles['BodyText']))
+        def build_spec():
+            try:
+                servicos_data = json.loads(termo['servicos_data']) if termo['servicos_data'] else []
+            except (json.JSONDecodeError, TypeError):
+                servicos_data = []
+            reference_prices = self.db.get_reference_prices(team_table(servicos_data)['empresa_referencia'])
+            return build_termo_aditivo_spec(termo, op_data, reference_prices, file_path)
 
-            def header_footer(canvas, doc):
-                canvas.saveState()
-                if os.path.exists(LOGO_PATH):
-                    try:
-                        logo = ImageReader(LOGO_PATH)
-                        img_width, img_height = logo.getSize()
-                        aspect = img_height / float(img_width)
-                        display_width = 1.5 * inch
-                        display_height = display_width * aspect
-                        canvas.drawImage(logo, doc.leftMargin, A4[1] - 1.0 * inch, width=display_width, height=display_height, mask='auto')
-                    except Exception: pass
-
-                now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-                canvas.setFont('Helvetica', 9)
-                canvas.drawRightString(A4[0] - doc.rightMargin, A4[1] - 0.75 * inch, f"Gerado em: {now}")
-
-                canvas.setFont('Helvetica', 10)
-                canvas.drawString(doc.leftMargin, 0.75 * inch, "_________________________________________")
-                canvas.drawString(doc.leftMargin, 0.5 * inch, "Assinatura da Diretoria")
-                canvas.restoreState()
-
-            doc.build(story, onFirstPage=header_footer, onLaterPages=header_footer)
-            messagebox.showinfo("Sucesso", f"PDF gerado com sucesso em:\n{file_path}", parent=self.root)
+        self._submit_report(build_spec)
 
+    def _submit_report(self, build_spec):
+        """Monta a especificação do relatório e a envia ao ReportService; o PDF é gerado em segundo plano."""
+        try:
+            spec = build_spec()
         except Exception as e:
-            messagebox.showerror("Erro", f"Erro ao gerar PDF: {e}", parent=self.root)
+            messagebox.showerror("Erro ao Gerar PDF", f"Ocorreu um erro: {e}", parent=self.root)
+            return None
+        job_id = self.report_service.submit(spec, on_progress=self._on_report_progress, on_done=self._on_report_done)
+        self._show_report_jobs_panel()
+        self._add_report_job_row(job_id, spec)
+        if not self.report_poll_active:
+            self.report_poll_active = True
+            self.root.after(REPORT_POLL_MS, self._poll_reports)
+        return job_id
+
+    def _poll_reports(self):
+        self.report_service.poll()
+        if self.report_service.pending:
+            self.root.after(REPORT_POLL_MS, self._poll_reports)
+        else:
+            self.report_poll_active = False
+
+    def _show_report_jobs_panel(self):
+        """Janela compacta com os PDFs em geração (não modal: a aplicação continua utilizável)."""
+        if self.report_jobs_win is not None and self.report_jobs_win.winfo_exists():
+            return
+        win = Toplevel(self.root)
+        win.title("Exportações")
+        win.geometry("420x60+40+40")
+        win.configure(bg=DOLP_COLORS['white'])
+        win.resizable(False, False)
+        win.attributes('-topmost', True)
+        self.report_jobs_win = win
+        self.report_job_rows = {}
+
+    def _add_report_job_row(self, job_id, spec):
+        row = ttk.Frame(self.report_jobs_win, style='TFrame', padding=(10, 5))
+        row.pack(fill='x')
+        label = ttk.Label(row, text=f"{spec['title']}: gerando...", style='TLabel', width=45)
+        label.pack(side='left')
+        bar = ttk.Progressbar(row, mode='indeterminate', length=100)
+        bar.pack(side='right')
+        bar.start(15)
+        self.report_job_rows[job_id] = (row, label, bar, spec['title'])
+        self.report_jobs_win.geometry(f"420x{20 + 36 * len(self.report_job_rows)}")
+
+    def _on_report_progress(self, job_id, page):
+        row = self.report_job_rows.get(job_id)
+        if row and row[1].winfo_exists():
+            row[1].config(text=f"{row[3]}: página {page}...")
+
+    def _on_report_done(self, job_id, spec, result, error):
+        row = self.report_job_rows.pop(job_id, None)
+        if row and row[0].winfo_exists():
+            row[0].destroy()
+        if self.report_jobs_win is not None and self.report_jobs_win.winfo_exists():
+            if self.report_job_rows:
+                self.report_jobs_win.geometry(f"420x{20 + 36 * len(self.report_job_rows)}")
+            else:
+                self.report_jobs_win.destroy()
+                self.report_jobs_win = None
+        if error is not None:
+            messagebox.showerror("Erro ao Gerar PDF", f"Ocorreu um erro ao gerar '{spec['title']}': {error}", parent=self.root)
+        else:
+            messagebox.showinfo("Sucesso", f"PDF '{spec['title']}' gerado com sucesso em:\n{result['file_path']}", parent=self.root)
 
     def add_event_dialog(self, op_id, parent_win):
         dialog = Toplevel(parent_win)
@@ -6686,21 +10169,27 @@ class CRMApp:
         tree.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
 
+        def current_filters():
+            selected_user = user_filter.get()
+            return {
+                'start_date': start_date_filter.get() if start_date_filter.get() else None,
+                'end_date': end_date_filter.get() if end_date_filter.get() else None,
+                'user_id': user_map.get(selected_user) if selected_user != 'Todos' else None,
+            }
+
         def apply_filters():
             for item in tree.get_children():
                 tree.delete(item)
 
-            start_date = start_date_filter.get() if start_date_filter.get() else None
-            end_date = end_date_filter.get() if end_date_filter.get() else None
-            selected_user = user_filter.get()
-            user_id = user_map.get(selected_user) if selected_user != 'Todos' else None
-
-            logs = self.db.get_logs(start_date, end_date, user_id)
+            filters = current_filters()
+            logs = self.db.get_logs(filters['start_date'], filters['end_date'], filters['user_id'])
             for log in logs:
                 tree.insert('', 'end', values=log)
 
         # Botão de Aplicar
         ttk.Button(filters_frame, text="🔍 Aplicar Filtros", command=apply_filters, style='Primary.TButton').grid(row=0, column=6, padx=20)
+        ttk.Button(filters_frame, text="📤 Exportar Planilha", style='TButton',
+                   command=lambda: self.export_dataset_dialog('logs', current_filters())).grid(row=0, column=7)
 
         # Carregar logs iniciais
         apply_filters()
@@ -7241,6 +10730,12 @@ class CRMApp:
 
         # Botão de Filtrar
         ttk.Button(filters_frame, text="🔍 Filtrar", style='Primary.TButton', command=apply_filters).grid(row=1, column=4, padx=(20, 0), pady=5)
+        ttk.Button(filters_frame, text="📤 Exportar Planilha", style='TButton',
+                   command=lambda: self.export_dataset_dialog('empresas_referencia', {
+                       'estado': estado_filter.get(), 'tipo_servico': servico_filter.get(),
+                       'concessionaria': concessionaria_filter.get(), 'nome_empresa': empresa_filter.get()})).grid(row=1, column=5, padx=(10, 0), pady=5)
+        ttk.Button(filters_frame, text="📥 Importar Planilha", style='TButton',
+                   command=lambda: self.import_empresas_referencia_dialog(on_imported=self.show_empresa_referencia_view)).grid(row=1, column=6, padx=(10, 0), pady=5)
 
         # Carregar dados iniciais (sem filtros)
         load_data()
@@ -7254,6 +10749,119 @@ class CRMApp:
 
         tree.bind('<Double-1>', on_double_click)
 
+    def import_empresas_referencia_dialog(self, on_imported=None):
+        """Importa uma tabela de preços (.csv/.xlsx): valida e mostra as diferenças antes de gravar."""
+        file_path = filedialog.askopenfilename(
+            parent=self.root, title="Importar Empresas Referência",
+            filetypes=[("Planilhas", "*.xlsx *.csv"), ("Excel", "*.xlsx"), ("CSV", "*.csv")])
+        if not file_path:
+            return
+
+        def worker():
+            try:
+                plan = import_price_table(self.db, file_path)
+                self.root.after(0, lambda: self._show_price_import_plan(plan, file_path, on_imported))
+            except Exception as e:
+                print(f"Erro ao ler planilha de preços: {e}")
+                self.root.after(0, lambda e=e: messagebox.showerror("Erro", f"Erro ao ler planilha de preços: {e}", parent=self.root))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _show_price_import_plan(self, plan, file_path, on_imported=None):
+        """Resumo da importação (simulação) com as linhas que serão inseridas, atualizadas ou que têm erro."""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Importar Empresas Referência")
+        dialog.geometry("1100x600")
+        dialog.configure(bg=DOLP_COLORS['white'])
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        main_frame = ttk.Frame(dialog, padding=20, style='TFrame')
+        main_frame.pack(fill='both', expand=True)
+        ttk.Label(main_frame, text=os.path.basename(file_path), style='TLabel', font=('Segoe UI', 11, 'bold')).pack(anchor='w')
+        ttk.Label(main_frame, style='TLabel', text=(
+            f"{plan['linhas']} linha(s) lida(s) em {plan['segundos']:.1f}s: {len(plan['inserir'])} nova(s), "
+            f"{len(plan['atualizar'])} atualizada(s), {plan['inalteradas']} sem alteração, {len(plan['erros'])} com erro."
+        )).pack(anchor='w', pady=(5, 10))
+
+        # Prévia limitada: o relatório completo pode ser salvo em planilha
+        rows = price_import_report_rows(plan)
+        if len(rows) > PRICE_IMPORT_PREVIEW_ROWS:
+            ttk.Label(main_frame, style='TLabel',
+                      text=f"Exibindo as primeiras {PRICE_IMPORT_PREVIEW_ROWS} de {len(rows)} linhas. Salve o relatório para ver todas.").pack(anchor='w')
+
+        table_frame = ttk.Frame(main_frame, style='TFrame')
+        table_frame.pack(fill='both', expand=True)
+        table_frame.columnconfigure(0, weight=1)
+        table_frame.rowconfigure(0, weight=1)
+        columns = [key for key, _, _ in PRICE_IMPORT_REPORT_COLUMNS]
+        tree = ttk.Treeview(table_frame, columns=columns, show='headings')
+        for key, title, _ in PRICE_IMPORT_REPORT_COLUMNS:
+            tree.heading(key, text=title)
+            tree.column(key, width=360 if key == 'detalhes' else 110, anchor='w' if key == 'detalhes' else 'center')
+        for row in rows[:PRICE_IMPORT_PREVIEW_ROWS]:
+            tree.insert('', 'end', values=[row[key] for key in columns])
+        v_scrollbar = ttk.Scrollbar(table_frame, orient='vertical', command=tree.yview)
+        h_scrollbar = ttk.Scrollbar(table_frame, orient='horizontal', command=tree.xview)
+        tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        tree.grid(row=0, column=0, sticky='nsew')
+        v_scrollbar.grid(row=0, column=1, sticky='ns')
+        h_scrollbar.grid(row=1, column=0, sticky='ew')
+
+        buttons_frame = ttk.Frame(main_frame, style='TFrame')
+        buttons_frame.pack(fill='x', pady=(10, 0))
+
+        def save_report():
+            formats = available_spreadsheet_formats()
+            report_path = filedialog.asksaveasfilename(
+                parent=dialog, defaultextension=formats[0],
+                filetypes=[(SPREADSHEET_FORMATS[ext], f"*{ext}") for ext in formats],
+                title="Salvar Relatório da Importação",
+                initialfile=f"Importacao_Empresas_Referencia_{datetime.now().strftime('%Y%m%d')}{formats[0]}")
+            if not report_path:
+                return
+            try:
+                count = write_price_import_report(plan, report_path)
+                messagebox.showinfo("Sucesso", f"{count} linha(s) salva(s) em:\n{report_path}", parent=dialog)
+            except Exception as e:
+                print(f"Erro ao salvar relatório da importação: {e}")
+                messagebox.showerror("Erro", f"Erro ao salvar relatório da importação: {e}", parent=dialog)
+
+        def on_finished(count=None, error=None):
+            if not dialog.winfo_exists():
+                return
+            if error is not None:
+                import_btn.config(state='normal')
+                messagebox.showerror("Erro", f"Erro ao importar planilha de preços: {error}", parent=dialog)
+                return
+            messagebox.showinfo("Sucesso", f"{count} empresa(s) referência gravada(s).", parent=dialog)
+            dialog.destroy()
+            if on_imported:
+                on_imported()
+
+        def start_import():
+            if plan['erros'].shape[0] and not messagebox.askyesno(
+                    "Confirmar", f"{len(plan['erros'])} linha(s) com erro serão ignoradas. Continuar?", parent=dialog):
+                return
+            import_btn.config(state='disabled')
+
+            def worker():
+                try:
+                    count = apply_price_import(self.db, plan)
+                    self.root.after(0, lambda: on_finished(count=count))
+                except Exception as e:
+                    print(f"Erro ao importar planilha de preços: {e}")
+                    self.root.after(0, lambda e=e: on_finished(error=e))
+
+            threading.Thread(target=worker, daemon=True).start()
+
+        import_btn = ttk.Button(buttons_frame, text="Importar", command=start_import, style='Success.TButton')
+        import_btn.pack(side='right')
+        if plan['inserir'].empty and plan['atualizar'].empty:
+            import_btn.config(state='disabled')
+        ttk.Button(buttons_frame, text="Cancelar", command=dialog.destroy, style='TButton').pack(side='right', padx=(0, 10))
+        ttk.Button(buttons_frame, text="Salvar Relatório", command=save_report, style='TButton').pack(side='left')
+
     def show_empresa_referencia_form(self, empresa_id=None):
         form_win = Toplevel(self.root)
         form_win.title("Nova Empresa Referência" if not empresa_id else "Editar Empresa Referência")
@@ -7458,7 +11066,149 @@ class CRMApp:
         ttk.Button(buttons_frame, text="Excluir Selecionado", command=delete_selected, style='Danger.TButton').pack(side='left')
         ttk.Button(buttons_frame, text="Fechar", command=manager_win.destroy, style='TButton').pack(side='right')
 
-# --- 7. EXECUÇÃO PRINCIPAL ---
+# --- 9. EXECUÇÃO PRINCIPAL ---
+def _export_dataset_job(db_name, name, output, filters):
+    return {'linhas': export_dataset(DatabaseManager(db_name, initialize=False), name, output, filters)}
+
+
+def _export_dashboard_job(db_name, output):
+    return {'linhas': export_dashboard_aggregates(DatabaseManager(db_name, initialize=False), output)}
+
+
+def _cli_historico_filters(args):
+    return {'numero_oportunidade': args.numero, 'cliente': args.cliente, 'estagio': args.estagio,
+            'valor_min': args.valor_min, 'periodo': args.periodo}
+
+
+def _cli_jobs(args):
+    """Lista de trabalhos (nome, tipo, parâmetros) do subcomando informado."""
+    if args.comando in ('sumario', 'analise'):
+        kind = 'sumario_executivo' if args.comando == 'sumario' else 'analise_previa'
+        return [(args.comando, 'pdf', (kind, args.saida, args.consolidado, _cli_historico_filters(args)))]
+    if args.comando == 'planilha':
+        filters = dict(item.split('=', 1) for item in args.filtro)
+        return [(args.listagem, 'planilha', (args.listagem, args.saida, filters))]
+    if args.comando == 'painel':
+        return [('painel', 'painel', (args.saida,))]
+    # noturno: todos os relatórios independentes numa pasta, em paralelo
+    os.makedirs(os.path.join(args.saida, 'sumarios'), exist_ok=True)
+    jobs = [('sumario', 'pdf', ('sumario_executivo', os.path.join(args.saida, 'sumarios'), False, {}))]
+    jobs += [(name, 'planilha', (name, os.path.join(args.saida, f"{name}.{args.formato}"), {})) for name in SPREADSHEET_DATASETS]
+    jobs.append(('painel', 'painel', (os.path.join(args.saida, 'painel.json'),)))
+    return jobs
+
+
+def run_reports_cli(argv):
+    """Relatórios e exportações sem interface gráfica (ex.: cron em servidor sem display).
+
+    Uso: python CRM.py relatorios [--banco ARQ] [--processos N] {sumario,analise,planilha,painel,noturno} ...
+    Imprime um JSON com status e tempo de cada trabalho; código de saída 0 (sucesso), 1 (falha em algum
+    trabalho) ou 2 (argumentos inválidos)."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="CRM.py relatorios", description="Relatórios e exportações do CRM Dolp sem interface gráfica.")
+    parser.add_argument('--banco', default=DB_NAME, help="arquivo do banco SQLite")
+    parser.add_argument('--processos', type=int, default=max(PDF_RENDER_WORKERS, os.cpu_count() or 1), help="processos de trabalho")
+    commands = parser.add_subparsers(dest='comando', required=True)
+
+    for name, help_text in (('sumario', "PDFs do Sumário Executivo"), ('analise', "PDFs da Análise Prévia")):
+        pdf = commands.add_parser(name, help=help_text)
+        pdf.add_argument('--saida', required=True, help="pasta existente, arquivo .zip ou .pdf (com --consolidado)")
+        pdf.add_argument('--consolidado', action='store_true', help="um único PDF com sumário (requer pypdf)")
+        pdf.add_argument('--numero', help="nº da oportunidade (parcial)")
+        pdf.add_argument('--cliente')
+        pdf.add_argument('--estagio')
+        pdf.add_argument('--valor-min', dest='valor_min')
+        pdf.add_argument('--periodo', choices=['Última semana', 'Último mês', 'Últimos 3 meses', 'Último ano'])
+
+    sheet = commands.add_parser('planilha', help="exporta uma listagem para CSV, XLSX ou Parquet")
+    sheet.add_argument('listagem', choices=list(SPREADSHEET_DATASETS))
+    sheet.add_argument('--saida', required=True, help="arquivo .csv, .xlsx ou .parquet")
+    sheet.add_argument('--filtro', action='append', default=[], metavar='CHAVE=VALOR')
+
+    dashboard = commands.add_parser('painel', help="agregados do Dashboard de Análise em JSON")
+    dashboard.add_argument('--saida', required=True)
+
+    nightly = commands.add_parser('noturno', help="todos os relatórios acima numa pasta, em paralelo")
+    nightly.add_argument('--saida', required=True, help="pasta de destino")
+    nightly.add_argument('--formato', choices=['xlsx', 'csv', 'parquet'], default='xlsx')
+
+    args = parser.parse_args(argv)
+    if any('=' not in item for item in getattr(args, 'filtro', [])):
+        parser.error("--filtro deve ter o formato CHAVE=VALOR")
+
+    started = time.perf_counter()
+    DatabaseManager(args.banco)  # Cria/migra o banco uma vez; os processos abrem sem inicializar
+    jobs = _cli_jobs(args)
+    results = []
+
+    with ProcessPoolExecutor(max_workers=args.processos) as executor:
+        executor.submit(int).result()  # Inicia os processos antes das threads de coordenação
+
+        def run(job):
+            name, kind, params = job
+            job_started = time.perf_counter()
+            status = {'trabalho': name, 'tipo': kind}
+            try:
+                if kind == 'pdf':
+                    report_kind, output, merged, filters = params
+                    info = export_report_batch(DatabaseManager(args.banco, initialize=False), filters, [report_kind], output,
+                                               merged=merged, workers=args.processos, executor=executor)
+                    status.update({'saida': output, 'documentos': info['documents'], 'ignorados': info['skipped'], 'paginas': info['pages']})
+                elif kind == 'planilha':
+                    status.update(executor.submit(_export_dataset_job, args.banco, *params).result(), saida=params[1])
+                else:
+                    status.update(executor.submit(_export_dashboard_job, args.banco, *params).result(), saida=params[0])
+                status['status'] = 'ok'
+            except Exception as e:
+                status.update(status='erro', erro=f"{type(e).__name__}: {e}")
+            status['segundos'] = round(time.perf_counter() - job_started, 3)
+            return status
+
+        with ThreadPoolExecutor(max_workers=len(jobs)) as coordinators:
+            results = list(coordinators.map(run, jobs))
+
+    failed = any(result['status'] != 'ok' for result in results)
+    print(json.dumps({'status': 'erro' if failed else 'ok', 'segundos': round(time.perf_counter() - started, 3),
+                      'trabalhos': results}, ensure_ascii=False, indent=2))
+    return 1 if failed else 0
+
+
+def run_cli(argv):
+    """Comandos sem interface gráfica: 'relatorios' (ver run_reports_cli), benchmarks e gravação de feed offline.
+
+    Uso: python CRM.py {relatorios,benchmark-resumos,benchmark-noticias,benchmark-extracao,benchmark-pdf,gravar-feed} ...
+    Retorna o código de saída (argumentos inválidos encerram com 2)."""
+    if argv[:1] == ['relatorios']:
+        return run_reports_cli(argv[1:])
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="CRM.py", description="CRM Dolp. Sem argumentos, abre a interface gráfica.")
+    commands = parser.add_subparsers(dest='comando', required=True)
+    commands.add_parser('relatorios', help="relatórios e exportações sem interface (CRM.py relatorios -h)")
+    commands.add_parser('benchmark-resumos', help="resumo de notícias em lote com modelo simulado")
+    news = commands.add_parser('benchmark-noticias', help="pipeline de notícias completo, offline")
+    news.add_argument('feed', nargs='?', help="feed gravado (.json); padrão: feed sintético")
+    extraction = commands.add_parser('benchmark-extracao', help="extração de texto completa x incremental")
+    extraction.add_argument('fonte', nargs='?', help="pasta com .html ou feed gravado (.json); padrão: cache de páginas")
+    commands.add_parser('benchmark-pdf', help="renderização de um histórico de interações longo")
+    record = commands.add_parser('gravar-feed', help="grava o resultado atual do DuckDuckGo para uso offline")
+    record.add_argument('destino', help="arquivo .json de destino")
+
+    args = parser.parse_args(argv)
+    if args.comando == 'benchmark-resumos':
+        benchmark_news_summaries()
+    elif args.comando == 'benchmark-noticias':
+        benchmark_news_pipeline(args.feed)
+    elif args.comando == 'benchmark-extracao':
+        benchmark_html_extraction(args.fonte)
+    elif args.comando == 'benchmark-pdf':
+        benchmark_pdf_reports()
+    elif args.comando == 'gravar-feed':
+        print(f"{FixtureNewsSource.record(DDGSNewsSource(), args.destino)} notícias gravadas em {args.destino}")
+    return 0
+
+
 def main():
     try:
         # Define o locale para pt_BR para formatação de moeda correta
@@ -7472,10 +11222,14 @@ def main():
             # Fallback final se nenhum locale puder ser definido
             print("Aviso CRÍTICO: Não foi possível definir nenhum locale. A formatação de moeda pode estar incorreta.")
 
+    load_gui_modules()
     root = tk.Tk()
     root.configure(bg=DOLP_COLORS['white'])
     app = CRMApp(root)
     root.mainloop()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     main()
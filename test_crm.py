@@ -0,0 +1,300 @@
+import http.server
+import json
+import os
+import threading
+import time
+import warnings
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import CRM
+
+
+def test_visit_index_with_multi_day_visit():
+    visits = [
+        {'id': 1, 'data_ida': '2024-03-10 08:00:00', 'data_volta': '2024-03-14 18:00:00', 'responsavel_id': 1, 'cliente_id': 1},
+        {'id': 2, 'data_ida': '2024-03-20 08:00:00', 'data_volta': None, 'responsavel_id': 1, 'cliente_id': 2},
+    ]
+    index = CRM.VisitIndex(visits)
+
+    assert [v['id'] for v in index.all()] == [1, 2]
+    assert [v['id'] for v in index.visits_on(date(2024, 3, 12))] == [1]
+    assert [e[2]['id'] for e in index.query_range(date.min, date.max)] == [1, 2]
+
+    scheduler = CRM.VisitScheduler(index.all())
+    new_visit = {'id': None, 'data_ida': '2024-03-13 09:00:00', 'data_volta': '2024-03-13 12:00:00',
+                 'responsavel_id': 1, 'cliente_id': 3}
+    conflicts = scheduler.find_conflicts(new_visit)
+    assert [v['id'] for v in conflicts['responsavel']] == [1]
+    assert conflicts['cliente'] == []
+
+
+def test_csv_export_round_trips_decimals(tmp_path):
+    columns = [('nome_empresa', 'Empresa', 'text'), ('tipo_servico', 'Tipo de Serviço', 'text'),
+               ('valor_mensal', 'Valor Mensal', 'money'), ('volumetria_minima', 'Vol. Mínima', 'float'),
+               ('ano_referencia', 'Ano Ref.', 'int')]
+    rows = [
+        {'nome_empresa': 'Empresa A', 'tipo_servico': 'Manutenção', 'valor_mensal': 1234567.89, 'volumetria_minima': 12.5, 'ano_referencia': 2024},
+        {'nome_empresa': 'Empresa B', 'tipo_servico': 'Perdas', 'valor_mensal': 0.1, 'volumetria_minima': 1000.0, 'ano_referencia': 2023},
+    ]
+    file_path = tmp_path / 'empresas.csv'
+    CRM.write_spreadsheet(columns, [rows], str(file_path))
+
+    header, first = file_path.read_text(encoding='utf-8-sig').splitlines()[:2]
+    assert header.split(';')[2] == 'Valor Mensal'
+    assert first.split(';')[2] == '1234567,89'
+
+    table = CRM.read_price_table(str(file_path))
+    values, invalid = CRM._number_column(table['valor_mensal'])
+    assert values.tolist() == [1234567.89, 0.1]
+    assert not invalid.any()
+    values, invalid = CRM._number_column(table['volumetria_minima'])
+    assert values.tolist() == [12.5, 1000.0]
+    assert not invalid.any()
+
+
+class _ArticleHandler(http.server.BaseHTTPRequestHandler):
+    etag = '"v1"'
+    last_modified = 'Mon, 01 Jan 2024 00:00:00 GMT'
+    body = ("<html><body><article><p>" + "Leilão de transmissão de energia elétrica confirmado pela agência. " * 5
+            + "</p></article></body></html>").encode('utf-8')
+    statuses = []
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.statuses.append(304)
+            self.send_response(304)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+            return
+        self.statuses.append(200)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.send_header('ETag', self.etag)
+        self.send_header('Last-Modified', self.last_modified)
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def article_server():
+    _ArticleHandler.statuses = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _ArticleHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/noticia"
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_cache_miss_hit_and_revalidation(tmp_path, article_server):
+    service = CRM.NewsService(None, sources=[], model=CRM.FakeNewsModel(), rate_limits={'host': (6000, 100)},
+                              cache_dir=str(tmp_path))
+
+    text = service._get_article_text(article_server)
+    assert 'Leilão de transmissão' in text
+    assert service._get_article_text(article_server) == text
+    assert _ArticleHandler.statuses == [200]
+
+    # Entrada vencida: revalida com If-None-Match e recebe 304 sem baixar a página de novo
+    meta_path = service.http_cache._path(service.http_cache.key_for(article_server), 'json')
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    meta['stored_at'] = (datetime.now() - timedelta(hours=CRM.NEWS_CACHE_FRESH_HOURS + 1)).isoformat()
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    assert service._get_article_text(article_server) == text
+    assert _ArticleHandler.statuses == [200, 304]
+
+    # O 304 renovou a entrada: volta a ser usada sem requisição dentro do prazo
+    assert service._get_article_text(article_server) == text
+    assert _ArticleHandler.statuses == [200, 304]
+
+    stats = service.http_cache.stats()
+    assert (stats['misses'], stats['hits'], stats['revalidated']) == (1, 2, 1)
+    assert service.http_cache.get(article_server)['etag'] == _ArticleHandler.etag
+
+
+def test_http_cache_evicts_least_recently_used(tmp_path):
+    cache = CRM.HttpCache(str(tmp_path), max_bytes=10_000)
+    urls = [f"http://example.com/noticia-{i}" for i in range(3)]
+    for position, url in enumerate(urls):
+        cache.put(url, b'x' * 3000, 'texto')
+        stamp = time.time() - 100 + position
+        os.utime(cache._path(cache.key_for(url), 'json'), (stamp, stamp))
+
+    assert cache.get(urls[0]) is not None  # Leitura torna a primeira a mais recente
+    cache.put("http://example.com/noticia-3", b'x' * 3000, 'texto')
+
+    assert cache.get(urls[1]) is None
+    assert cache.get(urls[0]) is not None and cache.get(urls[2]) is not None
+    assert cache.total_bytes <= cache.max_bytes
+
+
+@pytest.fixture
+def db(tmp_path):
+    return CRM.DatabaseManager(str(tmp_path / 'crm.db'))
+
+
+PRICE_HEADER = "Empresa;Tipo de Serviço;Tipo de Equipe;UF;Concessionária;Ano Ref.;Valor Mensal;Ativa"
+
+
+def _write_lines(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+    return str(path)
+
+
+def test_number_column_parses_brazilian_and_plain_formats():
+    values, invalid = CRM._number_column(pd.Series(['1.234,56', 'R$ 1234.56', 'R$ 1.234,56', '1.234', '', 'abc', 1500.0], dtype=object))
+    assert values.tolist()[:5] == [1234.56, 1234.56, 1234.56, 1234.0, 0.0]
+    assert values.iloc[6] == 1500.0
+    assert invalid.tolist() == [False, False, False, False, False, True, False]
+
+
+def test_plan_price_import_validates_rows(db, tmp_path):
+    servico_id = next(s['id'] for s in db.get_all_servicos() if s['nome'] == 'Atendimento Emergencial')
+    db.add_team_type({'nome': 'Equipe Leve', 'servico_id': servico_id, 'ativa': 1})
+    path = _write_lines(tmp_path / 'precos.csv', [
+        PRICE_HEADER,
+        "Emp A;Atendimento Emergencial;Equipe Leve;SP;;2024;1.234,56;Sim",
+        "Emp A;atendimento emergencial;equipe leve;sp;;2024;999;Sim",
+        "",
+        "Emp B;Serviço Inexistente;;SP;;2024;100;",
+        "Emp C;Atendimento Emergencial;;XX;;2024;100;",
+        "Emp D;Atendimento Emergencial;;RJ;;2024;abc;",
+    ])
+
+    plan = CRM.plan_price_import(db, CRM.read_price_table(path))
+
+    inserted = plan['inserir'].set_index('linha')
+    assert inserted.index.tolist() == [2]
+    assert inserted.loc[2, 'valor_mensal'] == 1234.56
+    assert inserted.loc[2, 'tipo_equipe_id'] == db.get_all_team_types()[0]['id']
+    errors = dict(zip(plan['erros']['linha'], plan['erros']['detalhes']))
+    assert errors == {
+        3: "chave repetida na planilha (linha 2)",
+        5: "tipo de serviço não cadastrado",
+        6: "UF inválida",
+        7: "valor_mensal não numérico",
+    }
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.xlsx'])
+def test_price_import_of_an_export_is_unchanged(db, tmp_path, extension):
+    if extension == '.xlsx' and CRM.Workbook is None:
+        pytest.skip("openpyxl não instalado")
+    base = {'tipo_servico': 'Perdas', 'tipo_equipe_id': None, 'volumetria_minima': 10, 'valor_por_pessoa': 1500.5,
+            'valor_us_ups_upe_ponto': None, 'ativa': 1, 'estado': 'SP', 'concessionaria': None, 'ano_referencia': '2024', 'observacoes': None}
+    db.add_empresa_referencia(dict(base, nome_empresa='Emp A', valor_mensal=1000.25))
+    # Chave já repetida no cadastro: a exportação traz as duas linhas
+    db.add_empresa_referencia(dict(base, nome_empresa='Emp A', valor_mensal=2000.75))
+    db.add_empresa_referencia(dict(base, nome_empresa='Emp B', valor_mensal=300.0, ativa=0, estado='RJ'))
+
+    path = str(tmp_path / f'empresas{extension}')
+    CRM.export_dataset(db, 'empresas_referencia', path, {})
+    plan = CRM.import_price_table(db, path)
+
+    assert (len(plan['inserir']), len(plan['atualizar']), len(plan['erros']), plan['inalteradas']) == (0, 0, 0, 3)
+
+
+def _forecast_frame(rows):
+    columns = ['oportunidade_id', 'estagio', 'valor', 'faturamento_estimado', 'duracao_contrato', 'tempo_contrato_meses', 'data_abertura']
+    return pd.DataFrame([dict(zip(columns, row)) for row in rows], columns=columns)
+
+
+def test_forecast_starts_at_opening_month():
+    ops = _forecast_frame([(1, 'Negociação', 1200.0, None, 12, None, '2025-03-10')])
+    curve, totals = CRM.forecast_revenue(ops, {'Negociação': 0.5}, start='2025-01', horizon_months=6)
+    assert totals.index.tolist() == ['2025-01', '2025-02', '2025-03', '2025-04', '2025-05', '2025-06']
+    assert totals['receita_bruta'].tolist() == [0, 0, 100, 100, 100, 100]
+    assert totals['receita_esperada'].tolist() == [0, 0, 50, 50, 50, 50]
+    assert curve.columns.tolist() == ['Negociação']
+
+
+def test_forecast_clips_long_contracts_at_the_horizon():
+    ops = _forecast_frame([(1, 'Negociação', 1.2e6, None, 1200000, None, '2020-01-01')])
+    _, totals = CRM.forecast_revenue(ops, {'Negociação': 1.0}, start='2025-01', horizon_months=3)
+    assert totals['receita_bruta'].tolist() == [1.0, 1.0, 1.0]
+
+
+def test_forecast_handles_zero_and_missing_durations():
+    ops = _forecast_frame([
+        (1, 'Negociação', 500.0, None, 0.3, None, None),    # arredonda para 0 meses: fatura em um mês
+        (2, 'Negociação', 1200.0, None, None, None, None),  # sem prazo: FORECAST_DEFAULT_DURATION_MONTHS
+        (3, 'Histórico', 9999.0, None, 12, None, None),     # estágio sem probabilidade: fora da previsão
+    ])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        _, totals = CRM.forecast_revenue(ops, {'Negociação': 1.0}, start='2025-01', horizon_months=2)
+    assert totals['receita_bruta'].tolist() == [600.0, 100.0]
+
+
+def test_learned_win_probabilities_uses_closed_opportunities():
+    transitions = pd.DataFrame([
+        (1, 'Negociação', 'Avaliação do Contrato'), (1, 'Avaliação do Contrato', CRM.CONTRACT_EXECUTION_STAGE),
+        (2, 'Negociação', 'Cancelada'),
+        (3, 'Proposta Comercial', 'Negociação'),
+    ], columns=['oportunidade_id', 'estagio_origem', 'estagio_destino'])
+    opportunities = pd.DataFrame([(1, CRM.CONTRACT_EXECUTION_STAGE), (2, 'Cancelada'), (3, 'Negociação')],
+                                 columns=['oportunidade_id', 'estagio_atual'])
+    learned = CRM.learned_win_probabilities(transitions, opportunities, min_samples=2)
+    assert learned['Negociação'] == 0.5
+    assert learned['Avaliação do Contrato'] == CRM.STAGE_WIN_PROBABILITIES['Avaliação do Contrato']  # só 1 encerrada
+
+
+def test_parse_movement_summaries_with_and_without_result():
+    parsed = CRM.parse_movement_summaries(pd.Series([
+        "Movida de 'Oportunidades' para 'Negociação' - Resultado: Ganho",
+        "Movida de 'Negociação' para 'Cancelada'",
+        "Reunião com o cliente",
+    ]))
+    assert parsed.iloc[0].tolist() == ['Oportunidades', 'Negociação', 'Ganho']
+    assert parsed.iloc[1, :2].tolist() == ['Negociação', 'Cancelada'] and pd.isna(parsed.iloc[1, 2])
+    assert parsed.iloc[2].isna().all()
+
+
+def test_backfill_converts_movement_interactions(db):
+    with db._connect() as conn:
+        cliente_id = conn.execute("INSERT INTO clientes (nome_empresa) VALUES ('Cliente')").lastrowid
+        estagio_id = conn.execute("SELECT id FROM pipeline_estagios WHERE nome = 'Negociação'").fetchone()['id']
+        op_id = conn.execute("INSERT INTO oportunidades (numero_oportunidade, titulo, cliente_id, estagio_id, data_criacao) VALUES ('OPP-1', 'Teste', ?, ?, '2025-01-01')",
+                             (cliente_id, estagio_id)).lastrowid
+        for when, resumo in (('2025-01-05 10:00:00', "Movida de 'Oportunidades' para 'Proposta Comercial' - Resultado: Em andamento"),
+                             ('10/01/2025 09:30', "Movida de 'Proposta Comercial' para 'Negociação'"),
+                             ('2025-01-12 08:00:00', "Ajuste manual do estágio")):
+            conn.execute("INSERT INTO crm_interacoes (oportunidade_id, data_interacao, tipo, resumo, usuario) VALUES (?, ?, 'Movimentação', ?, 'ana')",
+                         (op_id, when, resumo))
+        assert db._backfill_stage_transitions(conn) == 2
+        assert db._backfill_stage_transitions(conn) == 0
+
+    transitions = db.get_stage_transitions()
+    assert transitions[['estagio_origem', 'estagio_destino']].values.tolist() == [
+        ['Oportunidades', 'Proposta Comercial'], ['Proposta Comercial', 'Negociação']]
+    assert transitions['resultado'].iloc[0] == 'Em andamento' and pd.isna(transitions['resultado'].iloc[1])
+    assert transitions['data_transicao'].tolist() == ['2025-01-05 10:00:00', '2025-01-10 09:30:00']
+
+
+def test_stage_stays_ages_open_stays_until_now():
+    transitions = pd.DataFrame([
+        (1, 'Oportunidades', 'Negociação', '2025-01-05 00:00:00'),
+        (2, 'Oportunidades', 'Cancelada', '2025-01-03 00:00:00'),
+    ], columns=['oportunidade_id', 'estagio_origem', 'estagio_destino', 'data_transicao'])
+    opportunities = pd.DataFrame([(1, '2025-01-01', 'Negociação'), (2, '2025-01-01', 'Cancelada')],
+                                 columns=['oportunidade_id', 'data_criacao', 'estagio_atual'])
+
+    stays = CRM.stage_stays(transitions, opportunities, now=datetime(2025, 1, 15))
+
+    closed = stays[~stays['em_aberto']].set_index('oportunidade_id')
+    assert closed.loc[1, 'estagio'] == 'Oportunidades' and closed.loc[1, 'dias'] == 4
+    assert closed.loc[2, 'dias'] == 2
+    still_open = stays[stays['em_aberto']]
+    assert still_open['oportunidade_id'].tolist() == [1]  # encerrada (Cancelada) não fica em aberto
+    assert still_open['estagio'].iloc[0] == 'Negociação' and still_open['dias'].iloc[0] == 10
+    summary = CRM.time_in_stage(stays)
+    assert summary.loc['Negociação', 'em_aberto'] == 1 and summary.loc['Negociação', 'idade_media_em_aberto'] == 10